@@ -0,0 +1,16 @@
+from django.contrib import admin
+from .models import Agendamento, VagaHorario
+
+
+@admin.register(Agendamento)
+class AgendamentoAdmin(admin.ModelAdmin):
+    list_display = ('loja', 'usuario', 'produto', 'data_hora', 'status')
+    list_filter = ('status', 'loja')
+    search_fields = ('usuario__username', 'loja__nome')
+
+
+@admin.register(VagaHorario)
+class VagaHorarioAdmin(admin.ModelAdmin):
+    list_display = ('loja', 'inicio', 'ocupadas')
+    list_filter = ('loja',)
+    date_hierarchy = 'inicio'
@@ -0,0 +1,141 @@
+"""
+Cálculo dos horários livres para agendamento.
+
+Os horários candidatos começam na abertura da loja e andam de
+``PASSO_MINUTOS`` em ``PASSO_MINUTOS``; um horário serve se o serviço
+inteiro (``Produto.duracao_minutos``) cabe antes do fechamento e se, em
+nenhum momento desse intervalo, a loja já tem
+``Loja.capacidade_agendamentos`` atendimentos marcados.
+
+Os intervalos são contados na grade de ``PASSO_MINUTOS`` (ver
+``faixa_das_vagas``), como as vagas de ``agendamento.reservas``: um
+agendamento fora do passo ocupa os intervalos da grade que toca.
+
+Os agendamentos do período inteiro são lidos numa única consulta por
+faixa de data e montados numa ``Ocupacao``: uma função em degraus com o
+número de atendimentos simultâneos, consultada por busca binária.
+"""
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import accumulate
+
+from django.utils import timezone
+
+from produto.consts import DURACAO_MAXIMA_SERVICO
+
+from .models import DURACAO_PADRAO_MINUTOS, STATUS_ATIVOS, Agendamento
+
+PASSO_MINUTOS = 30
+MAXIMO_DIAS = 31
+# A grade dos intervalos: múltiplos de PASSO_MINUTOS a partir da meia-noite UTC
+_ORIGEM_GRADE = datetime(2000, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def duracao_do_servico(produto):
+    return timedelta(minutes=getattr(produto, 'duracao_minutos', None) or DURACAO_PADRAO_MINUTOS)
+
+
+def faixa_das_vagas(data_hora, duracao):
+    """
+    [inicio, fim) dos intervalos da grade de ``PASSO_MINUTOS`` ocupados
+    por um serviço de ``duracao`` que começa em ``data_hora``.
+    """
+    passo = timedelta(minutes=PASSO_MINUTOS)
+    inicio = data_hora - (data_hora - _ORIGEM_GRADE) % passo
+    fim = data_hora + duracao
+    fim += (_ORIGEM_GRADE - fim) % passo
+    return inicio, max(fim, inicio + passo)
+
+
+class Ocupacao:
+    """
+    Número de atendimentos em andamento ao longo do tempo, montado a
+    partir de uma lista de intervalos [inicio, fim).
+    """
+
+    def __init__(self, intervalos):
+        eventos = {}
+        for inicio, fim in intervalos:
+            eventos[inicio] = eventos.get(inicio, 0) + 1
+            eventos[fim] = eventos.get(fim, 0) - 1
+        self.instantes = sorted(eventos)
+        # niveis[i]: ocupação a partir de instantes[i] (até o próximo)
+        self.niveis = list(accumulate(eventos[instante] for instante in self.instantes))
+
+    def maximo(self, inicio, fim):
+        """
+        Maior ocupação em algum momento do intervalo [inicio, fim).
+        """
+        primeiro = max(bisect_right(self.instantes, inicio) - 1, 0)
+        ultimo = bisect_left(self.instantes, fim)
+        return max(self.niveis[primeiro:ultimo], default=0)
+
+
+def _intervalos_ocupados(loja, inicio, fim):
+    """
+    Intervalos dos agendamentos ativos da loja que tocam [inicio, fim),
+    lidos numa única consulta.
+    """
+    # Um agendamento iniciado antes do período ainda pode ocupar o começo
+    # dele (com o alinhamento à grade, até um passo a mais)
+    agendamentos = Agendamento.objects.filter(
+        loja=loja,
+        status__in=STATUS_ATIVOS,
+        data_hora__gte=inicio - timedelta(minutes=DURACAO_MAXIMA_SERVICO + PASSO_MINUTOS),
+        data_hora__lt=fim + timedelta(minutes=PASSO_MINUTOS),
+    ).values_list('data_hora', 'duracao_minutos')
+    return [faixa_das_vagas(data_hora, timedelta(minutes=duracao)) for data_hora, duracao in agendamentos]
+
+
+def _expediente(loja, dia, fuso):
+    abertura = timezone.make_aware(datetime.combine(dia, loja.horario_abertura), fuso)
+    if loja.horario_fechamento > loja.horario_abertura:
+        fechamento = timezone.make_aware(datetime.combine(dia, loja.horario_fechamento), fuso)
+    else:
+        # Fecha depois da meia-noite (ou funciona 24h)
+        fechamento = timezone.make_aware(datetime.combine(dia + timedelta(days=1), loja.horario_fechamento), fuso)
+    return abertura, fechamento
+
+
+def horarios_livres(loja, produto, primeiro_dia, dias=7, agora=None):
+    """
+    Retorna os horários livres da loja para o serviço, dia a dia:
+    ``[(dia, [(inicio, fim, vagas), ...]), ...]``.
+    """
+    dias = max(1, min(dias, MAXIMO_DIAS))
+    agora = agora or timezone.now()
+    fuso = timezone.get_current_timezone()
+    duracao = duracao_do_servico(produto)
+    passo = timedelta(minutes=PASSO_MINUTOS)
+    capacidade = loja.capacidade_agendamentos
+
+    expedientes = [
+        (primeiro_dia + timedelta(days=i),) + _expediente(loja, primeiro_dia + timedelta(days=i), fuso)
+        for i in range(dias)
+    ]
+    ocupacao = Ocupacao(_intervalos_ocupados(loja, expedientes[0][1], expedientes[-1][2]))
+
+    resultado = []
+    for dia, abertura, fechamento in expedientes:
+        horarios = []
+        inicio = abertura
+        while inicio + duracao <= fechamento:
+            if inicio >= agora:
+                vagas = capacidade - ocupacao.maximo(*faixa_das_vagas(inicio, duracao))
+                if vagas > 0:
+                    horarios.append((inicio, inicio + duracao, vagas))
+            inicio += passo
+        resultado.append((dia, horarios))
+    return resultado
+
+
+def horario_disponivel(loja, produto, data_hora):
+    """
+    Indica se o serviço pode ser agendado na loja exatamente em ``data_hora``.
+    """
+    dia = timezone.localtime(data_hora).date()
+    # O horário pode pertencer ao expediente do dia anterior, se a loja fecha depois da meia-noite
+    for _, horarios in horarios_livres(loja, produto, dia - timedelta(days=1), dias=2):
+        if any(inicio == data_hora for inicio, _, _ in horarios):
+            return True
+    return False
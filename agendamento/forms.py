@@ -1,25 +1,27 @@
 from django.utils import timezone
 from django import forms
 from .models import Agendamento
-from produto.models import Produto, Categoria
+from .disponibilidade import horario_disponivel
+from loja.models import Loja
+from loja.cache import categoria_por_nome
+from produto.models import Produto
 
 class AgendamentoForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         loja_id = kwargs.pop('loja_id', None)
         super().__init__(*args, **kwargs)
+        self.loja_id = loja_id
         self.fields['produto'].queryset = Produto.objects.none()
         if loja_id:
-            try:
-                # Filtra os produtos para mostrar apenas os que são da categoria 'Serviços'
-                categoria_servicos = Categoria.objects.get(nome='Serviço')
+            # Filtra os produtos para mostrar apenas os que são da categoria 'Serviços'
+            categoria_servicos = categoria_por_nome('Serviço')
+            # Se a categoria 'Serviços' não existir, o queryset continua vazio.
+            if categoria_servicos is not None:
                 self.fields['produto'].queryset = Produto.objects.filter(
                     loja_id=loja_id,
                     disponivel=True,
                     categoria=categoria_servicos
                 ).order_by('nome')
-            except Categoria.DoesNotExist:
-                # Se a categoria 'Serviços' não existir, o queryset continua vazio.
-                pass
 
         # Melhora a experiência do usuário se não houver serviços
         if not self.fields['produto'].queryset.exists():
@@ -38,4 +40,14 @@ class AgendamentoForm(forms.ModelForm):
         data_hora = self.cleaned_data.get('data_hora')
         if data_hora and data_hora < timezone.now():
             raise forms.ValidationError("A data e hora do agendamento não podem ser no passado.")
-        return data_hora
\ No newline at end of file
+        return data_hora
+
+    def clean(self):
+        cleaned_data = super().clean()
+        data_hora = cleaned_data.get('data_hora')
+        if data_hora and self.loja_id and not self.has_error('data_hora'):
+            loja = Loja.objects.filter(pk=self.loja_id).first()
+            # O horário precisa estar na grade da loja e ter vaga para o serviço inteiro
+            if loja and not horario_disponivel(loja, cleaned_data.get('produto'), data_hora):
+                self.add_error('data_hora', "Este horário não está disponível. Escolha um dos horários livres.")
+        return cleaned_data
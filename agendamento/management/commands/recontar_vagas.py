@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from agendamento.reservas import reconstruir_vagas
+
+
+class Command(BaseCommand):
+    help = "Recalcula as vagas ocupadas de cada horário a partir dos agendamentos ativos."
+
+    def handle(self, *args, **options):
+        total = reconstruir_vagas()
+        self.stdout.write(self.style.SUCCESS(f"{total} intervalo(s) ocupado(s)."))
@@ -0,0 +1,56 @@
+import math
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Cópia de agendamento.disponibilidade e agendamento.reservas no momento
+# desta migração (a migração não deve depender do código atual)
+PASSO_MINUTOS = 30
+DURACAO_PADRAO_MINUTOS = 30
+
+
+def inicios_das_vagas(data_hora, duracao):
+    passo = timedelta(minutes=PASSO_MINUTOS)
+    return [data_hora + passo * i for i in range(max(1, math.ceil(duracao / passo)))]
+
+
+def preencher_vagas(apps, schema_editor):
+    Agendamento = apps.get_model('agendamento', 'Agendamento')
+    VagaHorario = apps.get_model('agendamento', 'VagaHorario')
+    ocupadas = {}
+    agendamentos = Agendamento.objects.filter(status__in=('PENDENTE', 'CONFIRMADO'))
+    for loja_id, data_hora, duracao in agendamentos.values_list('loja_id', 'data_hora', 'produto__duracao_minutos').iterator():
+        for inicio in inicios_das_vagas(data_hora, timedelta(minutes=duracao or DURACAO_PADRAO_MINUTOS)):
+            ocupadas[loja_id, inicio] = ocupadas.get((loja_id, inicio), 0) + 1
+    VagaHorario.objects.bulk_create(
+        [VagaHorario(loja_id=loja_id, inicio=inicio, ocupadas=total) for (loja_id, inicio), total in ocupadas.items()],
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamento', '0001_initial'),
+        ('loja', '0017_loja_capacidade_agendamentos'),
+        ('produto', '0006_produto_duracao_minutos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VagaHorario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('inicio', models.DateTimeField()),
+                ('ocupadas', models.PositiveSmallIntegerField(default=0)),
+                ('loja', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vagas_horario', to='loja.loja')),
+            ],
+            options={
+                'verbose_name': 'Vaga de Horário',
+                'verbose_name_plural': 'Vagas de Horário',
+                'unique_together': {('loja', 'inicio')},
+            },
+        ),
+        migrations.RunPython(preencher_vagas, migrations.RunPython.noop),
+    ]
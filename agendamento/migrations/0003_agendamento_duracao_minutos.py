@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta, timezone
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+# Cópia de agendamento.disponibilidade e agendamento.reservas no momento
+# desta migração (a migração não deve depender do código atual)
+PASSO_MINUTOS = 30
+DURACAO_PADRAO_MINUTOS = 30
+_ORIGEM_GRADE = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+
+def faixa_das_vagas(data_hora, duracao):
+    passo = timedelta(minutes=PASSO_MINUTOS)
+    inicio = data_hora - (data_hora - _ORIGEM_GRADE) % passo
+    fim = data_hora + duracao
+    fim += (_ORIGEM_GRADE - fim) % passo
+    return inicio, max(fim, inicio + passo)
+
+
+def inicios_das_vagas(data_hora, duracao):
+    passo = timedelta(minutes=PASSO_MINUTOS)
+    inicio, fim = faixa_das_vagas(data_hora, duracao)
+    return [inicio + passo * i for i in range((fim - inicio) // passo)]
+
+
+def copiar_duracoes(apps, schema_editor):
+    Agendamento = apps.get_model('agendamento', 'Agendamento')
+    Produto = apps.get_model('produto', 'Produto')
+    duracao = Produto.objects.filter(pk=OuterRef('produto_id')).values('duracao_minutos')[:1]
+    Agendamento.objects.update(duracao_minutos=Coalesce(Subquery(duracao), DURACAO_PADRAO_MINUTOS))
+
+
+def reconstruir_vagas(apps, schema_editor):
+    # As vagas passam a ser contadas na grade de PASSO_MINUTOS
+    Agendamento = apps.get_model('agendamento', 'Agendamento')
+    VagaHorario = apps.get_model('agendamento', 'VagaHorario')
+    ocupadas = {}
+    agendamentos = Agendamento.objects.filter(status__in=('PENDENTE', 'CONFIRMADO'))
+    for loja_id, data_hora, duracao in agendamentos.values_list('loja_id', 'data_hora', 'duracao_minutos').iterator():
+        for inicio in inicios_das_vagas(data_hora, timedelta(minutes=duracao)):
+            ocupadas[loja_id, inicio] = ocupadas.get((loja_id, inicio), 0) + 1
+    VagaHorario.objects.all().delete()
+    VagaHorario.objects.bulk_create(
+        [VagaHorario(loja_id=loja_id, inicio=inicio, ocupadas=total) for (loja_id, inicio), total in ocupadas.items()],
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agendamento', '0002_vagahorario'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agendamento',
+            name='duracao_minutos',
+            field=models.PositiveSmallIntegerField(editable=False, null=True, verbose_name='Duração (minutos)'),
+        ),
+        migrations.RunPython(copiar_duracoes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='agendamento',
+            name='duracao_minutos',
+            field=models.PositiveSmallIntegerField(editable=False, verbose_name='Duração (minutos)'),
+        ),
+        migrations.RunPython(reconstruir_vagas, migrations.RunPython.noop),
+    ]
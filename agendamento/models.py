@@ -0,0 +1,100 @@
+from datetime import timedelta
+
+from django.db import models
+from django.contrib.auth.models import User
+
+from loja.models import Loja
+from produto.models import Produto
+
+# Agendamentos que ainda ocupam o horário
+STATUS_ATIVOS = ('PENDENTE', 'CONFIRMADO')
+# Duração dos agendamentos sem serviço
+DURACAO_PADRAO_MINUTOS = 30
+
+
+class Agendamento(models.Model):
+    """
+    Agendamento de um serviço de uma loja feito por um cliente.
+    """
+    STATUS_CHOICES = [
+        ('PENDENTE', 'Pendente'),
+        ('CONFIRMADO', 'Confirmado'),
+        ('CONCLUIDO', 'Concluído'),
+        ('CANCELADO', 'Cancelado'),
+    ]
+
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='agendamentos')
+    loja = models.ForeignKey(Loja, on_delete=models.CASCADE, related_name='agendamentos')
+    produto = models.ForeignKey(
+        Produto, on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='agendamentos', verbose_name="Serviço"
+    )
+    data_hora = models.DateTimeField(verbose_name="Data e Hora")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDENTE')
+    observacoes = models.TextField(blank=True, null=True, verbose_name="Observações")
+    criado_em = models.DateTimeField(auto_now_add=True)
+    # Copiada do serviço ao agendar: mudar a duração do serviço depois não
+    # muda o horário (nem as vagas) já reservado
+    duracao_minutos = models.PositiveSmallIntegerField(editable=False, verbose_name="Duração (minutos)")
+
+    class Meta:
+        verbose_name = "Agendamento"
+        verbose_name_plural = "Agendamentos"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Guarda o horário ocupado para acertar as vagas quando ele muda
+        campos = ('status', 'loja_id', 'data_hora', 'duracao_minutos')
+        if all(campo in instance.__dict__ for campo in campos):
+            instance._vaga_salva = instance.vaga()
+        if 'produto_id' in instance.__dict__:
+            instance._produto_salvo = instance.produto_id
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Sem duração ainda, ou trocou de serviço: usa a do serviço atual
+        if self.duracao_minutos is None or self.produto_id != getattr(self, '_produto_salvo', self.produto_id):
+            self.definir_duracao()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'duracao_minutos'}
+        super().save(*args, **kwargs)
+        self._produto_salvo = self.produto_id
+
+    def definir_duracao(self):
+        self.duracao_minutos = getattr(self.produto, 'duracao_minutos', None) or DURACAO_PADRAO_MINUTOS
+
+    def duracao(self):
+        return timedelta(minutes=self.duracao_minutos)
+
+    def vaga(self):
+        """
+        (loja, data_hora, duração em minutos) do horário que o agendamento
+        ocupa, ou None se ele não ocupa mais horário (cancelado ou
+        concluído).
+        """
+        if self.status not in STATUS_ATIVOS:
+            return None
+        return (self.loja_id, self.data_hora, self.duracao_minutos)
+
+    def __str__(self):
+        return f"{self.usuario.username} - {self.loja.nome} ({self.data_hora:%d/%m/%Y %H:%M})"
+
+
+class VagaHorario(models.Model):
+    """
+    Quantos atendimentos a loja já tem num intervalo de ``PASSO_MINUTOS``
+    a partir de ``inicio``. Cada agendamento ocupa uma vaga em todos os
+    intervalos que o serviço cobre (ver ``agendamento.reservas``).
+    """
+    loja = models.ForeignKey(Loja, on_delete=models.CASCADE, related_name='vagas_horario')
+    inicio = models.DateTimeField()
+    ocupadas = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('loja', 'inicio')
+        verbose_name = "Vaga de Horário"
+        verbose_name_plural = "Vagas de Horário"
+
+    def __str__(self):
+        return f"{self.loja_id} {self.inicio:%d/%m/%Y %H:%M}: {self.ocupadas}"
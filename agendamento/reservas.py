@@ -0,0 +1,116 @@
+"""
+Reserva de horários sem agendamento duplo.
+
+Cada agendamento ocupa uma vaga em todos os intervalos da grade de
+``PASSO_MINUTOS`` que o serviço cobre (``VagaHorario``), pela duração
+guardada no próprio agendamento. A reserva soma 1 a essas vagas com um
+único UPDATE condicional (``ocupadas < capacidade``) e só grava o
+agendamento se todas foram obtidas; senão a transação é desfeita. A disputa fica nas linhas dos intervalos pedidos: clientes em
+horários diferentes não esperam uns pelos outros (no SQLite, que tem um
+único escritor, as transações ainda entram em fila, mas são curtas e não
+leem nada antes de escrever).
+
+As mudanças feitas fora da reserva (cancelamento, troca de horário ou
+exclusão pelo admin) são acertadas pelos sinais de ``Agendamento``.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+
+from .disponibilidade import PASSO_MINUTOS, faixa_das_vagas
+from .models import STATUS_ATIVOS, Agendamento, VagaHorario
+
+
+class HorarioIndisponivel(Exception):
+    """
+    O horário pedido já atingiu a capacidade de atendimentos da loja.
+    """
+
+
+def inicios_das_vagas(data_hora, duracao):
+    """
+    Inícios dos intervalos da grade de ``PASSO_MINUTOS`` ocupados por um
+    serviço de ``duracao`` que começa em ``data_hora``.
+    """
+    passo = timedelta(minutes=PASSO_MINUTOS)
+    inicio, fim = faixa_das_vagas(data_hora, duracao)
+    return [inicio + passo * i for i in range((fim - inicio) // passo)]
+
+
+def _inicios_da_vaga(vaga):
+    _, data_hora, duracao = vaga
+    return inicios_das_vagas(data_hora, timedelta(minutes=duracao))
+
+
+def ocupar_vagas(loja_id, inicios, capacidade=None):
+    """
+    Soma um atendimento em cada intervalo. Com ``capacidade``, só conta os
+    intervalos abaixo dela e retorna se todos foram obtidos; quem chama
+    deve desfazer a transação quando não foram.
+    """
+    VagaHorario.objects.bulk_create(
+        [VagaHorario(loja_id=loja_id, inicio=inicio) for inicio in inicios],
+        ignore_conflicts=True,
+    )
+    vagas = VagaHorario.objects.filter(loja_id=loja_id, inicio__in=inicios)
+    if capacidade is not None:
+        vagas = vagas.filter(ocupadas__lt=capacidade)
+    return vagas.update(ocupadas=F('ocupadas') + 1) == len(inicios)
+
+
+def liberar_vagas(loja_id, inicios):
+    VagaHorario.objects.filter(
+        loja_id=loja_id, inicio__in=inicios, ocupadas__gt=0
+    ).update(ocupadas=F('ocupadas') - 1)
+
+
+def reservar(agendamento):
+    """
+    Grava o agendamento (ainda não salvo) se a loja tem vaga em todo o
+    horário do serviço; senão levanta ``HorarioIndisponivel``.
+    """
+    agendamento.definir_duracao()
+    inicios = inicios_das_vagas(agendamento.data_hora, agendamento.duracao())
+    with transaction.atomic():
+        if not ocupar_vagas(agendamento.loja_id, inicios, agendamento.loja.capacidade_agendamentos):
+            raise HorarioIndisponivel
+        # As vagas já foram contadas; o sinal de post_save não conta de novo
+        agendamento._vaga_salva = agendamento.vaga()
+        agendamento.save()
+    return agendamento
+
+
+def mover_vaga(anterior, atual):
+    """
+    Troca as vagas ocupadas por ``anterior`` pelas de ``atual`` (valores
+    de ``Agendamento.vaga()``), sem checar a capacidade.
+    """
+    if anterior == atual:
+        return
+    with transaction.atomic():
+        if anterior is not None:
+            liberar_vagas(anterior[0], _inicios_da_vaga(anterior))
+        if atual is not None:
+            ocupar_vagas(atual[0], _inicios_da_vaga(atual))
+
+
+def reconstruir_vagas():
+    """
+    Recalcula todas as vagas a partir dos agendamentos ativos. Retorna o
+    número de intervalos ocupados.
+    """
+    ocupadas = {}
+    agendamentos = Agendamento.objects.filter(status__in=STATUS_ATIVOS).values_list(
+        'loja_id', 'data_hora', 'duracao_minutos'
+    )
+    for loja_id, data_hora, duracao in agendamentos.iterator():
+        for inicio in inicios_das_vagas(data_hora, timedelta(minutes=duracao)):
+            ocupadas[loja_id, inicio] = ocupadas.get((loja_id, inicio), 0) + 1
+    with transaction.atomic():
+        VagaHorario.objects.all().delete()
+        VagaHorario.objects.bulk_create(
+            [VagaHorario(loja_id=loja_id, inicio=inicio, ocupadas=total) for (loja_id, inicio), total in ocupadas.items()],
+            batch_size=2000,
+        )
+    return len(ocupadas)
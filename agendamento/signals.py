@@ -0,0 +1,54 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from loja.models import ResumoUsuario
+
+from .models import Agendamento
+from .reservas import mover_vaga
+
+
+def _inicio_se_proximo(vaga, agora):
+    """
+    Início do agendamento se ele conta nos próximos do usuário (ativo e
+    ainda não começou), ou None.
+    """
+    if vaga is not None and vaga[1] > agora:
+        return vaga[1]
+    return None
+
+
+@receiver(post_save, sender=Agendamento)
+def acertar_vagas_e_contador(sender, instance, created, raw=False, **kwargs):
+    """
+    Acerta as vagas e o total de próximos agendamentos do usuário quando o
+    agendamento é criado ou muda de horário ou de status fora de
+    ``reservar`` (ex: cancelado pelo admin).
+    """
+    if raw:
+        return
+    anterior = getattr(instance, '_vaga_salva', None)
+    atual = instance.vaga()
+    mover_vaga(anterior, atual)
+    instance._vaga_salva = atual
+    # Um agendamento novo pode já ter as vagas ocupadas por ``reservar``,
+    # mas ainda não foi contado. Um que já começou não é mais contado: ou
+    # nunca foi, ou o total dele já está vencido e será recontado
+    agora = timezone.now()
+    contado_antes = None if created else _inicio_se_proximo(anterior, agora)
+    contado_agora = _inicio_se_proximo(atual, agora)
+    if (contado_antes is None) != (contado_agora is None):
+        ResumoUsuario.ajustar(
+            instance.usuario_id, inicio_proximo=contado_agora,
+            total_proximos_agendamentos=1 if contado_agora else -1,
+        )
+    elif contado_agora is not None and contado_agora != contado_antes:
+        # Remarcado para outra data ainda futura
+        ResumoUsuario.ajustar(instance.usuario_id, inicio_proximo=contado_agora)
+
+
+@receiver(post_delete, sender=Agendamento)
+def liberar_vagas_do_agendamento(sender, instance, **kwargs):
+    mover_vaga(instance.vaga(), None)
+    if _inicio_se_proximo(instance.vaga(), timezone.now()) is not None:
+        ResumoUsuario.ajustar(instance.usuario_id, total_proximos_agendamentos=-1)
@@ -0,0 +1,246 @@
+import threading
+from datetime import datetime, time, timedelta
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from loja.models import Loja
+from produto.models import Categoria, Produto
+
+from .disponibilidade import horarios_livres
+from .models import Agendamento, VagaHorario
+from .reservas import HorarioIndisponivel, reconstruir_vagas, reservar
+
+
+class ReservaConcorrenteTests(TransactionTestCase):
+    """
+    Vários clientes tentando o mesmo horário ao mesmo tempo, cada um na
+    sua thread (e na sua conexão com o banco).
+    """
+    CLIENTES = 100
+
+    def setUp(self):
+        self.loja = Loja.objects.create(
+            nome="Pet Shop", endereco="Rua A, 1", latitude=-23.5, longitude=-46.6,
+            horario_abertura=time(8), horario_fechamento=time(18), capacidade_agendamentos=3,
+        )
+        categoria = Categoria.objects.create(nome="Serviço")
+        self.banho = Produto.objects.create(nome="Banho", loja=self.loja, categoria=categoria, preco=50, duracao_minutos=60)
+        self.tosa = Produto.objects.create(nome="Tosa", loja=self.loja, categoria=categoria, preco=80, duracao_minutos=90)
+        self.usuarios = User.objects.bulk_create(User(username=f"cliente{i}") for i in range(self.CLIENTES))
+        amanha = timezone.localdate() + timedelta(days=1)
+        self.horario = timezone.make_aware(datetime.combine(amanha, time(10)))
+
+    def disputar(self, pedidos):
+        """
+        Dispara as reservas (produto, data_hora) juntas e retorna quantas
+        foram aceitas e quantas recusadas.
+        """
+        largada = threading.Barrier(len(pedidos))
+        resultados = []
+
+        def reservar_horario(usuario, produto, data_hora):
+            try:
+                largada.wait()
+                reservar(Agendamento(usuario=usuario, loja=self.loja, produto=produto, data_hora=data_hora))
+                resultados.append(True)
+            except HorarioIndisponivel:
+                resultados.append(False)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=reservar_horario, args=(usuario, produto, data_hora))
+            for usuario, (produto, data_hora) in zip(self.usuarios, pedidos)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(resultados), len(pedidos), "Alguma reserva falhou com erro inesperado.")
+        return resultados.count(True), resultados.count(False)
+
+    def test_mesmo_horario_nao_passa_da_capacidade(self):
+        aceitas, recusadas = self.disputar([(self.banho, self.horario)] * self.CLIENTES)
+
+        self.assertEqual(aceitas, 3)
+        self.assertEqual(recusadas, self.CLIENTES - 3)
+        self.assertEqual(Agendamento.objects.filter(loja=self.loja).count(), 3)
+        self.assertEqual(
+            list(VagaHorario.objects.filter(loja=self.loja).order_by('inicio').values_list('ocupadas', flat=True)),
+            [3, 3],
+        )
+
+    def test_servicos_sobrepostos_nao_passam_da_capacidade(self):
+        # Banhos às 10:00 e tosas às 09:30 disputam o intervalo das 10:00
+        pedidos = [
+            (self.banho, self.horario) if i % 2 else (self.tosa, self.horario - timedelta(minutes=30))
+            for i in range(self.CLIENTES)
+        ]
+        aceitas, _ = self.disputar(pedidos)
+
+        self.assertEqual(aceitas, 3)
+        self.assertTrue(all(v <= 3 for v in VagaHorario.objects.values_list('ocupadas', flat=True)))
+        self.assertEqual(VagaHorario.objects.get(loja=self.loja, inicio=self.horario).ocupadas, 3)
+
+    def test_cancelamento_libera_a_vaga(self):
+        self.disputar([(self.banho, self.horario)] * self.CLIENTES)
+        agendamento = Agendamento.objects.filter(loja=self.loja).first()
+        agendamento.status = 'CANCELADO'
+        agendamento.save()
+
+        self.assertEqual(VagaHorario.objects.get(loja=self.loja, inicio=self.horario).ocupadas, 2)
+        reservar(Agendamento(usuario=self.usuarios[0], loja=self.loja, produto=self.banho, data_hora=self.horario))
+        with self.assertRaises(HorarioIndisponivel):
+            reservar(Agendamento(usuario=self.usuarios[1], loja=self.loja, produto=self.banho, data_hora=self.horario))
+
+
+class HorariosDisponiveisTests(TestCase):
+
+    def setUp(self):
+        self.loja = Loja.objects.create(nome="Pet Shop", endereco="Rua A, 1", horario_abertura=time(8), horario_fechamento=time(18))
+        outra = Loja.objects.create(nome="Outra", endereco="Rua B, 2")
+        self.banho = Produto.objects.create(nome="Banho", loja=self.loja, preco=50, duracao_minutos=60)
+        self.da_outra = Produto.objects.create(nome="Tosa", loja=outra, preco=80)
+        self.client.force_login(User.objects.create_user("cliente"))
+        self.url = reverse('agendamento:horarios_disponiveis', args=[self.loja.pk])
+
+    def test_parametros_validos(self):
+        for parametros in ({}, {'produto': self.banho.pk}, {'produto': self.banho.pk, 'inicio': '2030-01-02', 'dias': 3}):
+            with self.subTest(parametros):
+                resposta = self.client.get(self.url, parametros)
+                self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(len(resposta.json()['dias']), 3)
+
+    def test_parametros_invalidos_retornam_400(self):
+        invalidos = [
+            {'produto': 'abc'}, {'produto': '1.5'}, {'produto': '9' * 30}, {'produto': self.da_outra.pk},
+            {'inicio': '2030-02-30'}, {'inicio': 'amanha'}, {'dias': 'x'}, {'dias': 0}, {'dias': 100},
+        ]
+        for parametros in invalidos:
+            with self.subTest(parametros):
+                self.assertEqual(self.client.get(self.url, parametros).status_code, 400)
+
+
+class VagasDoAgendamentoTests(TestCase):
+
+    def setUp(self):
+        self.loja = Loja.objects.create(
+            nome="Pet Shop", endereco="Rua A, 1", horario_abertura=time(8), horario_fechamento=time(18),
+            capacidade_agendamentos=1,
+        )
+        self.banho = Produto.objects.create(nome="Banho", loja=self.loja, preco=50, duracao_minutos=60)
+        self.tosa = Produto.objects.create(nome="Tosa", loja=self.loja, preco=80, duracao_minutos=90)
+        self.usuario = User.objects.create_user("cliente")
+        amanha = timezone.localdate() + timedelta(days=1)
+        self.horario = timezone.make_aware(datetime.combine(amanha, time(10)))
+
+    def ocupadas(self):
+        return {
+            timezone.localtime(inicio).strftime('%H:%M'): total
+            for inicio, total in VagaHorario.objects.filter(loja=self.loja, ocupadas__gt=0).values_list('inicio', 'ocupadas')
+        }
+
+    def agendar(self, produto, data_hora):
+        return reservar(Agendamento(usuario=self.usuario, loja=self.loja, produto=produto, data_hora=data_hora))
+
+    def test_horario_fora_do_passo_ocupa_os_intervalos_da_grade(self):
+        agendamento = self.agendar(self.banho, self.horario + timedelta(minutes=15))
+        self.assertEqual(agendamento.duracao_minutos, 60)
+        self.assertEqual(self.ocupadas(), {'10:00': 1, '10:30': 1, '11:00': 1})
+        # 11:00-12:00 disputa o intervalo das 11:00 com o banho das 10:15
+        with self.assertRaises(HorarioIndisponivel):
+            self.agendar(self.banho, self.horario + timedelta(hours=1))
+        self.assertEqual(
+            [inicio for inicio, _, _ in horarios_livres(self.loja, self.banho, self.horario.date(), dias=1)[0][1]
+             if self.horario - timedelta(hours=1) <= inicio <= self.horario + timedelta(hours=1)],
+            [self.horario - timedelta(hours=1)],
+        )
+
+    def test_mudar_a_duracao_do_servico_nao_desacerta_as_vagas(self):
+        agendamento = self.agendar(self.banho, self.horario)
+        self.banho.duracao_minutos = 120
+        self.banho.save()
+
+        # Troca de horário: libera exatamente o que tinha ocupado
+        agendamento = Agendamento.objects.get(pk=agendamento.pk)
+        agendamento.data_hora += timedelta(hours=2)
+        agendamento.save()
+        self.assertEqual(agendamento.duracao_minutos, 60)
+        self.assertEqual(self.ocupadas(), {'12:00': 1, '12:30': 1})
+
+        # Troca de serviço: passa a usar a duração do novo
+        agendamento = Agendamento.objects.get(pk=agendamento.pk)
+        agendamento.produto = self.tosa
+        agendamento.save(update_fields=['produto'])
+        self.assertEqual(Agendamento.objects.get(pk=agendamento.pk).duracao_minutos, 90)
+        self.assertEqual(self.ocupadas(), {'12:00': 1, '12:30': 1, '13:00': 1})
+
+        Agendamento.objects.get(pk=agendamento.pk).delete()
+        self.assertEqual(self.ocupadas(), {})
+        self.agendar(self.banho, self.horario)
+        self.assertEqual(self.ocupadas(), {'10:00': 1, '10:30': 1, '11:00': 1, '11:30': 1})
+        reconstruir_vagas()
+        self.assertEqual(self.ocupadas(), {'10:00': 1, '10:30': 1, '11:00': 1, '11:30': 1})
+
+
+class HorariosLivresTests(TestCase):
+
+    def setUp(self):
+        self.loja = Loja.objects.create(
+            nome="Pet Shop", endereco="Rua A, 1", horario_abertura=time(8), horario_fechamento=time(12),
+            capacidade_agendamentos=2,
+        )
+        self.banho = Produto.objects.create(nome="Banho", loja=self.loja, preco=50, duracao_minutos=60)
+        self.tosa = Produto.objects.create(nome="Tosa", loja=self.loja, preco=80, duracao_minutos=90)
+        self.usuario = User.objects.create_user("cliente")
+        self.dia = timezone.localdate() + timedelta(days=1)
+
+    def hora(self, horas, minutos=0, dia=None):
+        return timezone.make_aware(datetime.combine(dia or self.dia, time(horas, minutos)))
+
+    def livres(self, produto, agora=None):
+        (dia, horarios), = horarios_livres(self.loja, produto, self.dia, dias=1, agora=agora)
+        self.assertEqual(dia, self.dia)
+        return [(timezone.localtime(inicio).strftime('%H:%M'), vagas) for inicio, _, vagas in horarios]
+
+    def agendar(self, produto, data_hora, status='PENDENTE'):
+        Agendamento.objects.create(usuario=self.usuario, loja=self.loja, produto=produto, data_hora=data_hora, status=status)
+
+    def test_horarios_dentro_do_expediente(self):
+        # O serviço inteiro tem que terminar até o fechamento
+        self.assertEqual(
+            [inicio for inicio, _ in self.livres(self.banho)],
+            ['08:00', '08:30', '09:00', '09:30', '10:00', '10:30', '11:00'],
+        )
+        self.assertEqual([inicio for inicio, _ in self.livres(self.tosa)][-1], '10:30')
+        # Horários que já passaram ficam de fora
+        self.assertEqual([inicio for inicio, _ in self.livres(self.banho, agora=self.hora(9, 10))][0], '09:30')
+
+    def test_loja_que_fecha_depois_da_meia_noite(self):
+        self.loja.horario_abertura, self.loja.horario_fechamento = time(22), time(1)
+        self.loja.save()
+        self.assertEqual([inicio for inicio, _ in self.livres(self.banho)], ['22:00', '22:30', '23:00', '23:30', '00:00'])
+
+    def test_agendamentos_ocupam_as_vagas_do_intervalo(self):
+        self.agendar(self.banho, self.hora(9))
+        livres = dict(self.livres(self.banho))
+        # Banhos que tocam 09:00-10:00 ficam com uma vaga
+        self.assertEqual(livres, {
+            '08:00': 2, '08:30': 1, '09:00': 1, '09:30': 1, '10:00': 2, '10:30': 2, '11:00': 2,
+        })
+
+        # Com a capacidade atingida o horário some; a tosa (90 min) das
+        # 08:00 invadiria o horário das 09:00
+        self.agendar(self.banho, self.hora(9))
+        self.assertEqual([inicio for inicio, _ in self.livres(self.banho)], ['08:00', '10:00', '10:30', '11:00'])
+        self.assertEqual([inicio for inicio, _ in self.livres(self.tosa)], ['10:00', '10:30'])
+
+        # Agendamentos cancelados não ocupam nada
+        self.agendar(self.tosa, self.hora(10), status='CANCELADO')
+        self.assertEqual([inicio for inicio, _ in self.livres(self.tosa)], ['10:00', '10:30'])
+        self.agendar(self.tosa, self.hora(10))
+        self.assertEqual(dict(self.livres(self.banho)), {'08:00': 2, '10:00': 1, '10:30': 1, '11:00': 1})
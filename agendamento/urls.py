@@ -0,0 +1,12 @@
+from django.urls import path
+from . import views
+
+# Adiciona um namespace para o app 'agendamento'
+app_name = 'agendamento'
+
+urlpatterns = [
+    path('', views.ListarAgendamento.as_view(), name='listar_agendamento'),
+    path('loja/<int:loja_id>/', views.CriarAgendamento.as_view(), name='criar_agendamento'),
+    path('loja/<int:loja_id>/horarios/', views.horarios_disponiveis, name='horarios_disponiveis'),
+    path('exportar/', views.ExportarAgendamentos.as_view(), name='exportar_agendamentos'),
+]
@@ -1,10 +1,18 @@
 from django.views import View
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.http import HttpResponseBadRequest, JsonResponse
+from django.utils.dateparse import parse_date
 from .models import Agendamento
 from .forms import AgendamentoForm
+from .disponibilidade import MAXIMO_DIAS, horarios_livres
+from .reservas import HorarioIndisponivel, reservar
 from loja.models import Loja
+from petcareapp.exportacao import ExportacaoView
+from petcareapp.fila_escrita import escrever
+from produto.models import Produto
 from django.utils import timezone
 
 
@@ -26,10 +34,15 @@ class CriarAgendamento(LoginRequiredMixin, View):
             agendamento.usuario = request.user
             agendamento.loja = loja
             agendamento.status = 'PENDENTE'
-            agendamento.save()
-            
-            messages.success(request, "Agendamento solicitado com sucesso! Aguarde a confirmação.")
-            return redirect('agendamento:listar_agendamento')
+            try:
+                # A vaga é garantida na gravação: outro cliente pode ter
+                # ocupado o horário depois da validação do formulário
+                escrever(reservar, agendamento)
+            except HorarioIndisponivel:
+                form.add_error('data_hora', "Este horário acabou de ser ocupado. Escolha outro horário livre.")
+            else:
+                messages.success(request, "Agendamento solicitado com sucesso! Aguarde a confirmação.")
+                return redirect('agendamento:listar_agendamento')
 
         context = {
             'form': form,
@@ -58,3 +71,57 @@ class ListarAgendamento(LoginRequiredMixin, View):
 
         return render(request, 'agendamento/listar_agendamentos.html', context)
 
+
+
+@login_required
+def horarios_disponiveis(request, loja_id):
+    """
+    Retorna em JSON os horários livres da loja para um serviço, dia a dia.
+    Parâmetros: `produto` (id do serviço), `inicio` (AAAA-MM-DD, padrão
+    hoje) e `dias` (padrão 7).
+    """
+    loja = get_object_or_404(Loja, pk=loja_id)
+    try:
+        produto_id = int(request.GET['produto']) if request.GET.get('produto') else None
+        inicio = parse_date(request.GET['inicio']) if request.GET.get('inicio') else timezone.localdate()
+        dias = int(request.GET.get('dias', 7))
+    except ValueError:
+        inicio = None
+    if inicio is None or not 1 <= dias <= MAXIMO_DIAS:
+        return HttpResponseBadRequest(
+            f"Informe produto (id do serviço), inicio=AAAA-MM-DD e dias entre 1 e {MAXIMO_DIAS}."
+        )
+    produto = None
+    if produto_id is not None:
+        produto = Produto.objects.filter(pk=produto_id, loja=loja).first()
+        if produto is None:
+            return HttpResponseBadRequest("Serviço não encontrado nesta loja.")
+
+    return JsonResponse({
+        'loja': loja.pk,
+        'produto': produto.pk if produto else None,
+        'dias': [
+            {
+                'data': dia.isoformat(),
+                'horarios': [
+                    {'inicio': timezone.localtime(i).isoformat(), 'fim': timezone.localtime(f).isoformat(), 'vagas': vagas}
+                    for i, f, vagas in horarios
+                ],
+            }
+            for dia, horarios in horarios_livres(loja, produto, inicio, dias)
+        ],
+    })
+
+
+class ExportarAgendamentos(ExportacaoView):
+    """
+    Exporta os agendamentos em CSV ou JSON, com filtro pela data marcada.
+    """
+    model = Agendamento
+    nome_arquivo = 'agendamentos'
+    campo_data = 'data_hora'
+    colunas = [
+        ('id', 'pk'), ('loja', 'loja_id'), ('loja_nome', 'loja__nome'), ('data_hora', 'data_hora'),
+        ('status', 'status'), ('servico', 'produto__nome'), ('usuario', 'usuario__username'),
+        ('email', 'usuario__email'), ('observacoes', 'observacoes'), ('criado_em', 'criado_em'),
+    ]
@@ -0,0 +1,160 @@
+"""
+Armazenamento de mídia endereçado pelo conteúdo.
+
+Cada arquivo enviado por um ``FileField``/``ImageField`` é gravado em
+``cas/<hash[:2]>/<hash[2:4]>/<hash>.<ext>``, onde o hash (SHA-256) é
+calculado enquanto o arquivo é copiado em blocos para o disco. Se o mesmo
+conteúdo já existe, a cópia nova é descartada e o caminho existente é
+reutilizado. Como o caminho nunca muda de conteúdo, as URLs podem ser
+guardadas em cache para sempre.
+
+Os arquivos gravados diretamente pelo código (ex: os derivados de
+``loja.imagens``) ficam no caminho pedido, como no ``FileSystemStorage``.
+
+As referências de cada arquivo (``ArquivoMidia.referencias``) são
+mantidas pelos sinais registrados com ``registrar_referencias``. O
+``coletar_midia`` só remove arquivos sem referências cujo último upload
+(``ArquivoMidia.enviado_em``) passou do prazo de carência.
+"""
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.utils import timezone
+
+PREFIXO = 'cas'
+# Marca os nomes gerados pelos campos de arquivo (uploads), os únicos
+# que são deduplicados
+_PREFIXO_UPLOAD = '_upload'
+
+# (modelo, campos) com referências a arquivos, usados pelo comando ``coletar_midia``
+CAMPOS_COM_ARQUIVOS = []
+
+
+def caminho_por_hash(hash_, extensao):
+    return posixpath.join(PREFIXO, hash_[:2], hash_[2:4], f'{hash_}{extensao.lower()}')
+
+
+class ArmazenamentoPorConteudo(FileSystemStorage):
+    """
+    ``FileSystemStorage`` que deduplica os uploads pelo hash do conteúdo.
+    """
+
+    def generate_filename(self, filename):
+        return posixpath.join(_PREFIXO_UPLOAD, super().generate_filename(filename))
+
+    def get_available_name(self, name, max_length=None):
+        # O nome final dos uploads só é conhecido depois de ler o conteúdo
+        if name.startswith(_PREFIXO_UPLOAD + '/'):
+            return name
+        return super().get_available_name(name, max_length)
+
+    def _save(self, name, content):
+        if not name.startswith(_PREFIXO_UPLOAD + '/'):
+            return super()._save(name, content)
+
+        from .models import ArquivoMidia
+
+        diretorio_temporario = os.path.join(self.location, PREFIXO, 'tmp')
+        os.makedirs(diretorio_temporario, exist_ok=True)
+        hash_ = hashlib.sha256()
+        tamanho = 0
+        descritor, temporario = tempfile.mkstemp(dir=diretorio_temporario)
+        try:
+            with os.fdopen(descritor, 'wb') as destino:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for bloco in content.chunks():
+                    hash_.update(bloco)
+                    tamanho += len(bloco)
+                    destino.write(bloco)
+
+            hash_ = hash_.hexdigest()
+            # Renova o prazo do ``coletar_midia`` antes de reaproveitar o
+            # arquivo: até o registro que aponta para ele ser salvo, o
+            # arquivo continua sem referências
+            ArquivoMidia.objects.filter(hash=hash_).update(enviado_em=timezone.now())
+            # O mesmo conteúdo pode ter sido enviado antes com outra extensão
+            existente = ArquivoMidia.objects.filter(hash=hash_).values_list('nome', flat=True).first()
+            nome = existente or caminho_por_hash(hash_, posixpath.splitext(name)[1])
+            if not self.exists(nome):
+                os.makedirs(os.path.dirname(self.path(nome)), exist_ok=True)
+                file_move_safe(temporario, self.path(nome), allow_overwrite=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(self.path(nome), self.file_permissions_mode)
+        finally:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+
+        if existente is None:
+            try:
+                ArquivoMidia.objects.create(hash=hash_, nome=nome, tamanho=tamanho)
+            except IntegrityError:
+                # Outro processo registrou o mesmo conteúdo ao mesmo tempo
+                pass
+        return nome
+
+
+def ajustar_referencias(nome, delta):
+    """
+    Soma ``delta`` às referências do arquivo. Nomes fora do armazenamento
+    por conteúdo são ignorados.
+    """
+    from .models import ArquivoMidia
+
+    if not nome or not nome.startswith(PREFIXO + '/'):
+        return
+    arquivos = ArquivoMidia.objects.filter(nome=nome)
+    if delta < 0:
+        arquivos = arquivos.filter(referencias__gte=-delta)
+    arquivos.update(referencias=F('referencias') + delta)
+
+
+def _nomes(instance, campos):
+    return {campo: getattr(instance, campo).name or '' for campo in campos}
+
+
+def registrar_referencias(modelo, *campos):
+    """
+    Conecta os sinais que mantêm as referências dos arquivos apontados
+    pelos campos do modelo: +1 para o arquivo novo e -1 para o substituído
+    ao salvar, e -1 ao excluir o registro.
+    """
+    CAMPOS_COM_ARQUIVOS.append((modelo, campos))
+
+    def guardar_anteriores(sender, instance, raw=False, update_fields=None, **kwargs):
+        # None indica que os arquivos não mudaram (ou não dá para saber)
+        instance._arquivos_anteriores = None
+        if raw or (update_fields is not None and not set(update_fields) & set(campos)):
+            return
+        if instance._state.adding or instance.pk is None:
+            instance._arquivos_anteriores = {}
+            return
+        anteriores = sender._default_manager.filter(pk=instance.pk).values(*campos).first() or {}
+        instance._arquivos_anteriores = {campo: valor or '' for campo, valor in anteriores.items()}
+
+    def atualizar(sender, instance, **kwargs):
+        anteriores = getattr(instance, '_arquivos_anteriores', None)
+        if anteriores is None:
+            return
+        for campo, nome in _nomes(instance, campos).items():
+            anterior = anteriores.get(campo, '')
+            if nome != anterior:
+                ajustar_referencias(nome, 1)
+                ajustar_referencias(anterior, -1)
+        instance._arquivos_anteriores = None
+
+    def remover(sender, instance, **kwargs):
+        for nome in _nomes(instance, campos).values():
+            ajustar_referencias(nome, -1)
+
+    pre_save.connect(guardar_anteriores, sender=modelo, weak=False)
+    post_save.connect(atualizar, sender=modelo, weak=False)
+    post_delete.connect(remover, sender=modelo, weak=False)
+
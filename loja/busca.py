@@ -0,0 +1,183 @@
+"""
+Busca textual com índices FTS5 do SQLite.
+
+Cada ``IndiceBusca`` mantém uma tabela virtual FTS5 de conteúdo externo
+apontando para a tabela do modelo. O tokenizador ``unicode61`` com
+``remove_diacritics`` ignora acentos e maiúsculas, então "racao" encontra
+"Ração". Gatilhos (triggers) no banco mantêm o índice em dia a cada
+INSERT, UPDATE e DELETE, inclusive nos feitos com ``bulk_create`` ou
+``update()``. Os resultados podem ser ordenados por relevância (BM25).
+
+A tabela, os gatilhos e a indexação inicial são criados pela migração
+``loja/0020_indices_busca``. Uma migração que recria a tabela do modelo
+(no SQLite, alterar uma coluna copia a tabela inteira) apaga os gatilhos;
+por isso, ao final de cada ``migrate``, os que faltarem são recriados e o
+índice é reconstruído.
+
+Em bancos que não são SQLite a busca cai para ``icontains``.
+"""
+import re
+
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_migrate
+
+from .models import Loja
+
+# Índices registrados, usados pelo comando ``reconstruir_busca``
+INDICES = []
+
+_PALAVRA = re.compile(r'\w+', re.UNICODE)
+
+
+class IndiceBusca:
+    """
+    Índice FTS5 sobre alguns campos de texto de um modelo.
+    """
+
+    def __init__(self, modelo, campos, pesos=None):
+        self.modelo = modelo
+        self.campos = list(campos)
+        self.pesos = list(pesos) if pesos else [1.0] * len(self.campos)
+        INDICES.append(self)
+
+    @property
+    def tabela_modelo(self):
+        return self.modelo._meta.db_table
+
+    @property
+    def tabela(self):
+        return f'{self.tabela_modelo}_busca'
+
+    def _colunas(self, prefixo=''):
+        return ', '.join(f'{prefixo}{self.modelo._meta.get_field(c).column}' for c in self.campos)
+
+    def _sql_criacao(self):
+        tabela, modelo = self.tabela, self.tabela_modelo
+        pk = self.modelo._meta.pk.column
+        colunas = self._colunas()
+        novas = self._colunas('new.')
+        antigas = self._colunas('old.')
+        return [
+            f"CREATE VIRTUAL TABLE {tabela} USING fts5({colunas}, content='{modelo}', "
+            f"content_rowid='{pk}', tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+            f"CREATE TRIGGER {tabela}_ai AFTER INSERT ON {modelo} BEGIN "
+            f"INSERT INTO {tabela}(rowid, {colunas}) VALUES (new.{pk}, {novas}); END",
+            f"CREATE TRIGGER {tabela}_ad AFTER DELETE ON {modelo} BEGIN "
+            f"INSERT INTO {tabela}({tabela}, rowid, {colunas}) VALUES ('delete', old.{pk}, {antigas}); END",
+            f"CREATE TRIGGER {tabela}_au AFTER UPDATE OF {colunas} ON {modelo} BEGIN "
+            f"INSERT INTO {tabela}({tabela}, rowid, {colunas}) VALUES ('delete', old.{pk}, {antigas}); "
+            f"INSERT INTO {tabela}(rowid, {colunas}) VALUES (new.{pk}, {novas}); END",
+        ]
+
+    def _sql_remocao(self):
+        return [
+            f'DROP TRIGGER IF EXISTS {self.tabela}_ai',
+            f'DROP TRIGGER IF EXISTS {self.tabela}_ad',
+            f'DROP TRIGGER IF EXISTS {self.tabela}_au',
+            f'DROP TABLE IF EXISTS {self.tabela}',
+        ]
+
+    def disponivel(self, using='default'):
+        return connections[using].vendor == 'sqlite'
+
+    def _objetos(self, using):
+        """
+        Quais dos objetos do índice (a tabela e os três gatilhos) existem.
+        """
+        nomes = [self.tabela] + [f'{self.tabela}_{sufixo}' for sufixo in ('ai', 'ad', 'au')]
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE name IN (%s, %s, %s, %s)", nomes
+            )
+            return {nome for nome, in cursor.fetchall()}
+
+    def existe(self, using='default'):
+        """
+        True se a tabela e os três gatilhos existem; sem os gatilhos o
+        índice deixa de acompanhar as alterações.
+        """
+        return len(self._objetos(using)) == 4
+
+    def criar(self, using='default'):
+        """
+        Cria a tabela FTS5 e os gatilhos que faltarem e indexa as linhas já
+        cadastradas.
+        """
+        if not self.disponivel(using) or self.existe(using):
+            return
+        self.reconstruir(using, recriar=True)
+
+    def reconstruir(self, using='default', recriar=False):
+        """
+        Reindexa todo o conteúdo da tabela do modelo. Com ``recriar``, a
+        tabela e os gatilhos são apagados e criados de novo.
+        """
+        if not self.disponivel(using):
+            return
+        with connections[using].cursor() as cursor:
+            if recriar or not self.existe(using):
+                for sql in self._sql_remocao() + self._sql_criacao():
+                    cursor.execute(sql)
+            cursor.execute(f"INSERT INTO {self.tabela}({self.tabela}) VALUES ('rebuild')")
+
+    def montar_consulta(self, termo):
+        """
+        Converte o texto digitado numa consulta FTS5: cada palavra vira um
+        prefixo entre aspas e todas precisam aparecer.
+        """
+        palavras = _PALAVRA.findall(termo or '')
+        return ' '.join(f'"{palavra}"*' for palavra in palavras)
+
+    def filtrar(self, queryset, termo):
+        """
+        Restringe o queryset aos registros que casam com o termo.
+        """
+        consulta = self.montar_consulta(termo)
+        if not consulta:
+            return queryset
+        if not self.disponivel(queryset.db):
+            filtro = Q()
+            for campo in self.campos:
+                filtro |= Q(**{f'{campo}__icontains': termo})
+            return queryset.filter(filtro)
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {self.tabela} WHERE {self.tabela} MATCH %s', [consulta]
+        ))
+
+    def ordenar_por_relevancia(self, queryset, termo):
+        """
+        Ordena pela relevância (BM25) um queryset já restringido com
+        ``filtrar``.
+        """
+        consulta = self.montar_consulta(termo)
+        if not consulta or not self.disponivel(queryset.db):
+            return queryset
+        pesos = ', '.join(str(float(peso)) for peso in self.pesos)
+        pk = self.modelo._meta.pk.column
+        relevancia = RawSQL(
+            f'SELECT bm25({self.tabela}, {pesos}) FROM {self.tabela} '
+            f'WHERE {self.tabela} MATCH %s AND rowid = "{self.tabela_modelo}"."{pk}"',
+            [consulta],
+        )
+        # bm25() retorna valores menores para os resultados mais relevantes
+        return queryset.annotate(relevancia=relevancia).order_by('relevancia', 'pk')
+
+    def conectar(self, app_config):
+        """
+        Recria, ao final de cada ``migrate``, os gatilhos apagados por uma
+        migração que recriou a tabela do modelo.
+        """
+        post_migrate.connect(self._apos_migrate, sender=app_config, weak=False)
+
+    def _apos_migrate(self, sender, using='default', **kwargs):
+        if not self.disponivel(using):
+            return
+        # Sem a tabela FTS5 a migração do índice ainda não rodou (ex: um
+        # migrate parcial); a tabela do modelo pode nem existir ainda
+        if self.tabela in self._objetos(using):
+            self.criar(using)
+
+
+INDICE_LOJAS = IndiceBusca(Loja, ['nome', 'endereco'], pesos=[2.0, 1.0])
@@ -0,0 +1,180 @@
+"""
+Funções de cache do app loja.
+"""
+from hashlib import md5
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+
+from produto.models import Categoria
+
+from .models import CarouselImage, Loja, LojaFavorita
+
+# Tempo (em segundos) que o conjunto de favoritas de um usuário fica em cache
+TEMPO_CACHE_FAVORITAS = 60 * 15
+TEMPO_CACHE_CARROSSEL = 60 * 60 * 24
+# Tempo máximo dos fragmentos da página da loja. Alterações feitas sem
+# passar pelo save() (ex: ``update()``) só aparecem depois desse prazo.
+TEMPO_CACHE_FRAGMENTOS = 60 * 60
+# Dados de referência: só mudam pelo admin, e os sinais geram uma nova versão
+TEMPO_CACHE_REFERENCIAS = 60 * 60 * 24
+
+_CHAVE_VERSAO_CARROSSEL = 'loja:carrossel:versao'
+_CHAVE_VERSAO_CATEGORIAS = 'loja:categorias:versao'
+_CHAVE_VERSAO_LOJISTAS = 'loja:lojistas:versao'
+# Cópias na memória do processo: nome -> (versão, valor)
+_copias_locais = {}
+
+
+def _chave_favoritas(user_id):
+    return f'loja:favoritas:{user_id}'
+
+
+def ids_lojas_favoritas(user):
+    """
+    Retorna o conjunto de ids das lojas favoritadas pelo usuário.
+    O conjunto é buscado numa única consulta e guardado em cache.
+    """
+    chave = _chave_favoritas(user.pk)
+    ids = cache.get(chave)
+    if ids is None:
+        ids = set(LojaFavorita.objects.filter(usuario_id=user.pk).values_list('loja_id', flat=True))
+        cache.set(chave, ids, TEMPO_CACHE_FAVORITAS)
+    return ids
+
+
+def invalidar_lojas_favoritas(user):
+    """
+    Descarta o conjunto de favoritas em cache do usuário (ou do id).
+    Deve ser chamada sempre que o usuário favoritar ou desfavoritar uma loja.
+    """
+    cache.delete(_chave_favoritas(getattr(user, 'pk', user)))
+
+
+def _versao(chave):
+    versao = cache.get(chave)
+    if versao is None:
+        cache.add(chave, uuid4().hex, None)
+        versao = cache.get(chave)
+    return versao
+
+
+def _ler_versionado(nome, chave_versao, buscar, tempo):
+    """
+    Lê um valor que muda pouco, guardado na memória do processo e no cache
+    compartilhado. ``buscar()`` só é chamada (no banco) quando a versão em
+    ``chave_versao`` muda.
+    """
+    versao = _versao(chave_versao)
+    copia = _copias_locais.get(nome)
+    if copia is not None and copia[0] == versao:
+        return copia[1]
+    chave = f'loja:{nome}:{versao}'
+    valor = cache.get(chave)
+    if valor is None:
+        valor = buscar()
+        cache.set(chave, valor, tempo)
+    _copias_locais[nome] = (versao, valor)
+    return valor
+
+
+def imagens_carrossel():
+    """
+    Retorna a lista de imagens do carrossel. Ela só é buscada de novo no
+    banco quando a versão muda (ver ``invalidar_carrossel``).
+    """
+    return _ler_versionado(
+        'carrossel', _CHAVE_VERSAO_CARROSSEL, lambda: list(CarouselImage.objects.all()), TEMPO_CACHE_CARROSSEL
+    )
+
+
+def invalidar_carrossel():
+    """
+    Gera uma nova versão do carrossel, descartando as cópias em cache de
+    todos os processos.
+    """
+    cache.set(_CHAVE_VERSAO_CARROSSEL, uuid4().hex, None)
+
+
+def _chave_versao_loja(loja_id):
+    return f'loja:versao:{loja_id}'
+
+
+def versao_loja(loja_id):
+    """
+    Versão dos fragmentos em cache da página da loja (cabeçalho, produtos
+    e avaliações). Ela entra na chave dos fragmentos, então gerar uma nova
+    versão descarta todos de uma vez.
+    """
+    return _versao(_chave_versao_loja(loja_id))
+
+
+def invalidar_loja(loja_id):
+    """
+    Descarta os fragmentos em cache da página da loja. Chamada pelos
+    sinais de ``Loja``, ``Produto`` e ``Avaliacao``.
+    """
+    cache.set(_chave_versao_loja(loja_id), uuid4().hex, None)
+
+
+def invalidar_total_favoritos(loja_id):
+    """
+    Descarta o fragmento com o total de favoritos da loja, que muda com
+    frequência e por isso não usa a versão da loja.
+    """
+    cache.delete(make_template_fragment_key('loja_favoritos', [loja_id]))
+
+
+def categorias():
+    """
+    Lista das categorias de produto, usada nos filtros e formulários.
+    """
+    return _ler_versionado(
+        'categorias', _CHAVE_VERSAO_CATEGORIAS, lambda: list(Categoria.objects.all()), TEMPO_CACHE_REFERENCIAS
+    )
+
+
+def categoria_por_nome(nome):
+    """
+    Categoria com o nome dado, ou None, sem consultar o banco.
+    """
+    return next((categoria for categoria in categorias() if categoria.nome == nome), None)
+
+
+def invalidar_categorias():
+    cache.set(_CHAVE_VERSAO_CATEGORIAS, uuid4().hex, None)
+
+
+def loja_do_usuario(user):
+    """
+    Id da loja cadastrada com o e-mail do usuário, ou None se ele não é
+    lojista. O resultado fica em cache por e-mail e, durante a requisição,
+    no próprio usuário.
+    """
+    if not user.is_authenticated or not user.email:
+        return None
+    memorizado = getattr(user, '_loja_do_usuario', None)
+    if memorizado is not None and memorizado[0] == user.email:
+        return memorizado[1]
+    versao = _versao(_CHAVE_VERSAO_LOJISTAS)
+    chave = f'loja:lojista:{versao}:{md5(user.email.encode()).hexdigest()}'
+    # 0 marca "não é lojista", para diferenciar de uma chave ausente
+    loja_id = cache.get(chave)
+    if loja_id is None:
+        loja_id = Loja.objects.filter(email=user.email).values_list('pk', flat=True).first() or 0
+        cache.set(chave, loja_id, TEMPO_CACHE_REFERENCIAS)
+    user._loja_do_usuario = (user.email, loja_id or None)
+    return loja_id or None
+
+
+def usuario_e_lojista(user):
+    return loja_do_usuario(user) is not None
+
+
+def invalidar_lojistas():
+    """
+    Descarta a relação e-mail -> loja de todos os usuários. Chamada pelos
+    sinais de ``Loja`` quando o e-mail pode ter mudado.
+    """
+    cache.set(_CHAVE_VERSAO_LOJISTAS, uuid4().hex, None)
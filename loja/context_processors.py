@@ -1,7 +1,11 @@
-from .models import CarouselImage
+from django.utils.functional import SimpleLazyObject
+
+from .cache import imagens_carrossel
+
 
 def carousel_context(request):
     """
     Disponibiliza as imagens do carrossel para todos os templates.
+    A lista vem do cache e só é carregada se o template usar a variável.
     """
-    return {'carousel_images': CarouselImage.objects.all()}
\ No newline at end of file
+    return {'carousel_images': SimpleLazyObject(imagens_carrossel)}
@@ -0,0 +1,285 @@
+"""
+Dados sintéticos para medir o sistema em escala.
+
+``gerar()`` cria lojas, usuários, categorias, produtos, avaliações,
+favoritas e agendamentos com ``bulk_create`` em lotes, a partir de uma
+semente: a mesma semente gera sempre os mesmos dados (só as datas dos
+agendamentos acompanham o dia em que são gerados). Como o
+``bulk_create`` não chama o ``save()`` nem os sinais, os campos derivados
+(geohash, chave do produto) são preenchidos aqui e as tabelas mantidas
+pelos sinais são recalculadas no fim, pelas mesmas funções dos comandos
+de reconstrução.
+
+Os registros gerados são reconhecidos pelo domínio ``DOMINIO`` do
+e-mail, o que permite apagá-los com ``apagar()``.
+"""
+import io
+import random
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.utils import timezone
+
+from agendamento.disponibilidade import PASSO_MINUTOS
+from agendamento.models import STATUS_ATIVOS, Agendamento
+from agendamento.reservas import reconstruir_vagas
+from produto.models import Categoria, Produto, ProdutoCanonico, ResumoOferta
+from produto.normalizacao import normalizar_nome
+
+from .geo import codificar_geohash
+from .mapa import reconstruir_indice
+from .models import Avaliacao, Loja, LojaFavorita
+
+DOMINIO = 'sintetico.petcare'
+# Senha de todos os usuários gerados
+SENHA = 'petcare-sintetico'
+CATEGORIA_SERVICOS = 'Serviço'
+
+# Centro e raio (em graus) da região onde as lojas são espalhadas
+CENTRO = (-23.55, -46.63)
+RAIO_GRAUS = 0.3
+
+CATEGORIAS = [
+    CATEGORIA_SERVICOS, 'Ração', 'Petiscos', 'Brinquedos', 'Higiene', 'Acessórios',
+    'Medicamentos', 'Camas', 'Aquarismo', 'Coleiras', 'Roupas', 'Transporte',
+]
+MARCAS = ['Golden', 'Premier', 'Whiskas', 'Pedigree', 'Royal Canin', 'Guabi', 'Farmina', 'Biofresh']
+ITENS = ['Ração', 'Petisco', 'Shampoo', 'Bola', 'Coleira', 'Cama', 'Arranhador', 'Areia', 'Vermífugo']
+TAMANHOS = ['500g', '1kg', '3kg', '10kg', '15kg', '250ml', '500ml', 'P', 'M', 'G']
+SERVICOS = [('Banho', 60), ('Tosa', 90), ('Banho e Tosa', 120), ('Consulta', 30), ('Vacinação', 30)]
+ANIMAIS = ['CACHORRO', 'GATO', 'TODOS']
+COMENTARIOS = ['', 'Ótimo atendimento.', 'Voltarei com certeza.', 'Preço justo.', 'Demorou um pouco.']
+# Agendamentos entre DIAS_AGENDAMENTOS dias atrás e DIAS_AGENDAMENTOS dias à frente
+DIAS_AGENDAMENTOS = 60
+
+PADRAO = {
+    'lojas': 200,
+    'usuarios': 1000,
+    'categorias': len(CATEGORIAS),
+    'produtos_por_loja': 40,
+    'avaliacoes': 5000,
+    'favoritas': 5000,
+    'agendamentos': 3000,
+}
+
+
+def _pares_distintos(rng, total, primeiros, segundos):
+    """
+    ``total`` pares (primeiro, segundo) sem repetição, sorteados entre
+    todas as combinações.
+    """
+    total = min(total, len(primeiros) * len(segundos))
+    indices = rng.sample(range(len(primeiros) * len(segundos)), total)
+    return [(primeiros[i // len(segundos)], segundos[i % len(segundos)]) for i in indices]
+
+
+def _criar_usuarios(quantidade, lote):
+    senha = make_password(SENHA)
+    User.objects.bulk_create(
+        [
+            User(username=f'sintetico{i}', email=f'usuario{i}@{DOMINIO}', password=senha, first_name=f'Cliente {i}')
+            for i in range(quantidade)
+        ],
+        batch_size=lote,
+    )
+    return list(User.objects.filter(email__endswith=f'@{DOMINIO}').order_by('pk').values_list('pk', 'email'))
+
+
+def _criar_lojas(rng, quantidade, usuarios, lote):
+    lojas = []
+    for i in range(quantidade):
+        latitude = CENTRO[0] + rng.uniform(-RAIO_GRAUS, RAIO_GRAUS)
+        longitude = CENTRO[1] + rng.uniform(-RAIO_GRAUS, RAIO_GRAUS)
+        abertura = rng.choice([7, 8, 9])
+        lojas.append(Loja(
+            nome=f'Pet Shop {i}',
+            endereco=f'Rua Sintética, {i}',
+            telefone=f'(11) 9{i:08d}',
+            horario_abertura=time(abertura),
+            horario_fechamento=time(abertura + rng.choice([9, 10, 11])),
+            atendimento_emergencia=rng.random() < 0.1,
+            capacidade_agendamentos=rng.choice([1, 1, 2, 3]),
+            descricao=f'Loja sintética {i}.',
+            # Os primeiros usuários são os lojistas
+            email=usuarios[i % len(usuarios)][1] if usuarios else f'loja{i}@{DOMINIO}',
+            latitude=latitude,
+            longitude=longitude,
+            geohash=codificar_geohash(latitude, longitude),
+        ))
+    Loja.objects.bulk_create(lojas, batch_size=lote)
+    return list(
+        Loja.objects.filter(email__endswith=f'@{DOMINIO}').order_by('pk')
+        .values_list('pk', 'horario_abertura', 'horario_fechamento')
+    )
+
+
+def _criar_categorias(quantidade):
+    nomes = (CATEGORIAS + [f'Categoria {i}' for i in range(len(CATEGORIAS), quantidade)])[:max(quantidade, 1)]
+    Categoria.objects.bulk_create([Categoria(nome=nome) for nome in nomes], ignore_conflicts=True)
+    return dict(Categoria.objects.filter(nome__in=nomes).values_list('nome', 'pk'))
+
+
+def _criar_produtos(rng, lojas, categorias, por_loja, lote):
+    """
+    Produtos e serviços de cada loja. Os nomes se repetem entre as lojas,
+    como no catálogo real, para que o comparador tenha ofertas a agrupar.
+    """
+    servicos = categorias.get(CATEGORIA_SERVICOS)
+    outras = [pk for nome, pk in categorias.items() if nome != CATEGORIA_SERVICOS] or [servicos]
+    # Cerca de um décimo do catálogo de cada loja são serviços
+    total_servicos = min(len(SERVICOS), max(1, por_loja // 10)) if servicos else 0
+    produtos = []
+    for loja_id, _, _ in lojas:
+        for nome, duracao in rng.sample(SERVICOS, total_servicos):
+            produtos.append(Produto(
+                loja_id=loja_id, categoria_id=servicos, nome=nome, preco=Decimal(rng.randint(30, 150)),
+                duracao_minutos=duracao, animal_destino=rng.choice(ANIMAIS),
+            ))
+        for _ in range(por_loja - total_servicos):
+            nome = f'{rng.choice(ITENS)} {rng.choice(MARCAS)} {rng.choice(TAMANHOS)}'
+            produtos.append(Produto(
+                loja_id=loja_id, categoria_id=rng.choice(outras), nome=nome,
+                preco=Decimal(rng.randint(500, 40000)) / 100, estoque=rng.randint(0, 200),
+                disponivel=rng.random() < 0.95, animal_destino=rng.choice(ANIMAIS),
+            ))
+
+    # Canônicos pela chave exata, como faz o save(); o agrupamento
+    # aproximado continua com o comando ``agrupar_produtos``
+    for produto in produtos:
+        produto.chave = normalizar_nome(produto.nome)
+    chaves = {produto.chave: produto.nome for produto in produtos}
+    existentes = set(ProdutoCanonico.objects.filter(chave__in=chaves).values_list('chave', flat=True))
+    ProdutoCanonico.objects.bulk_create(
+        [ProdutoCanonico(nome=nome, chave=chave) for chave, nome in chaves.items() if chave not in existentes],
+        batch_size=lote,
+    )
+    canonicos = dict(ProdutoCanonico.objects.filter(chave__in=chaves).values_list('chave', 'pk'))
+    for produto in produtos:
+        produto.canonico_id = canonicos[produto.chave]
+    Produto.objects.bulk_create(produtos, batch_size=lote)
+
+
+def _criar_agendamentos(rng, quantidade, lojas, usuarios, lote):
+    """
+    Agendamentos de serviços sem sobreposição dentro de cada loja, então
+    a capacidade nunca é excedida.
+    """
+    servicos = {}
+    for pk, loja_id, duracao in Produto.objects.filter(
+        loja__email__endswith=f'@{DOMINIO}', categoria__nome=CATEGORIA_SERVICOS
+    ).values_list('pk', 'loja_id', 'duracao_minutos').order_by('pk'):
+        servicos.setdefault(loja_id, []).append((pk, duracao))
+    expedientes = {loja_id: (abertura, fechamento) for loja_id, abertura, fechamento in lojas if loja_id in servicos}
+    if not expedientes or not usuarios:
+        return
+
+    hoje = timezone.localdate()
+    fuso = timezone.get_current_timezone()
+    passo = timedelta(minutes=PASSO_MINUTOS)
+    proximo_livre = {}
+    agendamentos = []
+    agora = timezone.now()
+    tentativas = quantidade * 3
+    loja_ids = sorted(expedientes)
+    while len(agendamentos) < quantidade and tentativas:
+        tentativas -= 1
+        loja_id = rng.choice(loja_ids)
+        dia = hoje + timedelta(days=rng.randint(-DIAS_AGENDAMENTOS, DIAS_AGENDAMENTOS))
+        abertura, fechamento = expedientes[loja_id]
+        inicio = proximo_livre.get((loja_id, dia)) or timezone.make_aware(datetime.combine(dia, abertura), fuso)
+        produto_id, duracao = rng.choice(servicos[loja_id])
+        fim = inicio + timedelta(minutes=duracao)
+        if fim > timezone.make_aware(datetime.combine(dia, fechamento), fuso):
+            continue
+        # Próximo início livre, alinhado à grade de vagas
+        proximo_livre[loja_id, dia] = inicio + passo * -(-timedelta(minutes=duracao) // passo)
+        if inicio < agora:
+            status = rng.choice(['CONCLUIDO', 'CONCLUIDO', 'CANCELADO'])
+        else:
+            status = rng.choice(STATUS_ATIVOS + ('CANCELADO',))
+        agendamentos.append(Agendamento(
+            usuario_id=rng.choice(usuarios)[0], loja_id=loja_id, produto_id=produto_id,
+            data_hora=inicio, status=status, duracao_minutos=duracao,
+        ))
+    Agendamento.objects.bulk_create(agendamentos, batch_size=lote)
+
+
+def _recalcular_derivados(lote):
+    """
+    Refaz o que os sinais manteriam a cada save(): agregados das
+    avaliações, totais de favoritos, resumos dos usuários, grade do mapa,
+    resumos de ofertas e vagas ocupadas.
+    """
+    call_command('recalcular_avaliacoes', stdout=io.StringIO())
+    loja_ids = list(Loja.objects.values_list('pk', flat=True))
+    for inicio in range(0, len(loja_ids), lote):
+        Loja.recontar_favoritos(loja_ids[inicio:inicio + lote])
+    call_command('recontar_resumos', stdout=io.StringIO())
+    reconstruir_indice()
+    ResumoOferta.reconstruir()
+    reconstruir_vagas()
+    # As versões em cache (páginas das lojas, categorias, lojistas) não
+    # sabem dos registros criados sem os sinais
+    cache.clear()
+
+
+def gerar(semente=42, lote=2000, **quantidades):
+    """
+    Gera o conjunto de dados (quantidades padrão em ``PADRAO``) e retorna
+    o número de registros de cada tabela.
+    """
+    quantidades = {**PADRAO, **quantidades}
+    rng = random.Random(semente)
+    with transaction.atomic():
+        usuarios = _criar_usuarios(quantidades['usuarios'], lote)
+        lojas = _criar_lojas(rng, quantidades['lojas'], usuarios, lote)
+        categorias = _criar_categorias(quantidades['categorias'])
+        _criar_produtos(rng, lojas, categorias, quantidades['produtos_por_loja'], lote)
+
+        usuario_ids = [pk for pk, _ in usuarios]
+        loja_ids = [pk for pk, _, _ in lojas]
+        Avaliacao.objects.bulk_create(
+            [
+                Avaliacao(loja_id=loja_id, usuario_id=usuario_id, nota=rng.choices([1, 2, 3, 4, 5], [1, 1, 2, 4, 5])[0],
+                          comentario=rng.choice(COMENTARIOS))
+                for loja_id, usuario_id in _pares_distintos(rng, quantidades['avaliacoes'], loja_ids, usuario_ids)
+            ],
+            batch_size=lote,
+        )
+        LojaFavorita.objects.bulk_create(
+            [
+                LojaFavorita(usuario_id=usuario_id, loja_id=loja_id)
+                for usuario_id, loja_id in _pares_distintos(rng, quantidades['favoritas'], usuario_ids, loja_ids)
+            ],
+            batch_size=lote,
+        )
+        _criar_agendamentos(rng, quantidades['agendamentos'], lojas, usuarios, lote)
+        _recalcular_derivados(lote)
+
+    sinteticas = Loja.objects.filter(email__endswith=f'@{DOMINIO}')
+    return {
+        'usuarios': len(usuarios),
+        'lojas': len(lojas),
+        'categorias': len(categorias),
+        'produtos': Produto.objects.filter(loja__in=sinteticas).count(),
+        'avaliacoes': Avaliacao.objects.filter(loja__in=sinteticas).count(),
+        'favoritas': LojaFavorita.objects.filter(loja__in=sinteticas).count(),
+        'agendamentos': Agendamento.objects.filter(loja__in=sinteticas).count(),
+    }
+
+
+def apagar():
+    """
+    Apaga os usuários e as lojas gerados (e, em cascata, o que depende
+    deles) e recalcula as tabelas derivadas.
+    """
+    with transaction.atomic():
+        Loja.objects.filter(email__endswith=f'@{DOMINIO}').delete()
+        User.objects.filter(email__endswith=f'@{DOMINIO}').delete()
+        ProdutoCanonico.objects.filter(produtos__isnull=True).delete()
+        _recalcular_derivados(2000)
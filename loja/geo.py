@@ -0,0 +1,254 @@
+"""
+Índice espacial das lojas baseado em geohash.
+
+Cada loja guarda o geohash da sua coordenada numa coluna indexada. Para
+buscar lojas próximas, a área de busca é coberta por algumas células de
+geohash; cada célula vira uma faixa no índice (``geohash >= prefixo`` e
+``geohash < prefixo + '{'``), então o banco só lê as lojas candidatas.
+A distância exata (Haversine) é calculada apenas para essas candidatas.
+"""
+import math
+
+from django.db.models import Q
+
+from produto.paginacao import PaginaCursor, codificar_cursor, decodificar_cursor
+
+RAIO_TERRA_KM = 6371.0
+PRECISAO_GEOHASH = 9
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# Caractere logo após o último do alfabeto ('z'), usado como limite
+# superior exclusivo das faixas de prefixo.
+_FIM_PREFIXO = '{'
+
+# Quantidade máxima de células usadas para cobrir a área de busca.
+_MAX_CELULAS = 16
+# Raio inicial e máximo (em km) da busca pelas k lojas mais próximas.
+_RAIO_INICIAL_KM = 2.0
+_RAIO_MAXIMO_KM = 2 * math.pi * RAIO_TERRA_KM
+_SALTO_SEM_LOJAS = 10
+# Maior raio aceito no filtro "lojas a até X km"
+RAIO_MAXIMO_BUSCA_KM = 500.0
+
+
+def codificar_geohash(latitude, longitude, precisao=PRECISAO_GEOHASH):
+    """
+    Retorna o geohash de uma coordenada com a precisão informada.
+    """
+    lat_min, lat_max = -90.0, 90.0
+    lon_min, lon_max = -180.0, 180.0
+    resultado = []
+    bits = 0
+    valor = 0
+    par = True  # Bits pares codificam a longitude
+    while len(resultado) < precisao:
+        if par:
+            meio = (lon_min + lon_max) / 2
+            if longitude >= meio:
+                valor = (valor << 1) | 1
+                lon_min = meio
+            else:
+                valor <<= 1
+                lon_max = meio
+        else:
+            meio = (lat_min + lat_max) / 2
+            if latitude >= meio:
+                valor = (valor << 1) | 1
+                lat_min = meio
+            else:
+                valor <<= 1
+                lat_max = meio
+        par = not par
+        bits += 1
+        if bits == 5:
+            resultado.append(_BASE32[valor])
+            bits = 0
+            valor = 0
+    return ''.join(resultado)
+
+
+def tamanho_celula(precisao):
+    """
+    Retorna (altura, largura) em graus de uma célula de geohash.
+    """
+    total_bits = 5 * precisao
+    bits_lon = (total_bits + 1) // 2
+    bits_lat = total_bits // 2
+    return 180.0 / (2 ** bits_lat), 360.0 / (2 ** bits_lon)
+
+
+def distancia_km(lat1, lon1, lat2, lon2):
+    """
+    Distância em km entre dois pontos pela fórmula de Haversine.
+    """
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * RAIO_TERRA_KM * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def caixas_envolventes(latitude, longitude, raio_km):
+    """
+    Retorna as caixas (lat_min, lat_max, lon_min, lon_max) que contêm o
+    círculo de raio ``raio_km`` em volta do ponto: uma, ou duas quando o
+    círculo cruza o antimeridiano (longitude ±180).
+    """
+    delta_lat = math.degrees(raio_km / RAIO_TERRA_KM)
+    lat_min = max(latitude - delta_lat, -90.0)
+    lat_max = min(latitude + delta_lat, 90.0)
+
+    cos_lat = math.cos(math.radians(max(abs(lat_min), abs(lat_max))))
+    if cos_lat < 1e-9:
+        return [(lat_min, lat_max, -180.0, 180.0)]
+    delta_lon = math.degrees(raio_km / (RAIO_TERRA_KM * cos_lat))
+    if delta_lon >= 180.0:
+        return [(lat_min, lat_max, -180.0, 180.0)]
+    lon_min, lon_max = longitude - delta_lon, longitude + delta_lon
+    if lon_min < -180.0:
+        return [(lat_min, lat_max, lon_min + 360.0, 180.0), (lat_min, lat_max, -180.0, lon_max)]
+    if lon_max > 180.0:
+        return [(lat_min, lat_max, lon_min, 180.0), (lat_min, lat_max, -180.0, lon_max - 360.0)]
+    return [(lat_min, lat_max, lon_min, lon_max)]
+
+
+def celulas_cobrindo(lat_min, lat_max, lon_min, lon_max):
+    """
+    Retorna os prefixos de geohash que cobrem a caixa, usando a maior
+    precisão que não passe de ``_MAX_CELULAS`` células.
+    """
+    for precisao in range(PRECISAO_GEOHASH, 0, -1):
+        altura, largura = tamanho_celula(precisao)
+        linhas = math.floor((lat_max + 90.0) / altura) - math.floor((lat_min + 90.0) / altura) + 1
+        colunas = math.floor((lon_max + 180.0) / largura) - math.floor((lon_min + 180.0) / largura) + 1
+        if linhas * colunas <= _MAX_CELULAS:
+            break
+    else:
+        return ['']
+
+    celulas = set()
+    primeira_linha = math.floor((lat_min + 90.0) / altura)
+    primeira_coluna = math.floor((lon_min + 180.0) / largura)
+    for i in range(linhas):
+        lat_centro = min(-90.0 + (primeira_linha + i + 0.5) * altura, 90.0)
+        for j in range(colunas):
+            lon_centro = min(-180.0 + (primeira_coluna + j + 0.5) * largura, 180.0)
+            celulas.add(codificar_geohash(lat_centro, lon_centro, precisao))
+    return sorted(celulas)
+
+
+def filtro_caixa(lat_min, lat_max, lon_min, lon_max):
+    """
+    Monta o filtro que usa o índice de geohash para restringir a busca à
+    caixa informada.
+    """
+    filtro_celulas = Q()
+    for prefixo in celulas_cobrindo(lat_min, lat_max, lon_min, lon_max):
+        if prefixo:
+            filtro_celulas |= Q(geohash__gte=prefixo, geohash__lt=prefixo + _FIM_PREFIXO)
+    return filtro_celulas & Q(
+        latitude__gte=lat_min, latitude__lte=lat_max,
+        longitude__gte=lon_min, longitude__lte=lon_max,
+    )
+
+
+def lojas_no_raio(queryset, latitude, longitude, raio_km):
+    """
+    Retorna as lojas a até ``raio_km`` do ponto, ordenadas pela distância.
+    Cada loja recebe o atributo ``distancia`` (em km).
+    """
+    filtro = Q()
+    for caixa in caixas_envolventes(latitude, longitude, raio_km):
+        filtro |= filtro_caixa(*caixa)
+    resultado = []
+    for loja in queryset.filter(filtro):
+        loja.distancia = distancia_km(latitude, longitude, loja.latitude, loja.longitude)
+        if loja.distancia <= raio_km:
+            resultado.append(loja)
+    resultado.sort(key=lambda loja: (loja.distancia, loja.pk))
+    return resultado
+
+
+def lojas_mais_proximas(queryset, latitude, longitude, k, raio_maximo_km=None, depois=None):
+    """
+    Retorna as ``k`` lojas mais próximas do ponto, ordenadas pela distância.
+    Com ``depois`` (distância, id de uma loja), só as que vêm depois dela
+    nessa ordem.
+
+    A busca começa num raio pequeno e aumenta até encontrar ``k`` lojas
+    dentro do raio (ou atingir ``raio_maximo_km``), de modo que só as
+    células vizinhas ao ponto são lidas do banco. O novo raio é estimado
+    pela densidade de lojas já encontrada (a área cresce com o quadrado
+    do raio), para não repetir a consulta a cada dobra.
+    """
+    if k <= 0:
+        return []
+    limite = raio_maximo_km if raio_maximo_km is not None else _RAIO_MAXIMO_KM
+    # Com ``depois``, o raio cresce a partir da distância da loja
+    inicio = depois[0] if depois is not None else 0
+    largura = _RAIO_INICIAL_KM
+    anteriores = 0
+    while True:
+        raio = min(inicio + largura, limite)
+        encontradas = lojas_no_raio(queryset, latitude, longitude, raio)
+        if depois is not None:
+            encontradas = [loja for loja in encontradas if (loja.distancia, loja.pk) > tuple(depois)]
+        if len(encontradas) >= k or raio >= limite:
+            return encontradas[:k]
+        if len(encontradas) > anteriores:
+            fator = max(math.sqrt(k / len(encontradas)) * 1.2, 2)
+        else:
+            # Nada de novo no último raio: a densidade não diz nada, salta
+            # mais longe
+            fator = _SALTO_SEM_LOJAS
+        anteriores = len(encontradas)
+        largura *= fator
+
+
+def _cursor_de_proximidade(token):
+    """
+    (valores, direção) de um cursor de ``paginar_por_proximidade``, ou None.
+    """
+    cursor = decodificar_cursor(token) if token else None
+    if cursor is None:
+        return None
+    valores, direcao = cursor
+    if (
+        direcao not in ('proximo', 'anterior') or len(valores) != 2
+        or not isinstance(valores[0], (int, float)) or not 0 <= valores[0] < math.inf
+        or not isinstance(valores[1], int) or isinstance(valores[1], bool)
+    ):
+        return None
+    return valores, direcao
+
+
+def paginar_por_proximidade(queryset, latitude, longitude, tamanho, token=None):
+    """
+    Retorna a ``PaginaCursor`` das lojas ordenadas pela distância ao ponto,
+    a partir do cursor (distância, id) da página vizinha, sem limite de
+    páginas. Cada página lê as lojas até a sua distância: só a área da
+    busca, e não o cálculo de todas as distâncias, cresce com a página.
+    """
+    cursor = _cursor_de_proximidade(token)
+    valores, direcao = cursor if cursor is not None else (None, 'proximo')
+    if direcao == 'anterior':
+        # As ``tamanho`` lojas imediatamente antes do cursor
+        antes = [
+            loja for loja in lojas_no_raio(queryset, latitude, longitude, valores[0])
+            if (loja.distancia, loja.pk) < tuple(valores)
+        ]
+        tem_mais = len(antes) > tamanho
+        itens = antes[-tamanho:]
+    else:
+        itens = lojas_mais_proximas(queryset, latitude, longitude, tamanho + 1, depois=valores)
+        tem_mais = len(itens) > tamanho
+        itens = itens[:tamanho]
+
+    anterior = proximo = None
+    if itens:
+        if (direcao == 'proximo' and tem_mais) or (direcao == 'anterior' and valores is not None):
+            proximo = codificar_cursor([itens[-1].distancia, itens[-1].pk], 'proximo')
+        if (direcao == 'anterior' and tem_mais) or (direcao == 'proximo' and valores is not None):
+            anterior = codificar_cursor([itens[0].distancia, itens[0].pk], 'anterior')
+    return PaginaCursor(itens, anterior, proximo)
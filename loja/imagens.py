@@ -0,0 +1,174 @@
+"""
+Derivados das imagens enviadas (fotos de lojas, produtos e carrossel).
+
+Para cada imagem são geradas versões redimensionadas em WebP e JPEG,
+gravadas ao lado do original:
+
+    loja/fotos/fachada.png
+    loja/fotos/fachada.320w.webp
+    loja/fotos/fachada.320w.jpg
+    ...
+    loja/fotos/fachada.derivados.json
+
+O arquivo ``.derivados.json`` é escrito por último e lista as larguras
+geradas; enquanto ele não existe os templates usam o original. A geração
+roda numa thread separada, depois do commit, para não atrasar o upload.
+"""
+import json
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import md5
+from io import BytesIO
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+LARGURAS = (320, 640, 1024, 1600)
+TEMPO_CACHE_MANIFESTO = 60 * 60 * 24
+# Imagens sem derivados são consultadas de novo depois desse prazo
+TEMPO_CACHE_SEM_MANIFESTO = 60
+
+# extensão: (formato do Pillow, tipo MIME, opções de gravação)
+FORMATOS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='derivados')
+
+
+def _base(nome):
+    raiz, _ = posixpath.splitext(nome)
+    return raiz
+
+
+def nome_manifesto(nome):
+    return f'{_base(nome)}.derivados.json'
+
+
+def nome_derivado(nome, largura, extensao):
+    return f'{_base(nome)}.{largura}w.{extensao}'
+
+
+def _chave_manifesto(nome):
+    # Nomes de arquivo podem ter espaços e acentos, que o memcached não aceita
+    return f'imagens:manifesto:{md5(nome.encode()).hexdigest()}'
+
+
+def manifesto(nome, storage=default_storage):
+    """
+    Retorna o manifesto dos derivados da imagem ({'larguras': [...]}) ou
+    None se eles ainda não foram gerados. O resultado fica em cache para
+    não acessar o storage a cada card renderizado.
+    """
+    if not nome:
+        return None
+    chave = _chave_manifesto(nome)
+    dados = cache.get(chave)
+    if dados is None:
+        try:
+            with storage.open(nome_manifesto(nome)) as arquivo:
+                dados = json.load(arquivo)
+        except (OSError, ValueError):
+            dados = {}
+        cache.set(chave, dados, TEMPO_CACHE_MANIFESTO if dados else TEMPO_CACHE_SEM_MANIFESTO)
+    return dados or None
+
+
+def _abrir(nome, storage):
+    with storage.open(nome) as arquivo:
+        imagem = Image.open(arquivo)
+        imagem.load()
+    return ImageOps.exif_transpose(imagem)
+
+
+def _converter(imagem, formato):
+    """
+    Ajusta o modo de cor para o formato. JPEG não tem transparência, então
+    as áreas transparentes viram branco.
+    """
+    tem_alfa = imagem.mode in ('RGBA', 'LA') or (imagem.mode == 'P' and 'transparency' in imagem.info)
+    if formato == 'JPEG':
+        if tem_alfa:
+            imagem = imagem.convert('RGBA')
+            fundo = Image.new('RGB', imagem.size, (255, 255, 255))
+            fundo.paste(imagem, mask=imagem.getchannel('A'))
+            return fundo
+        return imagem.convert('RGB')
+    return imagem.convert('RGBA' if tem_alfa else 'RGB')
+
+
+def _gravar(storage, destino, conteudo):
+    # O storage renomearia o arquivo se ele já existisse
+    if storage.exists(destino):
+        storage.delete(destino)
+    storage.save(destino, ContentFile(conteudo))
+
+
+def gerar_derivados(nome, storage=default_storage, forcar=False):
+    """
+    Gera os derivados da imagem e grava o manifesto. Larguras maiores que
+    a do original não são geradas (a própria largura original entra no
+    lugar delas). Retorna o manifesto.
+    """
+    if not forcar:
+        existente = manifesto(nome, storage)
+        if existente:
+            return existente
+
+    original = _abrir(nome, storage)
+    larguras = sorted({min(largura, original.width) for largura in LARGURAS})
+    for largura in larguras:
+        altura = max(1, round(original.height * largura / original.width))
+        redimensionada = original.resize((largura, altura), Image.LANCZOS)
+        for extensao, (formato, _, opcoes) in FORMATOS.items():
+            conteudo = BytesIO()
+            _converter(redimensionada, formato).save(conteudo, formato, **opcoes)
+            _gravar(storage, nome_derivado(nome, largura, extensao), conteudo.getvalue())
+
+    dados = {'larguras': larguras, 'largura_original': original.width}
+    _gravar(storage, nome_manifesto(nome), json.dumps(dados).encode())
+    cache.set(_chave_manifesto(nome), dados, TEMPO_CACHE_MANIFESTO)
+    return dados
+
+
+def _gerar_em_segundo_plano(nome):
+    try:
+        gerar_derivados(nome)
+    except Exception:
+        logger.exception('Falha ao gerar os derivados de %s', nome)
+
+
+def agendar_derivados(arquivo):
+    """
+    Agenda a geração dos derivados de um ``FieldFile`` para depois do
+    commit da transação atual, numa thread separada.
+    """
+    nome = getattr(arquivo, 'name', arquivo)
+    if not nome or manifesto(nome):
+        return
+    transaction.on_commit(lambda: _executor.submit(_gerar_em_segundo_plano, nome))
+
+
+def agendar_se_mudou(instance, campo, update_fields=None):
+    """
+    Para os receptores de ``post_save``: agenda os derivados do arquivo do
+    ``campo`` só se ele mudou desde que o registro foi lido (guardado em
+    ``_<campo>_salva`` pelo ``from_db`` do modelo) ou salvo pela última
+    vez. Os saves que não tocam no arquivo (ex: contadores) não agendam
+    nada.
+    """
+    if update_fields is not None and campo not in update_fields:
+        return
+    nome = getattr(instance, campo).name or ''
+    atributo = f'_{campo}_salva'
+    if getattr(instance, atributo, None) == nome:
+        return
+    setattr(instance, atributo, nome)
+    agendar_derivados(nome)
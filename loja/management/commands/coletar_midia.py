@@ -0,0 +1,103 @@
+import os
+import posixpath
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from loja.armazenamento import CAMPOS_COM_ARQUIVOS, PREFIXO
+from loja.models import ArquivoMidia
+
+
+class Command(BaseCommand):
+    help = "Remove os arquivos de mídia sem referências (e seus derivados)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recontar',
+            action='store_true',
+            help="Recalcula as referências a partir dos registros antes de coletar.",
+        )
+        parser.add_argument(
+            '--horas',
+            type=int,
+            default=24,
+            help="Só remove arquivos sem referências enviados pela última vez há mais que isso (padrão: 24).",
+        )
+        parser.add_argument(
+            '--simular',
+            action='store_true',
+            help="Apenas lista o que seria removido.",
+        )
+
+    def handle(self, *args, **options):
+        if options['recontar']:
+            self.recontar()
+
+        limite = timezone.now() - timedelta(hours=options['horas'])
+        # O prazo conta do último upload, não da criação: um upload que
+        # reaproveitou um arquivo antigo ainda não gravou a referência
+        orfaos = ArquivoMidia.objects.filter(referencias=0, enviado_em__lt=limite)
+        removidos = liberados = 0
+        for arquivo in orfaos.iterator():
+            if options['simular']:
+                self.stdout.write(f"{arquivo.nome} ({arquivo.tamanho} bytes)")
+            # As condições são repetidas no DELETE para não remover um
+            # arquivo que foi reenviado ou ganhou uma referência depois da
+            # consulta
+            elif orfaos.filter(pk=arquivo.pk).delete()[0]:
+                self.remover_arquivos(arquivo.nome)
+            else:
+                continue
+            removidos += 1
+            liberados += arquivo.tamanho
+
+        if not options['simular']:
+            self.limpar_temporarios(options['horas'])
+        verbo = "seriam removidos" if options['simular'] else "removidos"
+        self.stdout.write(self.style.SUCCESS(
+            f"{removidos} arquivos {verbo} ({liberados / 1024 / 1024:.1f} MB)."
+        ))
+
+    def recontar(self):
+        contagem = Counter()
+        for modelo, campos in CAMPOS_COM_ARQUIVOS:
+            for valores in modelo._default_manager.values_list(*campos).iterator():
+                contagem.update(nome for nome in valores if nome)
+
+        alterados = []
+        for arquivo in ArquivoMidia.objects.only('id', 'nome', 'referencias').iterator():
+            referencias = contagem.get(arquivo.nome, 0)
+            if arquivo.referencias != referencias:
+                arquivo.referencias = referencias
+                alterados.append(arquivo)
+        ArquivoMidia.objects.bulk_update(alterados, ['referencias'], batch_size=1000)
+        self.stdout.write(f"Referências recontadas ({len(alterados)} corrigidas).")
+
+    def remover_arquivos(self, nome):
+        """
+        Remove o arquivo e os derivados gravados ao lado dele
+        (``<hash>.320w.webp``, ``<hash>.derivados.json``...).
+        """
+        diretorio, arquivo = posixpath.split(nome)
+        base = posixpath.splitext(arquivo)[0]
+        try:
+            _, arquivos = default_storage.listdir(diretorio)
+        except FileNotFoundError:
+            return
+        for irmao in arquivos:
+            if irmao == arquivo or irmao.startswith(base + '.'):
+                default_storage.delete(posixpath.join(diretorio, irmao))
+
+    def limpar_temporarios(self, horas):
+        # Sobras de uploads interrompidos
+        diretorio = default_storage.path(posixpath.join(PREFIXO, 'tmp'))
+        if not os.path.isdir(diretorio):
+            return
+        limite = time.time() - horas * 3600
+        for arquivo in os.scandir(diretorio):
+            if arquivo.is_file() and arquivo.stat().st_mtime < limite:
+                os.remove(arquivo.path)
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from loja.dados_sinteticos import DOMINIO, PADRAO, SENHA, apagar, gerar
+from loja.models import Loja
+
+
+class Command(BaseCommand):
+    help = (
+        "Gera um conjunto de dados sintético e reproduzível (lojas, produtos, usuários, "
+        "avaliações, favoritas e agendamentos) para medir o sistema em escala."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--semente', type=int, default=42, help="Mesma semente, mesmos dados.")
+        for nome, padrao in PADRAO.items():
+            parser.add_argument(f"--{nome.replace('_', '-')}", type=int, default=padrao, dest=nome)
+        parser.add_argument('--lote', type=int, default=2000, help="Registros por INSERT.")
+        parser.add_argument(
+            '--limpar',
+            action='store_true',
+            help="Apaga antes os dados sintéticos gerados anteriormente.",
+        )
+        parser.add_argument(
+            '--apenas-limpar',
+            action='store_true',
+            help="Só apaga os dados sintéticos, sem gerar novos.",
+        )
+
+    def handle(self, *args, **options):
+        existentes = Loja.objects.filter(email__endswith=f'@{DOMINIO}').exists()
+        if options['limpar'] or options['apenas_limpar']:
+            if existentes:
+                apagar()
+                self.stdout.write("Dados sintéticos anteriores apagados.")
+            if options['apenas_limpar']:
+                return
+        elif existentes:
+            raise CommandError("Já existem dados sintéticos no banco; use --limpar para gerar de novo.")
+
+        totais = gerar(
+            semente=options['semente'],
+            lote=options['lote'],
+            **{nome: options[nome] for nome in PADRAO},
+        )
+        for tabela, total in totais.items():
+            self.stdout.write(f"{tabela}: {total}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Dados gerados com a semente {options['semente']}. "
+            f"Os usuários são sintetico<N>, com a senha '{SENHA}'."
+        ))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from loja.imagens import gerar_derivados
+from loja.models import CarouselImage, Loja
+from produto.models import Produto
+
+
+class Command(BaseCommand):
+    help = "Gera os derivados (WebP/JPEG em várias larguras) das fotos de lojas, produtos e carrossel."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--forcar',
+            action='store_true',
+            help="Gera de novo mesmo as imagens que já têm derivados.",
+        )
+
+    def handle(self, *args, **options):
+        fontes = [
+            (Loja, 'foto'),
+            (Produto, 'foto'),
+            (CarouselImage, 'image'),
+        ]
+        gerados = falhas = 0
+        for modelo, campo in fontes:
+            nomes = (
+                modelo.objects.exclude(**{f'{campo}__isnull': True}).exclude(**{campo: ''})
+                .values_list(campo, flat=True).distinct()
+            )
+            for nome in nomes.iterator():
+                try:
+                    gerar_derivados(nome, forcar=options['forcar'])
+                    gerados += 1
+                except (OSError, ValueError) as erro:
+                    falhas += 1
+                    self.stderr.write(f"{nome}: {erro}")
+        self.stdout.write(self.style.SUCCESS(f"{gerados} imagens processadas, {falhas} falhas."))
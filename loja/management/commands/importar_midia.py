@@ -0,0 +1,59 @@
+import posixpath
+
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from loja.armazenamento import CAMPOS_COM_ARQUIVOS, PREFIXO, ArmazenamentoPorConteudo, ajustar_referencias
+
+
+class Command(BaseCommand):
+    help = (
+        "Move as mídias enviadas antes do armazenamento por conteúdo para ele, "
+        "deduplicando os arquivos repetidos e atualizando os registros."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--apagar-originais',
+            action='store_true',
+            help="Apaga os arquivos antigos depois de importados.",
+        )
+
+    def handle(self, *args, **options):
+        if not isinstance(default_storage, ArmazenamentoPorConteudo):
+            raise CommandError("O storage padrão (STORAGES['default']) não é o ArmazenamentoPorConteudo.")
+        importados = {}
+        atualizados = 0
+        for modelo, campos in CAMPOS_COM_ARQUIVOS:
+            for campo in campos:
+                antigos = (
+                    modelo._default_manager.exclude(**{f'{campo}__isnull': True})
+                    .exclude(**{campo: ''}).exclude(**{f'{campo}__startswith': PREFIXO + '/'})
+                    .values_list(campo, flat=True).distinct()
+                )
+                for antigo in list(antigos):
+                    if antigo not in importados:
+                        if not default_storage.exists(antigo):
+                            self.stderr.write(f"{antigo}: arquivo não encontrado, ignorado.")
+                            continue
+                        with default_storage.open(antigo) as conteudo:
+                            nome_upload = default_storage.generate_filename(posixpath.basename(antigo))
+                            importados[antigo] = default_storage.save(nome_upload, conteudo)
+                    novo = importados[antigo]
+                    with transaction.atomic():
+                        total = modelo._default_manager.filter(**{campo: antigo}).update(**{campo: novo})
+                        ajustar_referencias(novo, total)
+                    atualizados += total
+
+        if atualizados:
+            # O resumo das ofertas guarda uma cópia do nome das fotos
+            call_command('reconstruir_resumo_ofertas', verbosity=0)
+        if options['apagar_originais']:
+            for antigo in importados:
+                default_storage.delete(antigo)
+        economia = len(importados) - len(set(importados.values()))
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(importados)} arquivos importados ({economia} duplicados), {atualizados} registros atualizados."
+        ))
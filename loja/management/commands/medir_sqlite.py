@@ -0,0 +1,117 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from petcareapp.sqlite import PRAGMAS, TEMPO_ESPERA_LOCK, comandos_iniciais
+
+MODOS = {
+    # Padrão do SQLite: journal de rollback, synchronous=FULL
+    'padrao': {},
+    'producao': PRAGMAS,
+}
+
+
+def _conectar(caminho, pragmas):
+    conexao = sqlite3.connect(caminho, timeout=TEMPO_ESPERA_LOCK, isolation_level=None, check_same_thread=False)
+    for comando in comandos_iniciais(pragmas).split(';'):
+        if comando.strip():
+            conexao.execute(comando)
+    return conexao
+
+
+def _preparar(caminho, pragmas, linhas):
+    conexao = _conectar(caminho, pragmas)
+    conexao.execute('CREATE TABLE loja (id INTEGER PRIMARY KEY, nome TEXT, nota REAL, favoritos INTEGER)')
+    conexao.execute('CREATE INDEX loja_nota ON loja (nota)')
+    conexao.execute('BEGIN')
+    conexao.executemany(
+        'INSERT INTO loja (nome, nota, favoritos) VALUES (?, ?, 0)',
+        ((f'Loja {i}', random.uniform(1, 5)) for i in range(linhas)),
+    )
+    conexao.execute('COMMIT')
+    conexao.close()
+
+
+def _rodar(caminho, pragmas, linhas, segundos, leitores, escritores):
+    """
+    Roda leitores e escritores juntos por ``segundos`` e retorna
+    (leituras por segundo, escritas por segundo).
+    """
+    parar = threading.Event()
+    contagem = {'leituras': 0, 'escritas': 0}
+    trava = threading.Lock()
+
+    def ler():
+        conexao = _conectar(caminho, pragmas)
+        feitas = 0
+        while not parar.is_set():
+            # Como a página da loja e a listagem: por id e por faixa de nota
+            conexao.execute('SELECT * FROM loja WHERE id = ?', (random.randint(1, linhas),)).fetchall()
+            nota = random.uniform(1, 4.9)
+            conexao.execute('SELECT id, nome FROM loja WHERE nota BETWEEN ? AND ? LIMIT 12', (nota, nota + 0.1)).fetchall()
+            feitas += 1
+        conexao.close()
+        with trava:
+            contagem['leituras'] += feitas
+
+    def escrever():
+        conexao = _conectar(caminho, pragmas)
+        feitas = 0
+        while not parar.is_set():
+            # Como um favorito: insere/atualiza e ajusta o contador na mesma transação
+            conexao.execute('BEGIN IMMEDIATE')
+            loja_id = random.randint(1, linhas)
+            conexao.execute('UPDATE loja SET favoritos = favoritos + 1 WHERE id = ?', (loja_id,))
+            conexao.execute('UPDATE loja SET nota = ? WHERE id = ?', (random.uniform(1, 5), loja_id))
+            conexao.execute('COMMIT')
+            feitas += 1
+        conexao.close()
+        with trava:
+            contagem['escritas'] += feitas
+
+    threads = [threading.Thread(target=ler) for _ in range(leitores)]
+    threads += [threading.Thread(target=escrever) for _ in range(escritores)]
+    for thread in threads:
+        thread.start()
+    time.sleep(segundos)
+    parar.set()
+    for thread in threads:
+        thread.join()
+    return contagem['leituras'] / segundos, contagem['escritas'] / segundos
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede a vazão de leituras do SQLite sem e com escritas concorrentes, "
+        "no modo padrão e no modo de produção (WAL e PRAGMAs de petcareapp/sqlite.py). "
+        "Usa um banco temporário; o banco do projeto não é tocado."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--segundos', type=float, default=3)
+        parser.add_argument('--leitores', type=int, default=4)
+        parser.add_argument('--escritores', type=int, default=2)
+        parser.add_argument('--linhas', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{options['leitores']} leitor(es), {options['escritores']} escritor(es), "
+            f"{options['segundos']}s por medição\n"
+        )
+        self.stdout.write(f"{'modo':<10} {'leituras/s':>12} {'c/ escrita':>12} {'variação':>9} {'escritas/s':>11}")
+        with tempfile.TemporaryDirectory() as diretorio:
+            for nome, pragmas in MODOS.items():
+                caminho = os.path.join(diretorio, f'{nome}.sqlite3')
+                _preparar(caminho, pragmas, options['linhas'])
+                args = (caminho, pragmas, options['linhas'], options['segundos'], options['leitores'])
+                sozinho, _ = _rodar(*args, 0)
+                concorrente, escritas = _rodar(*args, options['escritores'])
+                variacao = (concorrente - sozinho) / sozinho * 100
+                self.stdout.write(
+                    f"{nome:<10} {sozinho:>12.0f} {concorrente:>12.0f} {variacao:>+8.0f}% {escritas:>11.0f}"
+                )
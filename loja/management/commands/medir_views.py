@@ -0,0 +1,247 @@
+import json
+import logging
+import subprocess
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.test import Client, override_settings
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from loja.dados_sinteticos import CATEGORIA_SERVICOS, CENTRO, DIAS_AGENDAMENTOS, DOMINIO, PADRAO, gerar
+from loja.models import Loja, LojaFavorita
+from petcareapp.instrumentacao import RegistroDeConsultas
+from produto.models import Produto
+
+# Aumentos acima disso na mediana contam como regressão na comparação
+TOLERANCIA_LATENCIA = 0.2
+
+
+def _percentil(valores, percentil):
+    ordenados = sorted(valores)
+    indice = max(0, min(len(ordenados) - 1, round(percentil / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+
+def _commit_atual():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Caso:
+    """
+    Uma requisição medida. As que gravam (``metodo`` POST) rodam dentro de
+    uma transação desfeita no fim, para que todas as repetições encontrem
+    o mesmo banco.
+    """
+
+    def __init__(self, nome, usuario, url, metodo='get', dados=None, tipo_conteudo=None):
+        self.nome = nome
+        self.usuario = usuario
+        self.url = url
+        self.metodo = metodo
+        self.dados = dados
+        self.tipo_conteudo = tipo_conteudo
+
+    def executar(self, cliente):
+        kwargs = {'content_type': self.tipo_conteudo} if self.tipo_conteudo else {}
+        requisicao = getattr(cliente, self.metodo)
+        if self.metodo == 'get':
+            return requisicao(self.url, self.dados, **kwargs)
+        with transaction.atomic():
+            resposta = requisicao(self.url, self.dados, **kwargs)
+            transaction.set_rollback(True)
+        return resposta
+
+
+def _casos():
+    """
+    As URLs de loja/urls.py, produto/urls.py e dos agendamentos, com os
+    registros sintéticos usados em cada uma.
+    """
+    loja = Loja.objects.filter(email__endswith=f'@{DOMINIO}').order_by('pk').first()
+    if loja is None:
+        raise CommandError("Não há dados sintéticos no banco; rode o comando gerar_dados.")
+    lojista = User.objects.get(email=loja.email)
+    cliente = (
+        User.objects.filter(email__endswith=f'@{DOMINIO}').exclude(pk=lojista.pk)
+        .filter(favoritos_lojas__isnull=False, agendamentos__isnull=False).order_by('pk').first()
+    ) or lojista
+    admin, _ = User.objects.get_or_create(
+        username='admin-medicao', defaults={'is_superuser': True, 'is_staff': True, 'email': f'admin@{DOMINIO}'}
+    )
+    produto = Produto.objects.filter(loja=loja).exclude(categoria__nome=CATEGORIA_SERVICOS).order_by('pk').first()
+    servico = Produto.objects.filter(loja=loja, categoria__nome=CATEGORIA_SERVICOS).order_by('pk').first()
+    favoritas = list(LojaFavorita.objects.filter(usuario=cliente).values_list('loja_id', flat=True)[:5])
+    # Um dia depois do último agendamento gerado: todos os horários livres
+    dia_livre = timezone.localdate() + timedelta(days=DIAS_AGENDAMENTOS + 7)
+    horario_livre = datetime.combine(dia_livre, loja.horario_abertura)
+
+    casos = [
+        Caso('loja:loja_list', cliente, reverse('loja:loja_list')),
+        Caso('loja:loja_list (busca)', cliente, reverse('loja:loja_list'), dados={'q': 'Pet Shop 1'}),
+        Caso('loja:loja_create', cliente, reverse('loja:loja_create')),
+        Caso('loja:loja_detail', cliente, reverse('loja:loja_detail', args=[loja.pk])),
+        Caso('loja:avaliar-loja', cliente, reverse('loja:avaliar-loja', args=[loja.pk]), 'post',
+             {'nota': 4, 'comentario': 'Medição.'}),
+        Caso('loja:favoritar-loja', cliente, reverse('loja:favoritar-loja', args=[loja.pk]), 'post'),
+        Caso('loja:sincronizar-favoritas', cliente, reverse('loja:sincronizar-favoritas'), 'post',
+             json.dumps({'favoritas': {str(loja_id): False for loja_id in favoritas} | {str(loja.pk): True}}),
+             'application/json'),
+        Caso('loja:mapa_marcadores', cliente, reverse('loja:mapa_marcadores'), dados={
+            'bbox': f'{CENTRO[1] - 0.5},{CENTRO[0] - 0.5},{CENTRO[1] + 0.5},{CENTRO[0] + 0.5}', 'zoom': 11,
+        }),
+        Caso('loja:perfil_usuario', cliente, reverse('loja:perfil_usuario')),
+        Caso('produto:produto_list', cliente, reverse('produto:produto_list')),
+        Caso('produto:produto_list (busca)', cliente, reverse('produto:produto_list'), dados={'q': 'racao golden'}),
+        Caso('produto:produto_list_json', cliente, reverse('produto:produto_list_json')),
+        Caso('produto:produto_create', lojista, reverse('produto:produto_create')),
+        Caso('produto:produto_detail', cliente, reverse('produto:produto_detail', args=[produto.pk])),
+        Caso('produto:produto_update', lojista, reverse('produto:produto_update', args=[produto.pk])),
+        Caso('produto:categoria_create_ajax', admin, reverse('produto:categoria_create_ajax'), 'post',
+             {'nome': 'Categoria da medição'}),
+        Caso('agendamento:listar_agendamento', cliente, reverse('agendamento:listar_agendamento')),
+        Caso('agendamento:criar_agendamento', cliente, reverse('agendamento:criar_agendamento', args=[loja.pk])),
+        Caso('agendamento:criar_agendamento (POST)', cliente,
+             reverse('agendamento:criar_agendamento', args=[loja.pk]), 'post',
+             {'produto': servico.pk, 'data_hora': horario_livre.strftime('%Y-%m-%dT%H:%M'), 'observacoes': ''}),
+        Caso('agendamento:horarios_disponiveis', cliente,
+             reverse('agendamento:horarios_disponiveis', args=[loja.pk]),
+             dados={'produto': servico.pk, 'inicio': dia_livre.isoformat()}),
+    ]
+    return casos
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede a latência (percentis) e o número de consultas de cada view com o cliente de "
+        "testes, sobre um banco de testes com dados sintéticos, e grava o resultado em JSON "
+        "para comparar entre commits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeticoes', type=int, default=20, help="Medições por view.")
+        parser.add_argument('--aquecimento', type=int, default=2, help="Requisições descartadas antes de medir.")
+        parser.add_argument('--semente', type=int, default=42)
+        parser.add_argument(
+            '--escala', type=float, default=1.0,
+            help="Multiplica as quantidades padrão de gerar_dados (lojas, usuários, avaliações...).",
+        )
+        parser.add_argument('--saida', help="Arquivo JSON onde gravar as medições.")
+        parser.add_argument('--comparar', help="JSON de uma medição anterior para comparar.")
+        parser.add_argument(
+            '--banco-atual',
+            action='store_true',
+            help="Mede no banco configurado (já com gerar_dados) em vez de criar um banco de testes.",
+        )
+
+    def handle(self, *args, **options):
+        quantidades = {
+            nome: valor if nome in ('categorias', 'produtos_por_loja') else max(1, int(valor * options['escala']))
+            for nome, valor in PADRAO.items()
+        }
+        setup_test_environment(debug=False)
+        configuracao = None
+        try:
+            if not options['banco_atual']:
+                configuracao = setup_databases(verbosity=0, interactive=False)
+                self.stdout.write("Gerando dados sintéticos...")
+                gerar(semente=options['semente'], **quantidades)
+            resultados = self._medir(options['repeticoes'], options['aquecimento'])
+        finally:
+            if configuracao is not None:
+                teardown_databases(configuracao, verbosity=0)
+            teardown_test_environment()
+
+        medicao = {
+            'commit': _commit_atual(),
+            'data': timezone.now().isoformat(timespec='seconds'),
+            'semente': options['semente'],
+            'quantidades': None if options['banco_atual'] else quantidades,
+            'repeticoes': options['repeticoes'],
+            'views': resultados,
+        }
+        self._mostrar(resultados, options['comparar'])
+        if options['saida']:
+            with open(options['saida'], 'w', encoding='utf-8') as arquivo:
+                json.dump(medicao, arquivo, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Medições gravadas em {options['saida']}."))
+
+    def _medir(self, repeticoes, aquecimento):
+        resultados = {}
+        clientes = {}
+        # Os erros 500 (ex: template ausente) ficam no status da medição
+        logging.getLogger('django.request').disabled = True
+        try:
+            # A contagem é feita aqui; o middleware só duplicaria o trabalho.
+            # Sem DEBUG, o armazenamento com manifesto exigiria o collectstatic.
+            with override_settings(
+                INSTRUMENTACAO_SQL=False,
+                ALLOWED_HOSTS=['*'],
+                STORAGES={**settings.STORAGES, 'staticfiles': {
+                    'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+                }},
+            ):
+                for caso in _casos():
+                    cliente = clientes.get(caso.usuario.pk)
+                    if cliente is None:
+                        cliente = clientes[caso.usuario.pk] = Client(raise_request_exception=False)
+                        cliente.force_login(caso.usuario)
+                    for _ in range(aquecimento):
+                        caso.executar(cliente)
+                    tempos = []
+                    for _ in range(repeticoes):
+                        registro = RegistroDeConsultas(getattr(settings, 'SQL_LIMITE_REPETICOES', 5))
+                        inicio = time.perf_counter()
+                        with connections['default'].execute_wrapper(registro):
+                            resposta = caso.executar(cliente)
+                        tempos.append((time.perf_counter() - inicio) * 1000)
+                    resultados[caso.nome] = {
+                        'metodo': caso.metodo.upper(),
+                        'url': caso.url,
+                        'status': resposta.status_code,
+                        'consultas': registro.total,
+                        'formas_repetidas': len(registro.repetidas),
+                        'p50_ms': round(_percentil(tempos, 50), 2),
+                        'p90_ms': round(_percentil(tempos, 90), 2),
+                        'p99_ms': round(_percentil(tempos, 99), 2),
+                        'media_ms': round(sum(tempos) / len(tempos), 2),
+                    }
+        finally:
+            logging.getLogger('django.request').disabled = False
+        return resultados
+
+    def _mostrar(self, resultados, comparar):
+        anteriores = {}
+        if comparar:
+            with open(comparar, encoding='utf-8') as arquivo:
+                anteriores = json.load(arquivo)['views']
+        self.stdout.write(f"{'view':<42} {'status':>6} {'consultas':>9} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8}")
+        regressoes = 0
+        for nome, medida in resultados.items():
+            linha = (
+                f"{nome:<42} {medida['status']:>6} {medida['consultas']:>9} "
+                f"{medida['p50_ms']:>8.1f} {medida['p90_ms']:>8.1f} {medida['p99_ms']:>8.1f}"
+            )
+            anterior = anteriores.get(nome)
+            if anterior:
+                variacao = (medida['p50_ms'] - anterior['p50_ms']) / anterior['p50_ms'] if anterior['p50_ms'] else 0
+                linha += f"  p50 {variacao:+.0%}, consultas {medida['consultas'] - anterior['consultas']:+d}"
+                if medida['consultas'] > anterior['consultas'] or variacao > TOLERANCIA_LATENCIA:
+                    regressoes += 1
+                    linha = self.style.WARNING(linha + '  (regressão)')
+            if medida['formas_repetidas']:
+                linha += f"  [{medida['formas_repetidas']} possível(is) N+1]"
+            self.stdout.write(linha)
+        if comparar:
+            self.stdout.write(f"{regressoes} regressão(ões) em relação a {comparar}.")
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Sum
+
+from loja.models import Avaliacao, Loja, media_das_notas
+
+
+class Command(BaseCommand):
+    help = "Recalcula a soma, a quantidade e a média das avaliações de cada loja."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verificar',
+            action='store_true',
+            help="Apenas compara os agregados salvos com as avaliações, sem alterar nada.",
+        )
+
+    def handle(self, *args, **options):
+        agregados = {
+            linha['loja']: (linha['soma'], linha['total'])
+            for linha in Avaliacao.objects.values('loja').annotate(soma=Sum('nota'), total=Count('id'))
+        }
+
+        divergentes = []
+        campos = ('id', 'nome', 'avaliacao_soma', 'avaliacao_total', 'avaliacao_media')
+        for loja in Loja.objects.only(*campos).iterator(chunk_size=2000):
+            soma, total = agregados.get(loja.id, (0, 0))
+            media = media_das_notas(soma, total)
+            if (loja.avaliacao_soma, loja.avaliacao_total, loja.avaliacao_media) != (soma, total, media):
+                divergentes.append(loja)
+                loja.avaliacao_soma, loja.avaliacao_total, loja.avaliacao_media = soma, total, media
+
+        if options['verificar']:
+            for loja in divergentes:
+                self.stdout.write(f"Divergente: {loja.nome} (id {loja.id})")
+            if divergentes:
+                raise CommandError(f"{len(divergentes)} loja(s) com agregados divergentes.")
+            self.stdout.write(self.style.SUCCESS("Todos os agregados de avaliação estão corretos."))
+            return
+
+        Loja.objects.bulk_update(
+            divergentes, ['avaliacao_soma', 'avaliacao_total', 'avaliacao_media'], batch_size=500
+        )
+        self.stdout.write(self.style.SUCCESS(f"{len(divergentes)} loja(s) atualizada(s)."))
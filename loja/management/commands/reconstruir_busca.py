@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from loja.busca import INDICES
+
+
+class Command(BaseCommand):
+    help = "Reconstrói os índices de busca textual (FTS5) de lojas e produtos."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recriar',
+            action='store_true',
+            help="Apaga e cria de novo as tabelas e os gatilhos do índice antes de reindexar.",
+        )
+        parser.add_argument('--database', default='default', help="Banco de dados a reindexar.")
+
+    def handle(self, *args, **options):
+        using = options['database']
+        for indice in INDICES:
+            if not indice.disponivel(using):
+                self.stdout.write(f"{indice.tabela}: banco sem suporte a FTS5, ignorado.")
+                continue
+            indice.reconstruir(using, recriar=options['recriar'])
+            self.stdout.write(self.style.SUCCESS(f"{indice.tabela}: índice reconstruído."))
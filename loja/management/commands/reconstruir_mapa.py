@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from loja.mapa import reconstruir_indice
+
+
+class Command(BaseCommand):
+    help = "Recalcula a grade de agrupamento das lojas usada pelo mapa."
+
+    def handle(self, *args, **options):
+        total = reconstruir_indice()
+        self.stdout.write(self.style.SUCCESS(f"{total} célula(s) gerada(s)."))
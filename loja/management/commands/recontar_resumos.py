@@ -0,0 +1,82 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from agendamento.models import STATUS_ATIVOS, Agendamento
+from loja.models import Avaliacao, LojaFavorita, ResumoUsuario
+
+CAMPOS = ('total_favoritos', 'total_avaliacoes', 'total_proximos_agendamentos', 'inicio_proximo_agendamento')
+
+
+def _totais(queryset, campo):
+    return dict(queryset.values(campo).annotate(total=Count('*')).values_list(campo, 'total'))
+
+
+def _confere(resumo, totais, agora):
+    """
+    Os contadores salvos batem com os calculados. Com o início do próximo
+    agendamento vencido, o total de próximos será recontado pelo perfil e
+    não é comparado; o início salvo pode ser anterior ao real (o agendamento
+    dele pode ter sido cancelado), nunca posterior.
+    """
+    favoritos, avaliacoes, proximos, inicio = totais
+    if (resumo.total_favoritos, resumo.total_avaliacoes) != (favoritos, avaliacoes):
+        return False
+    salvo = resumo.inicio_proximo_agendamento
+    if salvo is not None and salvo <= agora:
+        return True
+    return resumo.total_proximos_agendamentos == proximos and (inicio is None or (salvo is not None and salvo <= inicio))
+
+
+class Command(BaseCommand):
+    help = "Recalcula os contadores de favoritas, avaliações e próximos agendamentos de cada usuário."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verificar',
+            action='store_true',
+            help="Apenas compara os contadores salvos com as tabelas, sem alterar nada.",
+        )
+
+    def handle(self, *args, **options):
+        agora = timezone.now()
+        favoritos = _totais(LojaFavorita.objects, 'usuario_id')
+        avaliacoes = _totais(Avaliacao.objects, 'usuario_id')
+        proximos = {
+            usuario_id: (total, inicio)
+            for usuario_id, total, inicio in (
+                Agendamento.objects.filter(status__in=STATUS_ATIVOS, data_hora__gt=agora)
+                .values('usuario_id').annotate(total=Count('*'), inicio=Min('data_hora'))
+                .values_list('usuario_id', 'total', 'inicio')
+            )
+        }
+        salvos = {resumo.pk: resumo for resumo in ResumoUsuario.objects.all()}
+
+        divergentes, novos = [], []
+        for pk in User.objects.values_list('pk', flat=True).iterator(chunk_size=2000):
+            totais = (favoritos.get(pk, 0), avaliacoes.get(pk, 0), *proximos.get(pk, (0, None)))
+            resumo = salvos.get(pk)
+            if resumo is None:
+                novos.append(ResumoUsuario(usuario_id=pk, **dict(zip(CAMPOS, totais))))
+            elif options['verificar']:
+                if not _confere(resumo, totais, agora):
+                    divergentes.append(resumo)
+            elif tuple(getattr(resumo, campo) for campo in CAMPOS) != totais:
+                for campo, total in zip(CAMPOS, totais):
+                    setattr(resumo, campo, total)
+                divergentes.append(resumo)
+
+        if options['verificar']:
+            for resumo in divergentes:
+                self.stdout.write(f"Divergente: usuário {resumo.pk}")
+            if divergentes:
+                raise CommandError(f"{len(divergentes)} usuário(s) com contadores divergentes.")
+            self.stdout.write(self.style.SUCCESS("Todos os contadores dos usuários estão corretos."))
+            return
+
+        ResumoUsuario.objects.bulk_create(novos, batch_size=2000)
+        ResumoUsuario.objects.bulk_update(divergentes, CAMPOS, batch_size=500)
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(divergentes)} resumo(s) atualizado(s) e {len(novos)} criado(s)."
+        ))
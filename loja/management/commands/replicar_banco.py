@@ -0,0 +1,36 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from petcareapp.replicas import replicar
+
+
+class Command(BaseCommand):
+    help = (
+        "Copia o SQLite primário para as réplicas de leitura locais "
+        "(REPLICAS_SQLITE_LOCAIS), no papel da replicação de um banco de verdade."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--intervalo',
+            type=float,
+            default=0,
+            help="Repete a cópia a cada N segundos (0 copia uma vez e sai).",
+        )
+
+    def handle(self, *args, **options):
+        replicas = [
+            alias for alias in settings.REPLICAS_DE_LEITURA
+            if settings.DATABASES[alias]['ENGINE'] == 'django.db.backends.sqlite3'
+        ]
+        if not replicas or settings.DATABASES['default']['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError("Nenhuma réplica SQLite local configurada (REPLICAS_SQLITE_LOCAIS).")
+        while True:
+            for alias in replicas:
+                replicar(alias)
+            self.stdout.write(f"{len(replicas)} réplica(s) atualizada(s).")
+            if not options['intervalo']:
+                break
+            time.sleep(options['intervalo'])
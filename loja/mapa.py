@@ -0,0 +1,160 @@
+"""
+Agrupamento (clustering) das lojas no mapa, feito no servidor.
+
+Para cada nível de zoom até ``ZOOM_LOJAS_INDIVIDUAIS - 1`` o mundo é
+dividido numa grade em Web Mercator com células de ``PIXELS_CELULA``
+pixels de tela. A tabela ``CelulaMapa`` guarda, por célula, quantas lojas
+ela tem e a soma das coordenadas, então o mapa de um país inteiro é
+respondido lendo só as células visíveis (uma faixa do índice
+``(zoom, x, y)``), sem percorrer as lojas. A grade é atualizada a cada
+loja salva ou excluída. A partir de ``ZOOM_LOJAS_INDIVIDUAIS`` as lojas
+são retornadas uma a uma, pelo índice de geohash.
+"""
+import math
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .geo import filtro_caixa
+from .models import CelulaMapa, Loja
+
+ZOOM_LOJAS_INDIVIDUAIS = 15
+PIXELS_CELULA = 64
+# log2(256 / PIXELS_CELULA): células por lado de um tile de 256px
+_BITS_CELULA = int(math.log2(256 // PIXELS_CELULA))
+LATITUDE_MAXIMA = 85.05112878
+MAXIMO_LOJAS_INDIVIDUAIS = 500
+# Mais células que isso não cabem numa tela (64 x 64 células de 64px);
+# uma área maior no mesmo zoom é recusada
+MAXIMO_CELULAS = 64 * 64
+
+
+def celula(latitude, longitude, zoom):
+    """
+    Retorna (x, y) da célula da grade do zoom que contém a coordenada.
+    """
+    n = 2 ** (zoom + _BITS_CELULA)
+    latitude = max(min(latitude, LATITUDE_MAXIMA), -LATITUDE_MAXIMA)
+    x = int((longitude + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def _ajustar_celula(zoom, x, y, latitude, longitude, delta):
+    alteracao = {
+        'total': F('total') + delta,
+        'soma_latitude': F('soma_latitude') + delta * latitude,
+        'soma_longitude': F('soma_longitude') + delta * longitude,
+    }
+    if CelulaMapa.objects.filter(zoom=zoom, x=x, y=y).update(**alteracao) or delta < 0:
+        return
+    try:
+        with transaction.atomic():
+            CelulaMapa.objects.create(
+                zoom=zoom, x=x, y=y, total=delta,
+                soma_latitude=delta * latitude, soma_longitude=delta * longitude,
+            )
+    except IntegrityError:
+        # Criada por outra requisição ao mesmo tempo
+        CelulaMapa.objects.filter(zoom=zoom, x=x, y=y).update(**alteracao)
+
+
+def ajustar_indice(latitude, longitude, delta):
+    """
+    Soma (delta=1) ou retira (delta=-1) uma loja das células de todos os
+    níveis de zoom.
+    """
+    if latitude is None or longitude is None:
+        return
+    with transaction.atomic():
+        for zoom in range(ZOOM_LOJAS_INDIVIDUAIS):
+            x, y = celula(latitude, longitude, zoom)
+            _ajustar_celula(zoom, x, y, latitude, longitude, delta)
+
+
+def reconstruir_indice(batch_size=2000):
+    """
+    Recalcula toda a grade a partir das lojas cadastradas. Retorna o
+    número de células geradas.
+    """
+    celulas = {}
+    lojas = Loja.objects.filter(latitude__isnull=False, longitude__isnull=False)
+    for latitude, longitude in lojas.values_list('latitude', 'longitude').iterator(chunk_size=batch_size):
+        for zoom in range(ZOOM_LOJAS_INDIVIDUAIS):
+            chave = (zoom,) + celula(latitude, longitude, zoom)
+            atual = celulas.get(chave)
+            if atual is None:
+                atual = celulas[chave] = CelulaMapa(zoom=zoom, x=chave[1], y=chave[2])
+            atual.total += 1
+            atual.soma_latitude += latitude
+            atual.soma_longitude += longitude
+    with transaction.atomic():
+        CelulaMapa.objects.all().delete()
+        CelulaMapa.objects.bulk_create(celulas.values(), batch_size=batch_size)
+    return len(celulas)
+
+
+def _faixas_x(oeste, leste, zoom):
+    """
+    Faixas de x cobertas pela longitude; são duas quando a área visível
+    cruza o antimeridiano (oeste > leste).
+    """
+    n = 2 ** (zoom + _BITS_CELULA)
+    if oeste > leste:
+        return [(celula(0, oeste, zoom)[0], n - 1), (0, celula(0, leste, zoom)[0])]
+    return [(celula(0, oeste, zoom)[0], celula(0, leste, zoom)[0])]
+
+
+def total_celulas(sul, oeste, norte, leste, zoom):
+    """
+    Quantas células da grade do zoom a área visível cobre (zero a partir
+    de ``ZOOM_LOJAS_INDIVIDUAIS``, em que as lojas vêm uma a uma).
+    """
+    zoom = max(0, int(zoom))
+    if zoom >= ZOOM_LOJAS_INDIVIDUAIS:
+        return 0
+    linhas = celula(sul, 0, zoom)[1] - celula(norte, 0, zoom)[1] + 1
+    return linhas * sum(x_max - x_min + 1 for x_min, x_max in _faixas_x(oeste, leste, zoom))
+
+
+def marcadores(sul, oeste, norte, leste, zoom):
+    """
+    Retorna os marcadores da área visível no zoom informado: grupos
+    (total e centróide de cada célula) ou, nos zooms mais altos, as
+    próprias lojas.
+    """
+    zoom = max(0, int(zoom))
+    if zoom >= ZOOM_LOJAS_INDIVIDUAIS:
+        return _lojas_individuais(sul, oeste, norte, leste)
+
+    y_min = celula(norte, 0, zoom)[1]
+    y_max = celula(sul, 0, zoom)[1]
+    resultado = []
+    for x_min, x_max in _faixas_x(oeste, leste, zoom):
+        celulas = CelulaMapa.objects.filter(
+            zoom=zoom, x__gte=x_min, x__lte=x_max, y__gte=y_min, y__lte=y_max, total__gt=0,
+        ).values_list('x', 'y', 'total', 'soma_latitude', 'soma_longitude')
+        for x, y, total, soma_latitude, soma_longitude in celulas:
+            resultado.append({
+                'tipo': 'grupo',
+                'celula': f'{zoom}/{x}/{y}',
+                'total': total,
+                'latitude': round(soma_latitude / total, 6),
+                'longitude': round(soma_longitude / total, 6),
+            })
+    return resultado
+
+
+def _lojas_individuais(sul, oeste, norte, leste):
+    if oeste > leste:
+        caixas = [(sul, norte, oeste, 180.0), (sul, norte, -180.0, leste)]
+    else:
+        caixas = [(sul, norte, oeste, leste)]
+    resultado = []
+    for caixa in caixas:
+        lojas = (
+            Loja.objects.filter(filtro_caixa(*caixa))
+            .order_by('pk').values('id', 'nome', 'latitude', 'longitude')[:MAXIMO_LOJAS_INDIVIDUAIS]
+        )
+        resultado.extend({'tipo': 'loja', **loja} for loja in lojas)
+    return resultado[:MAXIMO_LOJAS_INDIVIDUAIS]
@@ -0,0 +1,60 @@
+from django.db import migrations, models
+
+# Cópia do geohash de loja/geo.py no momento desta migração (a migração
+# não deve depender do código atual)
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def codificar_geohash(latitude, longitude, precisao=9):
+    lat_min, lat_max = -90.0, 90.0
+    lon_min, lon_max = -180.0, 180.0
+    resultado = []
+    bits = valor = 0
+    par = True  # Bits pares codificam a longitude
+    while len(resultado) < precisao:
+        if par:
+            meio = (lon_min + lon_max) / 2
+            if longitude >= meio:
+                valor = (valor << 1) | 1
+                lon_min = meio
+            else:
+                valor <<= 1
+                lon_max = meio
+        else:
+            meio = (lat_min + lat_max) / 2
+            if latitude >= meio:
+                valor = (valor << 1) | 1
+                lat_min = meio
+            else:
+                valor <<= 1
+                lat_max = meio
+        par = not par
+        bits += 1
+        if bits == 5:
+            resultado.append(_BASE32[valor])
+            bits = valor = 0
+    return ''.join(resultado)
+
+
+def preencher_geohash(apps, schema_editor):
+    Loja = apps.get_model('loja', 'Loja')
+    lojas = Loja.objects.filter(latitude__isnull=False, longitude__isnull=False)
+    for loja in lojas.iterator():
+        loja.geohash = codificar_geohash(loja.latitude, loja.longitude)
+        loja.save(update_fields=['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loja', '0012_loja_latitude_loja_longitude'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loja',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=12),
+        ),
+        migrations.RunPython(preencher_geohash, migrations.RunPython.noop),
+    ]
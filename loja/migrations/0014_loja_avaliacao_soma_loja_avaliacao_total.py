@@ -0,0 +1,46 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+# Cópia de loja.models.media_das_notas no momento desta migração (a
+# migração não deve depender do código atual): metade para cima, como o
+# ROUND do banco, e não o arredondamento do round() do Python
+def media_das_notas(soma, total):
+    if not total:
+        return 0
+    return float((Decimal(soma) / Decimal(total)).quantize(Decimal('0.1'), rounding=ROUND_HALF_UP))
+
+
+def preencher_agregados(apps, schema_editor):
+    Loja = apps.get_model('loja', 'Loja')
+    Avaliacao = apps.get_model('loja', 'Avaliacao')
+    agregados = Avaliacao.objects.values('loja').annotate(soma=Sum('nota'), total=Count('id'))
+    for linha in agregados:
+        Loja.objects.filter(pk=linha['loja']).update(
+            avaliacao_soma=linha['soma'],
+            avaliacao_total=linha['total'],
+            avaliacao_media=media_das_notas(linha['soma'], linha['total']),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loja', '0013_loja_geohash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loja',
+            name='avaliacao_soma',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='loja',
+            name='avaliacao_total',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(preencher_agregados, migrations.RunPython.noop),
+    ]
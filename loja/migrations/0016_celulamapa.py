@@ -0,0 +1,60 @@
+import math
+
+from django.db import migrations, models
+
+# Cópia da grade de loja/mapa.py no momento desta migração (a migração não
+# deve depender do código atual)
+ZOOM_LOJAS_INDIVIDUAIS = 15
+BITS_CELULA = 2
+LATITUDE_MAXIMA = 85.05112878
+
+
+def celula(latitude, longitude, zoom):
+    n = 2 ** (zoom + BITS_CELULA)
+    latitude = max(min(latitude, LATITUDE_MAXIMA), -LATITUDE_MAXIMA)
+    x = int((longitude + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def preencher_celulas(apps, schema_editor):
+    Loja = apps.get_model('loja', 'Loja')
+    CelulaMapa = apps.get_model('loja', 'CelulaMapa')
+    celulas = {}
+    lojas = Loja.objects.filter(latitude__isnull=False, longitude__isnull=False)
+    for latitude, longitude in lojas.values_list('latitude', 'longitude').iterator():
+        for zoom in range(ZOOM_LOJAS_INDIVIDUAIS):
+            chave = (zoom,) + celula(latitude, longitude, zoom)
+            atual = celulas.setdefault(chave, CelulaMapa(zoom=zoom, x=chave[1], y=chave[2]))
+            atual.total += 1
+            atual.soma_latitude += latitude
+            atual.soma_longitude += longitude
+    CelulaMapa.objects.bulk_create(celulas.values(), batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loja', '0015_arquivomidia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CelulaMapa',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zoom', models.PositiveSmallIntegerField()),
+                ('x', models.PositiveIntegerField()),
+                ('y', models.PositiveIntegerField()),
+                ('total', models.IntegerField(default=0)),
+                ('soma_latitude', models.FloatField(default=0)),
+                ('soma_longitude', models.FloatField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Célula do Mapa',
+                'verbose_name_plural': 'Células do Mapa',
+                'unique_together': {('zoom', 'x', 'y')},
+            },
+        ),
+        migrations.RunPython(preencher_celulas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:28
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loja', '0016_celulamapa'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loja',
+            name='capacidade_agendamentos',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Quantos agendamentos a loja atende ao mesmo tempo.', validators=[django.core.validators.MinValueValidator(1)], verbose_name='Atendimentos simultâneos'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def _totais(queryset, campo):
+    return dict(queryset.values(campo).annotate(total=Count('*')).values_list(campo, 'total'))
+
+
+def preencher_resumos(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    Loja = apps.get_model('loja', 'Loja')
+    Avaliacao = apps.get_model('loja', 'Avaliacao')
+    Agendamento = apps.get_model('agendamento', 'Agendamento')
+    ResumoUsuario = apps.get_model('loja', 'ResumoUsuario')
+    favoritos = _totais(Loja.favoritada_por.through.objects, 'user_id')
+    avaliacoes = _totais(Avaliacao.objects, 'usuario_id')
+    agendamentos = _totais(Agendamento.objects.filter(status__in=('PENDENTE', 'CONFIRMADO')), 'usuario_id')
+    ResumoUsuario.objects.bulk_create(
+        [
+            ResumoUsuario(
+                usuario_id=pk,
+                total_favoritos=favoritos.get(pk, 0),
+                total_avaliacoes=avaliacoes.get(pk, 0),
+                total_agendamentos_ativos=agendamentos.get(pk, 0),
+            )
+            for pk in User.objects.values_list('pk', flat=True).iterator()
+        ],
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('loja', '0017_loja_capacidade_agendamentos'),
+        ('agendamento', '0002_vagahorario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoUsuario',
+            fields=[
+                ('usuario', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='resumo', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('total_favoritos', models.PositiveIntegerField(default=0)),
+                ('total_avaliacoes', models.PositiveIntegerField(default=0)),
+                ('total_agendamentos_ativos', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Resumo do Usuário',
+                'verbose_name_plural': 'Resumos dos Usuários',
+            },
+        ),
+        migrations.RunPython(preencher_resumos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def copiar_favoritas(apps, schema_editor):
+    """
+    Copia as favoritas da tabela automática de ``favoritada_por`` para
+    ``LojaFavorita``, que passa a ser a tabela intermediária.
+    """
+    Loja = apps.get_model('loja', 'Loja')
+    LojaFavorita = apps.get_model('loja', 'LojaFavorita')
+    antigas = Loja.favoritada_por.through.objects.values_list('user_id', 'loja_id')
+    LojaFavorita.objects.bulk_create(
+        [LojaFavorita(usuario_id=usuario_id, loja_id=loja_id) for usuario_id, loja_id in antigas.iterator()],
+        batch_size=2000,
+        ignore_conflicts=True,
+    )
+
+
+def _total(LojaFavorita, campo, referencia):
+    return Coalesce(
+        Subquery(
+            LojaFavorita.objects.filter(**{campo: OuterRef(referencia)})
+            .values(campo).annotate(total=Count('*')).values('total')
+        ),
+        0,
+    )
+
+
+def preencher_totais(apps, schema_editor):
+    Loja = apps.get_model('loja', 'Loja')
+    LojaFavorita = apps.get_model('loja', 'LojaFavorita')
+    ResumoUsuario = apps.get_model('loja', 'ResumoUsuario')
+    Loja.objects.update(total_favoritos=_total(LojaFavorita, 'loja_id', 'pk'))
+    # As favoritas que só existiam em LojaFavorita agora também contam
+    ResumoUsuario.objects.update(total_favoritos=_total(LojaFavorita, 'usuario_id', 'usuario_id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loja', '0018_resumousuario'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loja',
+            name='total_favoritos',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(copiar_favoritas, migrations.RunPython.noop),
+        # O Django não troca a tabela intermediária de um ManyToManyField
+        # existente: o campo é removido e criado de novo com through
+        migrations.RemoveField(
+            model_name='loja',
+            name='favoritada_por',
+        ),
+        migrations.AddField(
+            model_name='loja',
+            name='favoritada_por',
+            field=models.ManyToManyField(blank=True, related_name='lojas_favoritadas', through='loja.LojaFavorita', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(preencher_totais, migrations.RunPython.noop),
+    ]
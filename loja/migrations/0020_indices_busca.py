@@ -0,0 +1,64 @@
+from django.db import migrations
+
+# Cópia do SQL de loja/busca.py no momento desta migração (a migração não
+# deve depender do código atual). Os "IF NOT EXISTS" aceitam bancos em que
+# o índice já tinha sido criado pelo antigo gancho do post_migrate.
+INDICES = [
+    # (tabela do modelo, tabela FTS5, colunas)
+    ('loja_loja', 'loja_loja_busca', ['nome', 'endereco']),
+    ('produto_produto', 'produto_produto_busca', ['nome']),
+]
+
+
+def _criacao(modelo, tabela, colunas):
+    lista = ', '.join(colunas)
+    novas = ', '.join(f'new.{coluna}' for coluna in colunas)
+    antigas = ', '.join(f'old.{coluna}' for coluna in colunas)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {tabela} USING fts5({lista}, content='{modelo}', "
+        f"content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS {tabela}_ai AFTER INSERT ON {modelo} BEGIN "
+        f"INSERT INTO {tabela}(rowid, {lista}) VALUES (new.id, {novas}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {tabela}_ad AFTER DELETE ON {modelo} BEGIN "
+        f"INSERT INTO {tabela}({tabela}, rowid, {lista}) VALUES ('delete', old.id, {antigas}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {tabela}_au AFTER UPDATE OF {lista} ON {modelo} BEGIN "
+        f"INSERT INTO {tabela}({tabela}, rowid, {lista}) VALUES ('delete', old.id, {antigas}); "
+        f"INSERT INTO {tabela}(rowid, {lista}) VALUES (new.id, {novas}); END",
+        f"INSERT INTO {tabela}({tabela}) VALUES ('rebuild')",
+    ]
+
+
+def _remocao(tabela):
+    return [
+        f'DROP TRIGGER IF EXISTS {tabela}_ai',
+        f'DROP TRIGGER IF EXISTS {tabela}_ad',
+        f'DROP TRIGGER IF EXISTS {tabela}_au',
+        f'DROP TABLE IF EXISTS {tabela}',
+    ]
+
+
+class RunSQLSomenteSQLite(migrations.RunSQL):
+    """
+    O FTS5 só existe no SQLite; nos outros bancos a busca usa icontains.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'sqlite':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'sqlite':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loja', '0019_favoritas_consolidadas'),
+        ('produto', '0007_produto_sku'),
+    ]
+
+    operations = [
+        RunSQLSomenteSQLite(sql=_criacao(modelo, tabela, colunas), reverse_sql=_remocao(tabela))
+        for modelo, tabela, colunas in INDICES
+    ]
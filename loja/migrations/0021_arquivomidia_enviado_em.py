@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:17
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loja', '0020_indices_busca'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='arquivomidia',
+            name='enviado_em',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
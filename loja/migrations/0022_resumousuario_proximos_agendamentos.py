@@ -0,0 +1,46 @@
+from django.db import migrations, models
+from django.db.models import Count, Min
+from django.utils import timezone
+
+
+def recontar_proximos(apps, schema_editor):
+    Agendamento = apps.get_model('agendamento', 'Agendamento')
+    ResumoUsuario = apps.get_model('loja', 'ResumoUsuario')
+    # Cópia de ``STATUS_ATIVOS`` no momento desta migração (a migração não
+    # deve depender do código atual)
+    proximos = {
+        usuario_id: (total, inicio)
+        for usuario_id, total, inicio in (
+            Agendamento.objects.filter(status__in=('PENDENTE', 'CONFIRMADO'), data_hora__gt=timezone.now())
+            .values('usuario_id').annotate(total=Count('*'), inicio=Min('data_hora'))
+            .values_list('usuario_id', 'total', 'inicio')
+        )
+    }
+    resumos = list(ResumoUsuario.objects.all())
+    for resumo in resumos:
+        resumo.total_proximos_agendamentos, resumo.inicio_proximo_agendamento = proximos.get(resumo.pk, (0, None))
+    ResumoUsuario.objects.bulk_update(
+        resumos, ['total_proximos_agendamentos', 'inicio_proximo_agendamento'], batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loja', '0021_arquivomidia_enviado_em'),
+        ('agendamento', '0003_agendamento_duracao_minutos'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='resumousuario',
+            old_name='total_agendamentos_ativos',
+            new_name='total_proximos_agendamentos',
+        ),
+        migrations.AddField(
+            model_name='resumousuario',
+            name='inicio_proximo_agendamento',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(recontar_proximos, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,25 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, F, FloatField, Min, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Greatest, Least, Round
+from django.db.models.lookups import GreaterThan
 from datetime import time
+from decimal import ROUND_HALF_UP, Decimal
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
+
+from .geo import codificar_geohash
+
+
+def media_das_notas(soma, total):
+    """
+    Média com uma casa, arredondada como o ROUND do banco (metade para
+    cima) usado em ``Loja.ajustar_avaliacoes``; o ``round`` do Python
+    arredonda 3,25 para 3,2.
+    """
+    if not total:
+        return 0
+    return float((Decimal(soma) / Decimal(total)).quantize(Decimal('0.1'), rounding=ROUND_HALF_UP))
 
 
 
@@ -19,6 +37,12 @@ class Loja(models.Model):
         default=False, 
         verbose_name="Atende Emergências (24h)"
     )
+    capacidade_agendamentos = models.PositiveSmallIntegerField(
+        default=1,
+        validators=[MinValueValidator(1)],
+        verbose_name="Atendimentos simultâneos",
+        help_text="Quantos agendamentos a loja atende ao mesmo tempo."
+    )
     descricao = models.TextField(
         blank=True, 
         null=True, 
@@ -33,20 +57,90 @@ class Loja(models.Model):
         null=True, 
         verbose_name="Foto da Loja"
     )
+    latitude = models.FloatField(blank=True, null=True)
+    longitude = models.FloatField(blank=True, null=True)
+    geohash = models.CharField(max_length=12, blank=True, default='', db_index=True, editable=False)
     avaliacao_media = models.FloatField(default=0)
-    favoritada_por = models.ManyToManyField(User, related_name='lojas_favoritadas', blank=True)
+    # Soma e quantidade das notas, mantidas a cada avaliação criada,
+    # editada ou excluída para que a média não precise ser recalculada
+    avaliacao_soma = models.PositiveIntegerField(default=0, editable=False)
+    avaliacao_total = models.PositiveIntegerField(default=0, editable=False)
+    favoritada_por = models.ManyToManyField(
+        User, through='LojaFavorita', related_name='lojas_favoritadas', blank=True
+    )
+    # Mantido por ``LojaFavorita.alternar`` e pelos sinais de favoritada_por
+    total_favoritos = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.nome
 
-    def atualizar_media(self):
-        avaliacoes = self.avaliacoes.all()
-        if avaliacoes.exists():
-            media = sum(a.nota for a in avaliacoes) / avaliacoes.count()
-            self.avaliacao_media = round(media, 1)
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Guarda a coordenada carregada para atualizar o índice do mapa
+        if 'latitude' in field_names and 'longitude' in field_names:
+            instance._coordenada_salva = (instance.latitude, instance.longitude)
+        # E a foto, para só gerar os derivados quando ela muda
+        instance._foto_salva = instance.__dict__.get('foto')
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Mantém o geohash (usado no índice espacial) em dia com a coordenada
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = codificar_geohash(self.latitude, self.longitude)
         else:
-            self.avaliacao_media = 0
-        self.save()
+            self.geohash = ''
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def ajustar_avaliacoes(cls, loja_id, delta_soma, delta_total):
+        """
+        Aplica uma variação na soma e na quantidade de notas da loja e
+        recalcula a média no mesmo UPDATE, sem ler as avaliações.
+        """
+        soma = F('avaliacao_soma') + delta_soma
+        total = F('avaliacao_total') + delta_total
+        cls.objects.filter(pk=loja_id).update(
+            avaliacao_soma=soma,
+            avaliacao_total=total,
+            avaliacao_media=Case(
+                When(GreaterThan(total, 0), then=Round(Cast(soma, FloatField()) / total, 1)),
+                default=Value(0.0),
+                output_field=FloatField(),
+            ),
+        )
+
+    @classmethod
+    def recontar_favoritos(cls, loja_ids):
+        """
+        Recalcula o total de favoritos das lojas com um único UPDATE.
+        Usado quando não se sabe quantos favoritos mudaram (ex: ``clear()``).
+        """
+        loja_ids = list(loja_ids)
+        if not loja_ids:
+            return
+        favoritos = (
+            LojaFavorita.objects
+            .filter(loja_id=OuterRef('pk'))
+            .values('loja_id')
+            .annotate(total=Count('*'))
+            .values('total')
+        )
+        cls.objects.filter(pk__in=loja_ids).update(total_favoritos=Coalesce(Subquery(favoritos), 0))
+
+    def atualizar_media(self):
+        """
+        Recalcula do zero a soma, a quantidade e a média das notas da loja.
+        Usado pelo comando ``recalcular_avaliacoes``.
+        """
+        agregado = self.avaliacoes.aggregate(soma=Sum('nota'), total=Count('id'))
+        self.avaliacao_soma = agregado['soma'] or 0
+        self.avaliacao_total = agregado['total']
+        self.avaliacao_media = media_das_notas(self.avaliacao_soma, self.avaliacao_total)
+        self.save(update_fields=['avaliacao_soma', 'avaliacao_total', 'avaliacao_media'])
 
 class CarouselImage(models.Model):
     """
@@ -65,6 +159,14 @@ class CarouselImage(models.Model):
     def __str__(self):
         return self.caption_title or f"Imagem {self.id}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Guarda a imagem carregada, para só gerar os derivados quando ela
+        # muda (e não a cada mudança de ordem no admin)
+        instance._image_salva = instance.__dict__.get('image')
+        return instance
+
 
 class Avaliacao(models.Model):
     loja = models.ForeignKey(Loja, on_delete=models.CASCADE, related_name='avaliacoes')
@@ -81,17 +183,225 @@ class Avaliacao(models.Model):
     def __str__(self):
         return f"{self.loja.nome} - {self.nota}⭐"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Guarda a nota carregada para calcular a diferença ao salvar
+        instance._nota_salva = instance.__dict__.get('nota')
+        return instance
+
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        self.loja.atualizar_media()
+        criando = self._state.adding
+        nota_anterior = getattr(self, '_nota_salva', None)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if criando:
+                Loja.ajustar_avaliacoes(self.loja_id, self.nota, 1)
+            elif nota_anterior is not None and nota_anterior != self.nota:
+                Loja.ajustar_avaliacoes(self.loja_id, self.nota - nota_anterior, 0)
+        self._nota_salva = self.nota
 
 class LojaFavorita(models.Model):
+    """
+    Loja favoritada por um usuário; tabela intermediária de
+    ``Loja.favoritada_por``.
+    """
     usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='favoritos_lojas')
     loja = models.ForeignKey('Loja', on_delete=models.CASCADE, related_name='favoritos_relacionados')
     criado_em = models.DateTimeField(auto_now_add=True)
 
     class Meta:
+        # O índice único atende a consulta das favoritas de um usuário e o
+        # favoritar/desfavoritar; as do lado da loja usam o índice da FK
         unique_together = ('usuario', 'loja')
 
     def __str__(self):
-        return f"{self.usuario.username} ❤️ {self.loja.nome}"
\ No newline at end of file
+        return f"{self.usuario.username} ❤️ {self.loja.nome}"
+
+    @classmethod
+    def alternar(cls, usuario_id, loja_id, favoritar=None):
+        """
+        Favorita (``favoritar=True``), desfavorita (``False``) ou inverte o
+        estado atual (``None``) com um DELETE ou INSERT pelo índice único,
+        atualizando os contadores na mesma transação. Retorna
+        (favoritada, total_favoritos da loja); levanta
+        ``Loja.DoesNotExist`` se a loja não existe.
+        """
+        with transaction.atomic():
+            delta = 0
+            favoritada = bool(favoritar)
+            if favoritar is not True:
+                # Sem sinais ligados a este modelo, o delete() é um único DELETE
+                removidas, _ = cls.objects.filter(usuario_id=usuario_id, loja_id=loja_id).delete()
+                delta = -removidas
+            if favoritar is None and not delta:
+                favoritada = True
+            if favoritada:
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(usuario_id=usuario_id, loja_id=loja_id)
+                    delta = 1
+                except IntegrityError:
+                    # Já era favorita
+                    pass
+            if not Loja.objects.filter(pk=loja_id).update(
+                total_favoritos=Greatest(F('total_favoritos') + delta, Value(0))
+            ):
+                raise Loja.DoesNotExist
+            if delta:
+                ResumoUsuario.ajustar(usuario_id, total_favoritos=delta)
+            total = Loja.objects.filter(pk=loja_id).values_list('total_favoritos', flat=True).get()
+        return favoritada, total
+
+
+class ArquivoMidia(models.Model):
+    """
+    Arquivo de mídia guardado uma única vez, no caminho derivado do hash
+    do conteúdo (ver ``loja.armazenamento``). ``referencias`` conta quantos
+    registros apontam para ele; arquivos sem referências são removidos
+    pelo comando ``coletar_midia``.
+    """
+    hash = models.CharField(max_length=64, unique=True)
+    nome = models.CharField(max_length=255, unique=True)
+    tamanho = models.PositiveBigIntegerField()
+    referencias = models.PositiveIntegerField(default=0)
+    criado_em = models.DateTimeField(auto_now_add=True)
+    # Último upload com este conteúdo: entre o upload e o save do registro
+    # que aponta para o arquivo, ele ainda tem zero referências
+    enviado_em = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Arquivo de Mídia"
+        verbose_name_plural = "Arquivos de Mídia"
+
+    def __str__(self):
+        return self.nome
+
+
+class CelulaMapa(models.Model):
+    """
+    Célula da grade de agrupamento do mapa num nível de zoom: quantas
+    lojas caem nela e a soma das coordenadas (para o centróide). Mantida
+    pelos sinais de ``Loja`` (ver ``loja.mapa``).
+    """
+    zoom = models.PositiveSmallIntegerField()
+    x = models.PositiveIntegerField()
+    y = models.PositiveIntegerField()
+    total = models.IntegerField(default=0)
+    soma_latitude = models.FloatField(default=0)
+    soma_longitude = models.FloatField(default=0)
+
+    class Meta:
+        # O índice único também atende as consultas por zoom e faixa de x
+        unique_together = ('zoom', 'x', 'y')
+        verbose_name = "Célula do Mapa"
+        verbose_name_plural = "Células do Mapa"
+
+    def __str__(self):
+        return f"z{self.zoom} ({self.x}, {self.y}): {self.total}"
+
+
+
+class ResumoUsuario(models.Model):
+    """
+    Contadores das atividades de um usuário (lojas favoritas, avaliações e
+    próximos agendamentos), mantidos pelos sinais a cada escrita para que o
+    perfil não precise contar as tabelas.
+
+    Os próximos agendamentos também mudam com o tempo, sem escrita: o
+    resumo guarda o início do primeiro agendamento contado e, quando ele
+    passa, ``do_usuario`` reconta o total.
+    """
+    usuario = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='resumo')
+    total_favoritos = models.PositiveIntegerField(default=0)
+    total_avaliacoes = models.PositiveIntegerField(default=0)
+    # Pendentes ou confirmados que ainda não começaram
+    total_proximos_agendamentos = models.PositiveIntegerField(default=0)
+    # Início do primeiro dos próximos agendamentos (ou antes dele, se esse
+    # foi cancelado): a partir daí o total está vencido
+    inicio_proximo_agendamento = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Resumo do Usuário"
+        verbose_name_plural = "Resumos dos Usuários"
+
+    def __str__(self):
+        return f"Resumo de {self.usuario_id}"
+
+    @classmethod
+    def _garantir(cls, usuario_ids):
+        cls.objects.bulk_create([cls(usuario_id=pk) for pk in usuario_ids], ignore_conflicts=True)
+
+    @classmethod
+    def ajustar(cls, usuario_id, inicio_proximo=None, **deltas):
+        """
+        Soma as variações aos contadores do usuário, no mesmo UPDATE
+        (ex: ``ajustar(user.pk, total_avaliacoes=1)``). ``inicio_proximo``
+        é o início de um agendamento que passou a ser contado nos próximos.
+        """
+        # Só os aumentos criam o resumo: as reduções também chegam pelas
+        # exclusões em cascata do próprio usuário, depois que o resumo dele
+        # já foi apagado (e um resumo ausente é recontado em ``do_usuario``)
+        if any(delta > 0 for delta in deltas.values()):
+            cls._garantir([usuario_id])
+        campos = {campo: Greatest(F(campo) + delta, Value(0)) for campo, delta in deltas.items()}
+        if inicio_proximo is not None:
+            campos['inicio_proximo_agendamento'] = Least(
+                Coalesce(F('inicio_proximo_agendamento'), Value(inicio_proximo)), Value(inicio_proximo),
+            )
+        if campos:
+            cls.objects.filter(pk=usuario_id).update(**campos)
+
+    @classmethod
+    def recontar_favoritos(cls, usuario_ids):
+        """
+        Recalcula o total de favoritas dos usuários com um único UPDATE.
+        Usado quando não se sabe quantas favoritas mudaram (ex: ``clear()``).
+        """
+        usuario_ids = list(usuario_ids)
+        if not usuario_ids:
+            return
+        cls._garantir(usuario_ids)
+        favoritas = (
+            LojaFavorita.objects
+            .filter(usuario_id=OuterRef('usuario_id'))
+            .values('usuario_id')
+            .annotate(total=Count('*'))
+            .values('total')
+        )
+        cls.objects.filter(pk__in=usuario_ids).update(total_favoritos=Coalesce(Subquery(favoritas), 0))
+
+    @classmethod
+    def do_usuario(cls, usuario):
+        """
+        Retorna o resumo do usuário, calculando-o do zero se ainda não existe
+        e recontando os próximos agendamentos se algum deles já começou.
+        """
+        resumo = cls.objects.filter(pk=usuario.pk).first()
+        if resumo is None:
+            resumo = cls(usuario=usuario)
+            resumo.recontar()
+        elif resumo.inicio_proximo_agendamento is not None and resumo.inicio_proximo_agendamento <= timezone.now():
+            resumo.recontar_proximos()
+            resumo.save(update_fields=['total_proximos_agendamentos', 'inicio_proximo_agendamento'])
+        return resumo
+
+    def recontar_proximos(self):
+        from agendamento.models import STATUS_ATIVOS, Agendamento
+
+        proximos = Agendamento.objects.filter(
+            usuario_id=self.usuario_id, status__in=STATUS_ATIVOS, data_hora__gt=timezone.now(),
+        )
+        totais = proximos.aggregate(total=Count('*'), inicio=Min('data_hora'))
+        self.total_proximos_agendamentos = totais['total']
+        self.inicio_proximo_agendamento = totais['inicio']
+
+    def recontar(self):
+        """
+        Recalcula todos os contadores a partir das tabelas.
+        Usado pelo comando ``recontar_resumos``.
+        """
+        self.total_favoritos = LojaFavorita.objects.filter(usuario_id=self.usuario_id).count()
+        self.total_avaliacoes = Avaliacao.objects.filter(usuario_id=self.usuario_id).count()
+        self.recontar_proximos()
+        self.save()
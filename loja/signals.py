@@ -0,0 +1,167 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from petcareapp.identidade import invalidar_usuario
+
+from .armazenamento import registrar_referencias
+from .cache import (
+    invalidar_carrossel, invalidar_loja, invalidar_lojas_favoritas, invalidar_lojistas, invalidar_total_favoritos,
+)
+from .imagens import agendar_se_mudou
+from .mapa import ajustar_indice
+from .models import Avaliacao, CarouselImage, Loja, ResumoUsuario
+
+registrar_referencias(Loja, 'foto')
+registrar_referencias(CarouselImage, 'image')
+
+
+@receiver(post_delete, sender=Avaliacao)
+def remover_nota_da_loja(sender, instance, **kwargs):
+    """
+    Retira a nota excluída dos agregados da loja.
+    Feito por sinal para cobrir também as exclusões em cascata.
+    """
+    Loja.ajustar_avaliacoes(instance.loja_id, -instance.nota, -1)
+
+
+@receiver(post_save, sender=CarouselImage)
+@receiver(post_delete, sender=CarouselImage)
+def atualizar_carrossel(sender, **kwargs):
+    """
+    Invalida o carrossel em cache. Cobre também a edição da ordem pela
+    listagem do admin (``list_editable``), que salva cada imagem.
+    """
+    invalidar_carrossel()
+
+
+@receiver(post_save, sender=Loja)
+@receiver(post_delete, sender=Loja)
+def invalidar_pagina_da_loja(sender, instance, **kwargs):
+    invalidar_loja(instance.pk)
+
+
+@receiver(post_save, sender=Loja)
+@receiver(post_delete, sender=Loja)
+def atualizar_lojistas(sender, instance, update_fields=None, **kwargs):
+    """
+    Invalida a relação e-mail -> loja (``usuario_e_lojista``) quando o
+    e-mail pode ter mudado. Os saves parciais dos agregados não contam.
+    """
+    if update_fields is not None and 'email' not in update_fields:
+        return
+    invalidar_lojistas()
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def atualizar_identidade(sender, instance, **kwargs):
+    """
+    Descarta o usuário guardado pelo ``BackendComCache`` (inclusive no
+    login, que grava o ``last_login``).
+    """
+    invalidar_usuario(instance.pk)
+
+
+@receiver(post_save, sender=Avaliacao)
+@receiver(post_delete, sender=Avaliacao)
+def invalidar_avaliacoes_da_loja(sender, instance, **kwargs):
+    invalidar_loja(instance.loja_id)
+
+
+@receiver(post_save, sender=Loja)
+def gerar_derivados_da_foto_da_loja(sender, instance, update_fields=None, **kwargs):
+    agendar_se_mudou(instance, 'foto', update_fields)
+
+
+@receiver(post_save, sender=CarouselImage)
+def gerar_derivados_do_carrossel(sender, instance, update_fields=None, **kwargs):
+    agendar_se_mudou(instance, 'image', update_fields)
+
+
+@receiver(post_save, sender=Loja)
+def atualizar_indice_do_mapa(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Move a loja entre as células do mapa quando a coordenada muda.
+    """
+    if update_fields is not None and not {'latitude', 'longitude'} & set(update_fields):
+        return
+    coordenada = (instance.latitude, instance.longitude)
+    anterior = getattr(instance, '_coordenada_salva', None)
+    if created:
+        ajustar_indice(*coordenada, 1)
+    elif anterior is not None and anterior != coordenada:
+        ajustar_indice(*anterior, -1)
+        ajustar_indice(*coordenada, 1)
+    instance._coordenada_salva = coordenada
+
+
+@receiver(post_delete, sender=Loja)
+def remover_do_indice_do_mapa(sender, instance, **kwargs):
+    ajustar_indice(instance.latitude, instance.longitude, -1)
+
+
+@receiver(post_save, sender=Avaliacao)
+def contar_avaliacao_do_usuario(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        ResumoUsuario.ajustar(instance.usuario_id, total_avaliacoes=1)
+
+
+@receiver(post_delete, sender=Avaliacao)
+def descontar_avaliacao_do_usuario(sender, instance, **kwargs):
+    ResumoUsuario.ajustar(instance.usuario_id, total_avaliacoes=-1)
+
+
+@receiver(m2m_changed, sender=Loja.favoritada_por.through)
+def contar_favoritos(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Mantém os totais de favoritos das lojas e dos usuários quando a
+    relação é alterada pelo gerenciador (``loja.favoritada_por`` ou
+    ``user.lojas_favoritadas``, ex: pelo admin). O favoritar da página da
+    loja usa ``LojaFavorita.alternar``, que já atualiza os totais.
+    """
+    if action == 'pre_clear':
+        relacionados = instance.lojas_favoritadas if reverse else instance.favoritada_por
+        instance._favoritos_antes = list(relacionados.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    outros = getattr(instance, '_favoritos_antes', []) if action == 'post_clear' else pk_set
+    if reverse:
+        usuario_ids, loja_ids = [instance.pk], outros
+    else:
+        usuario_ids, loja_ids = outros, [instance.pk]
+    ResumoUsuario.recontar_favoritos(usuario_ids)
+    Loja.recontar_favoritos(loja_ids)
+    for usuario_id in usuario_ids:
+        invalidar_lojas_favoritas(usuario_id)
+    for loja_id in loja_ids:
+        invalidar_total_favoritos(loja_id)
+
+
+@receiver(pre_delete, sender=Loja)
+def guardar_quem_favoritou(sender, instance, **kwargs):
+    # As favoritas são excluídas em cascata sem disparar o m2m_changed
+    instance._favoritos_antes = list(instance.favoritada_por.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Loja)
+def descontar_favoritos_da_loja_excluida(sender, instance, **kwargs):
+    usuario_ids = getattr(instance, '_favoritos_antes', [])
+    ResumoUsuario.recontar_favoritos(usuario_ids)
+    for usuario_id in usuario_ids:
+        invalidar_lojas_favoritas(usuario_id)
+
+
+@receiver(pre_delete, sender=get_user_model())
+def guardar_lojas_favoritadas(sender, instance, **kwargs):
+    # Como na exclusão da loja: a cascata não passa pelo m2m_changed
+    instance._favoritas_antes = list(instance.lojas_favoritadas.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=get_user_model())
+def descontar_favoritos_do_usuario_excluido(sender, instance, **kwargs):
+    loja_ids = getattr(instance, '_favoritas_antes', [])
+    Loja.recontar_favoritos(loja_ids)
+    for loja_id in loja_ids:
+        invalidar_total_favoritos(loja_id)
@@ -0,0 +1,64 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html, format_html_join
+
+from loja.imagens import FORMATOS, manifesto, nome_derivado
+
+register = template.Library()
+
+
+def _nome(imagem):
+    # Aceita tanto um FieldFile quanto o nome do arquivo (ex: valores de .values())
+    return getattr(imagem, 'name', imagem) or ''
+
+
+@register.filter
+def srcset(imagem, extensao='webp'):
+    """
+    Retorna o ``srcset`` com os derivados da imagem no formato pedido, ou
+    uma string vazia se eles ainda não foram gerados.
+    Uso: ``<img srcset="{{ loja.foto|srcset:'jpg' }}" ...>``
+    """
+    nome = _nome(imagem)
+    dados = manifesto(nome)
+    if not dados:
+        return ''
+    return ', '.join(
+        f'{default_storage.url(nome_derivado(nome, largura, extensao))} {largura}w'
+        for largura in dados['larguras']
+    )
+
+
+@register.simple_tag
+def imagem_responsiva(imagem, sizes='100vw', **atributos):
+    """
+    Renderiza um ``<picture>`` com os derivados WebP e JPEG da imagem.
+    Enquanto os derivados não existem, renderiza só o original.
+    Uso: ``{% imagem_responsiva loja.foto sizes="(min-width: 992px) 33vw, 100vw" class="card-img-top" alt=loja.nome %}``
+    """
+    nome = _nome(imagem)
+    if not nome:
+        return ''
+    atributos.setdefault('loading', 'lazy')
+    atributos.setdefault('decoding', 'async')
+    dados = manifesto(nome)
+    if not dados:
+        return format_html(
+            '<img src="{}" {}>', default_storage.url(nome),
+            format_html_join(' ', '{}="{}"', atributos.items()),
+        )
+
+    maior = dados['larguras'][-1]
+    fontes = format_html_join(
+        '', '<source type="{}" srcset="{}" sizes="{}">',
+        ((tipo, srcset(nome, extensao), sizes)
+         for extensao, (_, tipo, _) in FORMATOS.items() if extensao != 'jpg'),
+    )
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" {}></picture>',
+        fontes,
+        default_storage.url(nome_derivado(nome, maior, 'jpg')),
+        srcset(nome, 'jpg'),
+        sizes,
+        format_html_join(' ', '{}="{}"', atributos.items()),
+    )
@@ -0,0 +1,15 @@
+from django import template
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def url_da_pagina(context, parametro, numero):
+    """
+    Query string da página atual trocando só ``parametro`` pelo número
+    pedido, para páginas com mais de uma lista paginada.
+    Uso: ``<a href="{% url_da_pagina 'pagina_avaliacoes' 2 %}">``
+    """
+    parametros = context['request'].GET.copy()
+    parametros[parametro] = numero
+    return f'?{parametros.urlencode()}'
@@ -1,3 +1,935 @@
-from django.test import TestCase
+import csv
+import json
+import random
+import re
+import shutil
+import tempfile
+import warnings
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from urllib.parse import quote_plus
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.cache.backends.base import CacheKeyWarning
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Avg, Count, F, Sum
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from agendamento.models import Agendamento, VagaHorario
+from produto.busca import INDICE_PRODUTOS
+from produto.models import Categoria, Produto
+from produto.paginacao import codificar_cursor
+
+from .busca import INDICE_LOJAS
+from .cache import (
+    _copias_locais, categoria_por_nome, categorias, ids_lojas_favoritas, imagens_carrossel, invalidar_carrossel,
+    loja_do_usuario,
+)
+from .dados_sinteticos import apagar, gerar
+from .geo import caixas_envolventes, distancia_km, lojas_mais_proximas, lojas_no_raio
+from .imagens import manifesto
+from .mapa import ZOOM_LOJAS_INDIVIDUAIS, celula, reconstruir_indice
+from .models import ArquivoMidia, Avaliacao, CarouselImage, CelulaMapa, Loja, LojaFavorita, ResumoUsuario
+
+QUANTIDADES = {
+    'lojas': 8, 'usuarios': 30, 'produtos_por_loja': 12,
+    'avaliacoes': 60, 'favoritas': 50, 'agendamentos': 40,
+}
+
+
+class DadosSinteticosTests(TestCase):
+
+    def retrato(self):
+        lojas = list(Loja.objects.order_by('pk').values_list('nome', 'latitude', 'capacidade_agendamentos'))
+        produtos = list(Produto.objects.order_by('pk').values_list('nome', 'preco'))
+        favoritas = sorted(LojaFavorita.objects.values_list('usuario__username', 'loja__nome'))
+        return lojas, produtos, favoritas
+
+    def test_mesma_semente_gera_os_mesmos_dados(self):
+        gerar(semente=3, **QUANTIDADES)
+        primeiro = self.retrato()
+        apagar()
+        gerar(semente=3, **QUANTIDADES)
+        self.assertEqual(self.retrato(), primeiro)
+
+    def test_quantidades(self):
+        totais = gerar(semente=3, **QUANTIDADES)
+        self.assertEqual(totais['lojas'], 8)
+        self.assertEqual(totais['produtos'], 8 * 12)
+        self.assertEqual(totais['avaliacoes'], 60)
+        self.assertEqual(totais['favoritas'], 50)
+        self.assertGreater(totais['agendamentos'], 0)
+
+    def test_campos_e_tabelas_derivadas_consistentes(self):
+        gerar(semente=3, **QUANTIDADES)
+        self.assertFalse(Loja.objects.filter(geohash='').exists())
+        self.assertFalse(Produto.objects.filter(chave='').exists())
+        self.assertFalse(Produto.objects.filter(canonico__isnull=True).exists())
+        for loja in Loja.objects.all():
+            self.assertEqual(loja.total_favoritos, LojaFavorita.objects.filter(loja=loja).count())
+        # Os comandos de verificação falham (CommandError) se algo diverge
+        call_command('recalcular_avaliacoes', verificar=True, stdout=StringIO())
+        call_command('recontar_resumos', verificar=True, stdout=StringIO())
+        self.assertFalse(VagaHorario.objects.filter(ocupadas__gt=F('loja__capacidade_agendamentos')).exists())
+
+
+class ExportacaoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        gerar(semente=3, **QUANTIDADES)
+        cls.loja = Loja.objects.order_by('pk').first()
+        cls.lojista = User.objects.get(email=cls.loja.email)
+        cls.admin = User.objects.create_superuser('admin-exportacao', 'admin@exportacao.petcare', 'senha')
+
+    def exportar(self, usuario, **parametros):
+        self.client.force_login(usuario)
+        resposta = self.client.get(reverse('loja:exportar_avaliacoes'), parametros)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertTrue(resposta.streaming)
+        texto = b''.join(resposta.streaming_content).decode('utf-8-sig')
+        return list(csv.DictReader(StringIO(texto)))
+
+    def test_admin_exporta_tudo_ou_uma_loja(self):
+        self.assertEqual(len(self.exportar(self.admin)), Avaliacao.objects.count())
+        linhas = self.exportar(self.admin, loja=self.loja.pk)
+        self.assertEqual(len(linhas), Avaliacao.objects.filter(loja=self.loja).count())
+
+    def test_lojista_exporta_so_a_propria_loja(self):
+        outra = Loja.objects.exclude(pk=self.loja.pk).first()
+        linhas = self.exportar(self.lojista, loja=outra.pk)
+        self.assertEqual({linha['loja'] for linha in linhas}, {str(self.loja.pk)})
+
+    def test_filtro_por_periodo(self):
+        avaliacao = Avaliacao.objects.order_by('pk').first()
+        Avaliacao.objects.filter(pk=avaliacao.pk).update(criado_em=timezone.now() - timedelta(days=30))
+        hoje = timezone.localdate().isoformat()
+        ids = {linha['id'] for linha in self.exportar(self.admin, inicio=hoje, fim=hoje)}
+        self.assertNotIn(str(avaliacao.pk), ids)
+        self.assertEqual(len(ids), Avaliacao.objects.count() - 1)
+
+    def test_cliente_nao_exporta(self):
+        cliente = User.objects.exclude(email__in=Loja.objects.values('email')).first()
+        self.client.force_login(cliente)
+        self.assertEqual(self.client.get(reverse('loja:exportar_avaliacoes')).status_code, 403)
+
+
+class BuscaTests(TestCase):
+
+    def encontra(self, indice, termo):
+        return set(indice.filtrar(indice.modelo.objects.all(), termo).values_list('pk', flat=True))
+
+    def test_indice_acompanha_criacao_edicao_e_exclusao(self):
+        loja = Loja.objects.create(nome='Pet Shop Ração Feliz', endereco='Rua A', telefone='1', email='a@busca.petcare')
+        produto = Produto.objects.create(loja=loja, nome='Ração Golden', preco=10)
+        self.assertEqual(self.encontra(INDICE_LOJAS, 'racao'), {loja.pk})
+        self.assertEqual(self.encontra(INDICE_PRODUTOS, 'RACAO golden'), {produto.pk})
+
+        loja.nome = 'Pet Shop Feliz'
+        loja.save()
+        Produto.objects.filter(pk=produto.pk).update(nome='Petisco Golden')
+        self.assertEqual(self.encontra(INDICE_LOJAS, 'racao'), set())
+        self.assertEqual(self.encontra(INDICE_PRODUTOS, 'racao'), set())
+        self.assertEqual(self.encontra(INDICE_PRODUTOS, 'petisco'), {produto.pk})
+
+        Produto.objects.create(loja=loja, nome='Ração Premier', preco=12).delete()
+        self.assertEqual(self.encontra(INDICE_PRODUTOS, 'racao'), set())
+        loja.delete()
+        self.assertEqual(self.encontra(INDICE_LOJAS, 'feliz'), set())
+
+    def test_gatilhos_apagados_sao_recriados_apos_o_migrate(self):
+        # Como depois de uma migração que recria a tabela do modelo
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TRIGGER {INDICE_LOJAS.tabela}_au')
+        self.assertFalse(INDICE_LOJAS.existe())
+        loja = Loja.objects.create(nome='Casa da Ração', endereco='Rua B', telefone='1', email='b@busca.petcare')
+        INDICE_LOJAS._apos_migrate(sender=None)
+        self.assertTrue(INDICE_LOJAS.existe())
+        self.assertEqual(self.encontra(INDICE_LOJAS, 'racao'), {loja.pk})
+        loja.nome = 'Casa do Pet'
+        loja.save()
+        self.assertEqual(self.encontra(INDICE_LOJAS, 'racao'), set())
+
+
+class ListaLojasTests(TestCase):
+
+    def test_links_da_paginacao_trocam_a_pagina(self):
+        Loja.objects.bulk_create([
+            Loja(nome=f'Pet Shop {numero}', endereco='Rua A', telefone='1', email=f'{numero}@lista.petcare')
+            for numero in range(30)
+        ])
+        self.client.force_login(User.objects.create_user('lista', 'lista@lista.petcare', 'senha'))
+        resposta = self.client.get(reverse('loja:loja_list'), {'page': 2, 'q': 'Pet'})
+        self.assertEqual(resposta.context['page_obj'].number, 2)
+        html = resposta.content.decode()
+        self.assertIn('href="?page=3&amp;q=Pet"', html)
+        self.assertIn('href="?page=1&amp;q=Pet"', html)
+        self.assertNotIn('page=2&amp;', html)
+
+    def test_favoritas_em_cache_acompanham_as_alteracoes(self):
+        cache.clear()
+        lojas = [
+            Loja.objects.create(nome=f'Loja {numero}', endereco='Rua A', telefone='1', email=f'{numero}@favoritas-lista.petcare')
+            for numero in range(3)
+        ]
+        usuario = User.objects.create_user('lista-favoritas')
+        self.client.force_login(usuario)
+
+        def favoritas():
+            with CaptureQueriesContext(connection) as consultas:
+                resposta = self.client.get(reverse('loja:loja_list'))
+            lidas = sum('loja_lojafavorita' in consulta['sql'] for consulta in consultas.captured_queries)
+            return resposta.context['favoritas_usuario'], lidas
+
+        self.assertEqual(favoritas(), ([], 1))
+        # O conjunto fica em cache até uma alteração
+        self.assertEqual(favoritas(), ([], 0))
+        self.client.post(reverse('loja:favoritar-loja', args=[lojas[1].pk]))
+        self.assertEqual(favoritas(), ([lojas[1].pk], 1))
+        # Pelo gerenciador (ex: admin), via m2m_changed
+        lojas[2].favoritada_por.add(usuario)
+        self.assertEqual(favoritas(), ([lojas[1].pk, lojas[2].pk], 1))
+        usuario.lojas_favoritadas.clear()
+        self.assertEqual(favoritas(), ([], 1))
+        lojas[0].favoritada_por.add(usuario)
+        lojas[0].delete()
+        self.assertEqual(favoritas(), ([], 1))
+
+
+class PerfilTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lojas = Loja.objects.bulk_create([
+            Loja(nome=f'Pet Shop {numero}', endereco='Rua A', telefone='1', email=f'{numero}@perfil.petcare')
+            for numero in range(15)
+        ])
+        cls.servicos = [Produto.objects.create(loja=loja, nome='Banho', preco=50) for loja in cls.lojas]
+
+    def usuario_com(self, nome, quantidade):
+        """
+        Usuário com ``quantidade`` favoritas, avaliações e agendamentos
+        futuros e passados.
+        """
+        usuario = User.objects.create_user(nome, f'{nome}@perfil.petcare', 'senha')
+        agora = timezone.now()
+        for loja, servico in list(zip(self.lojas, self.servicos))[:quantidade]:
+            LojaFavorita.alternar(usuario.pk, loja.pk, True)
+            Avaliacao.objects.create(loja=loja, usuario=usuario, nota=4)
+            for dias, status in ((3, 'PENDENTE'), (-3, 'CONCLUIDO')):
+                Agendamento.objects.create(
+                    usuario=usuario, loja=loja, produto=servico, status=status,
+                    data_hora=agora + timedelta(days=dias, hours=loja.pk),
+                )
+        return usuario
+
+    def consultas_do_perfil(self, usuario):
+        self.client.force_login(usuario)
+        # A primeira requisição aquece os caches de sessão e de usuário
+        self.client.get(reverse('loja:perfil_usuario'))
+        with CaptureQueriesContext(connection) as consultas:
+            resposta = self.client.get(reverse('loja:perfil_usuario'))
+        self.assertEqual(resposta.status_code, 200)
+        return len(consultas), resposta
+
+    def test_consultas_nao_crescem_com_o_historico(self):
+        uma, resposta = self.consultas_do_perfil(self.usuario_com('um', 1))
+        self.assertEqual(resposta.context['total_favoritos'], 1)
+
+        varios = self.usuario_com('varios', 15)
+        self.client.force_login(varios)
+        self.client.get(reverse('loja:perfil_usuario'))
+        with self.assertNumQueries(uma):
+            resposta = self.client.get(reverse('loja:perfil_usuario'))
+        self.assertEqual(resposta.context['total_favoritos'], 15)
+        self.assertEqual(resposta.context['total_proximos_agendamentos'], 15)
+        self.assertEqual(len(resposta.context['agendamentos_passados']), 10)
+
+    def test_excluir_usuario_nao_deixa_resumo_orfao(self):
+        usuario = self.usuario_com('excluido', 3)
+        self.assertTrue(ResumoUsuario.objects.filter(pk=usuario.pk).exists())
+        # As exclusões em cascata descontam avaliações e agendamentos do
+        # resumo, que já foi apagado junto com o usuário
+        usuario.delete()
+        self.assertFalse(ResumoUsuario.objects.filter(usuario_id=usuario.pk).exists())
+
+    def test_titulo_da_pagina(self):
+        _, resposta = self.consultas_do_perfil(self.usuario_com('titulo', 0))
+        titulo = re.search(r'<title>(.*?)</title>', resposta.content.decode(), re.S).group(1)
+        self.assertEqual(' '.join(titulo.split()), 'Meu Perfil - PetCare')
+
+
+class ProximosAgendamentosTests(TestCase):
+
+    def setUp(self):
+        self.loja = Loja.objects.create(nome='Pet Shop', endereco='Rua A', telefone='1', email='loja@proximos.petcare')
+        self.servico = Produto.objects.create(loja=self.loja, nome='Banho', preco=50)
+        self.usuario = User.objects.create_user('cliente')
+        self.agora = timezone.now()
+
+    def agendar(self, horas, status='PENDENTE'):
+        return Agendamento.objects.create(
+            usuario=self.usuario, loja=self.loja, produto=self.servico, status=status,
+            data_hora=self.agora + timedelta(hours=horas),
+        )
+
+    def proximos(self, agora=None):
+        """
+        (total, início do próximo) lidos como o perfil lê, conferidos com a
+        contagem do zero e com ``recontar_resumos --verificar``.
+        """
+        with mock.patch('django.utils.timezone.now', return_value=agora or timezone.now()):
+            resumo = ResumoUsuario.do_usuario(self.usuario)
+            esperado = Agendamento.objects.filter(
+                usuario=self.usuario, status__in=('PENDENTE', 'CONFIRMADO'), data_hora__gt=timezone.now(),
+            ).count()
+            self.assertEqual(resumo.total_proximos_agendamentos, esperado)
+            call_command('recontar_resumos', verificar=True, stdout=StringIO())
+        return resumo.total_proximos_agendamentos, resumo.inicio_proximo_agendamento
+
+    def test_cancelar_concluir_e_excluir(self):
+        primeiro, segundo, terceiro = self.agendar(2), self.agendar(5), self.agendar(8)
+        self.agendar(-2)
+        self.agendar(4, status='CANCELADO')
+        self.assertEqual(self.proximos(), (3, primeiro.data_hora))
+
+        primeiro.status = 'CANCELADO'
+        primeiro.save()
+        self.assertEqual(self.proximos()[0], 2)
+        # Cancelar de novo (ou salvar sem mudar o status) não desconta outra vez
+        primeiro.save()
+        self.assertEqual(self.proximos()[0], 2)
+
+        segundo.status = 'CONFIRMADO'
+        segundo.save()
+        self.assertEqual(self.proximos()[0], 2)
+        segundo.status = 'CONCLUIDO'
+        segundo.save()
+        self.assertEqual(self.proximos()[0], 1)
+        segundo.status = 'PENDENTE'
+        segundo.save()
+        self.assertEqual(self.proximos()[0], 2)
+
+        terceiro.delete()
+        self.assertEqual(self.proximos()[0], 1)
+
+    def test_remarcar(self):
+        agendamento = self.agendar(5)
+        agendamento.data_hora = self.agora + timedelta(hours=1)
+        agendamento.save()
+        self.assertEqual(self.proximos(), (1, agendamento.data_hora))
+
+        # Remarcado para o passado (ex: lançado depois pelo admin)
+        agendamento.data_hora = self.agora - timedelta(hours=1)
+        agendamento.save()
+        self.assertEqual(self.proximos()[0], 0)
+        agendamento.data_hora = self.agora + timedelta(hours=3)
+        agendamento.save()
+        # O início guardado só recua: fica o da 1h, que vence antes e
+        # leva a uma recontagem desnecessária, mas nunca a um total errado
+        self.assertEqual(self.proximos(), (1, self.agora + timedelta(hours=1)))
+        self.assertEqual(self.proximos(self.agora + timedelta(hours=2)), (1, agendamento.data_hora))
+
+    def test_agendamentos_que_comecam_deixam_de_contar(self):
+        primeiro, segundo = self.agendar(1), self.agendar(3)
+        self.assertEqual(self.proximos(), (2, primeiro.data_hora))
+        # Nenhuma escrita: só o tempo passou
+        self.assertEqual(self.proximos(self.agora + timedelta(hours=2)), (1, segundo.data_hora))
+        self.assertEqual(self.proximos(self.agora + timedelta(hours=4)), (0, None))
+        # Já começou: cancelar não desconta de novo
+        with mock.patch('django.utils.timezone.now', return_value=self.agora + timedelta(hours=4)):
+            segundo.status = 'CANCELADO'
+            segundo.save()
+        self.assertEqual(self.proximos(self.agora + timedelta(hours=4)), (0, None))
+
+    def test_perfil_reconta_so_quando_vence(self):
+        self.agendar(1)
+        self.client.force_login(self.usuario)
+        self.client.get(reverse('loja:perfil_usuario'))
+        with CaptureQueriesContext(connection) as em_dia:
+            self.assertEqual(self.client.get(reverse('loja:perfil_usuario')).context['total_proximos_agendamentos'], 1)
+        with mock.patch('django.utils.timezone.now', return_value=self.agora + timedelta(hours=2)):
+            with CaptureQueriesContext(connection) as vencido:
+                resposta = self.client.get(reverse('loja:perfil_usuario'))
+            self.assertEqual(resposta.context['total_proximos_agendamentos'], 0)
+            self.assertContains(resposta, 'Próximos agendamentos')
+        # Uma consulta para recontar e uma para salvar
+        self.assertEqual(len(vencido), len(em_dia) + 2)
+
+
+class AgregadosAvaliacaoTests(TestCase):
+
+    def setUp(self):
+        self.loja = Loja.objects.create(nome='Pet Shop', endereco='Rua A', telefone='1', email='loja@notas.petcare')
+        self.usuarios = [User.objects.create_user(f'avaliador{numero}') for numero in range(5)]
+
+    def assertAgregadosConferem(self):
+        """
+        Os agregados mantidos a cada escrita batem com os recalculados do zero.
+        """
+        self.loja.refresh_from_db()
+        agregado = Avaliacao.objects.filter(loja=self.loja).aggregate(soma=Sum('nota'), total=Count('id'), media=Avg('nota'))
+        mantidos = (self.loja.avaliacao_soma, self.loja.avaliacao_total, self.loja.avaliacao_media)
+        self.loja.atualizar_media()
+        self.assertEqual(mantidos, (self.loja.avaliacao_soma, self.loja.avaliacao_total, self.loja.avaliacao_media))
+        self.assertEqual(mantidos[:2], (agregado['soma'] or 0, agregado['total']))
+        return mantidos
+
+    def avaliar(self, usuario, nota):
+        return Avaliacao.objects.create(loja=self.loja, usuario=usuario, nota=nota)
+
+    def test_criar_editar_e_excluir(self):
+        avaliacoes = [self.avaliar(usuario, nota) for usuario, nota in zip(self.usuarios, [5, 3, 3, 2])]
+        # 13 / 4 = 3.25: o arredondamento precisa ser o mesmo nos dois cálculos
+        self.assertEqual(self.assertAgregadosConferem(), (13, 4, 3.3))
+
+        avaliacoes[0].nota = 1
+        avaliacoes[0].save()
+        self.assertEqual(self.assertAgregadosConferem(), (9, 4, 2.3))
+
+        # Editada a partir de uma instância carregada do banco
+        recarregada = Avaliacao.objects.get(pk=avaliacoes[1].pk)
+        recarregada.nota = 5
+        recarregada.save()
+        self.assertEqual(self.assertAgregadosConferem(), (11, 4, 2.8))
+
+        avaliacoes[2].delete()
+        self.assertEqual(self.assertAgregadosConferem(), (8, 3, 2.7))
+
+        # Exclusões em lote e em cascata também passam pelo sinal
+        self.usuarios[3].delete()
+        self.assertEqual(self.assertAgregadosConferem(), (6, 2, 3.0))
+        Avaliacao.objects.filter(loja=self.loja).delete()
+        self.assertEqual(self.assertAgregadosConferem(), (0, 0, 0))
+
+
+class FavoritasTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.lojas = [
+            Loja.objects.create(nome=f'Loja {numero}', endereco='Rua A', telefone='1', email=f'loja{numero}@favoritas.petcare')
+            for numero in range(3)
+        ]
+        self.usuario = User.objects.create_user('favoritador')
+        self.client.force_login(self.usuario)
+
+    def assertTotaisConferem(self):
+        """
+        Os totais mantidos a cada escrita batem com a tabela de favoritas.
+        """
+        for loja in Loja.objects.all():
+            self.assertEqual(loja.total_favoritos, LojaFavorita.objects.filter(loja=loja).count(), loja.nome)
+        for resumo in ResumoUsuario.objects.all():
+            self.assertEqual(resumo.total_favoritos, LojaFavorita.objects.filter(usuario_id=resumo.pk).count())
+        call_command('recontar_resumos', verificar=True, stdout=StringIO())
+
+    def favoritar(self, loja):
+        return self.client.post(reverse('loja:favoritar-loja', args=[loja.pk])).json()
+
+    def sincronizar(self, favoritas):
+        return self.client.post(
+            reverse('loja:sincronizar-favoritas'), json.dumps({'favoritas': favoritas}), content_type='application/json',
+        )
+
+    def test_alternar_duas_vezes_nao_muda_nada(self):
+        self.assertEqual(self.favoritar(self.lojas[0]), {'favoritado': True, 'total_favoritos': 1})
+        self.assertEqual(ResumoUsuario.objects.get(pk=self.usuario.pk).total_favoritos, 1)
+        self.assertEqual(self.favoritar(self.lojas[0]), {'favoritado': False, 'total_favoritos': 0})
+        self.assertFalse(LojaFavorita.objects.exists())
+        self.assertEqual(ResumoUsuario.objects.get(pk=self.usuario.pk).total_favoritos, 0)
+        self.assertTotaisConferem()
+
+    def test_sincronizar_de_novo_nao_muda_nada(self):
+        LojaFavorita.alternar(self.usuario.pk, self.lojas[2].pk, True)
+        favoritas = {str(self.lojas[0].pk): True, str(self.lojas[1].pk): True, str(self.lojas[2].pk): False, '999999': True}
+        primeira = self.sincronizar(favoritas).json()
+        self.assertEqual(primeira['ignoradas'], [999999])
+        self.assertEqual(self.sincronizar(favoritas).json(), primeira)
+        self.assertEqual(
+            sorted(LojaFavorita.objects.values_list('loja_id', flat=True)), [self.lojas[0].pk, self.lojas[1].pk],
+        )
+        self.assertEqual(ResumoUsuario.objects.get(pk=self.usuario.pk).total_favoritos, 2)
+        self.assertTotaisConferem()
+
+    def test_excluir_loja_ou_usuario_mantem_os_totais(self):
+        outro = User.objects.create_user('outro')
+        for usuario in (self.usuario, outro):
+            for loja in self.lojas:
+                LojaFavorita.alternar(usuario.pk, loja.pk, True)
+        self.lojas[0].delete()
+        self.assertEqual(ResumoUsuario.objects.get(pk=self.usuario.pk).total_favoritos, 2)
+        self.assertTotaisConferem()
+
+        outro.delete()
+        self.assertEqual(Loja.objects.get(pk=self.lojas[1].pk).total_favoritos, 1)
+        self.assertTotaisConferem()
+
+    def test_loja_inexistente(self):
+        with self.assertRaises(Loja.DoesNotExist):
+            LojaFavorita.alternar(self.usuario.pk, 999999)
+        self.assertFalse(LojaFavorita.objects.exists())
+        self.assertEqual(self.client.post(reverse('loja:favoritar-loja', args=[999999])).status_code, 404)
+
+
+class CacheCarrosselTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        _copias_locais.clear()
+
+    def imagem(self, titulo, ordem):
+        return CarouselImage.objects.create(image=f'carousel_images/{ordem}.jpg', caption_title=titulo, order=ordem)
+
+    def titulos(self):
+        return [imagem.caption_title for imagem in imagens_carrossel()]
+
+    def test_nova_versao_descarta_as_copias(self):
+        primeira = self.imagem('Primeira', 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.titulos(), ['Primeira'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.titulos(), ['Primeira'])
+        # Outro processo, sem a cópia local, lê a lista do cache compartilhado
+        _copias_locais.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.titulos(), ['Primeira'])
+
+        # Os sinais geram uma nova versão a cada alteração pelo admin
+        self.imagem('Segunda', 0)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.titulos(), ['Segunda', 'Primeira'])
+        primeira.order = 0
+        primeira.save()
+        segunda = CarouselImage.objects.get(caption_title='Segunda')
+        segunda.order = 2
+        segunda.save()
+        self.assertEqual(self.titulos(), ['Primeira', 'Segunda'])
+        segunda.delete()
+        self.assertEqual(self.titulos(), ['Primeira'])
+
+        # Uma versão trocada por outro processo vale também para a cópia local
+        CarouselImage.objects.filter(pk=primeira.pk).update(caption_title='Alterada sem sinal')
+        self.assertEqual(self.titulos(), ['Primeira'])
+        invalidar_carrossel()
+        self.assertEqual(self.titulos(), ['Alterada sem sinal'])
+
+    def test_pagina_mostra_o_carrossel_atual(self):
+        self.client.force_login(User.objects.create_user('visitante'))
+        self.imagem('Promoção de inverno', 0)
+        self.assertContains(self.client.get(reverse('loja:loja_list')), 'Promoção de inverno')
+        CarouselImage.objects.get().delete()
+        self.assertNotContains(self.client.get(reverse('loja:loja_list')), 'Promoção de inverno')
+
+
+class FragmentosLojaTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.loja = Loja.objects.create(nome='Pet Shop', endereco='Rua A', telefone='1', email='loja@fragmentos.petcare')
+        self.outra = Loja.objects.create(nome='Outra', endereco='Rua B', telefone='2', email='outra@fragmentos.petcare')
+        self.produto = Produto.objects.create(loja=self.loja, nome='Ração Golden', preco='100.00')
+        self.client.force_login(User.objects.create_user('visitante'))
+
+    def pagina(self, loja=None):
+        return self.client.get(reverse('loja:loja_detail', args=[(loja or self.loja).pk])).content.decode()
+
+    def test_fragmentos_sao_descartados_quando_um_produto_muda(self):
+        self.assertIn('Ração Golden', self.pagina())
+        # Sem alterações, a grade de produtos vem do cache
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertIn('Ração Golden', self.pagina())
+        self.assertFalse(any('produto_produto' in consulta['sql'] for consulta in consultas.captured_queries))
+
+        self.produto.nome = 'Ração Golden 15kg'
+        self.produto.save()
+        self.assertIn('Ração Golden 15kg', self.pagina())
+
+        # Trocado de loja a partir de uma instância carregada do banco: as
+        # páginas das duas lojas mudam
+        self.assertNotIn('Ração Golden', self.pagina(self.outra))
+        produto = Produto.objects.get(pk=self.produto.pk)
+        produto.loja = self.outra
+        produto.save()
+        self.assertNotIn('Ração Golden', self.pagina())
+        self.assertIn('Ração Golden 15kg', self.pagina(self.outra))
+
+        produto.delete()
+        self.assertNotIn('Ração Golden', self.pagina(self.outra))
+
+    def test_avaliacoes_e_favoritos(self):
+        self.pagina()
+        Avaliacao.objects.create(loja=self.loja, usuario=User.objects.create_user('avaliador'), nota=4, comentario='Atendimento ótimo')
+        self.assertIn('Atendimento ótimo', self.pagina())
+        Avaliacao.objects.create(loja=self.loja, usuario=User.objects.get(username='visitante'), nota=5, comentario='Voltarei')
+        pagina = self.pagina()
+        self.assertIn('Voltarei', pagina)
+        self.assertIn('Você já avaliou esta loja', pagina)
+
+        self.assertIn('<span id="favoritos-count-{}">0</span>'.format(self.loja.pk), self.pagina())
+        self.client.post(reverse('loja:favoritar-loja', args=[self.loja.pk]))
+        self.assertIn('<span id="favoritos-count-{}">1</span>'.format(self.loja.pk), self.pagina())
+
+    def test_grade_do_admin_fica_em_outro_fragmento(self):
+        self.assertNotIn('Editar Produto', self.pagina())
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@fragmentos.petcare', 'senha'))
+        self.assertIn('Editar Produto', self.pagina())
+
+
+class ProximidadeTests(TestCase):
+
+    @staticmethod
+    def loja(nome, latitude, longitude):
+        return Loja.objects.create(
+            nome=nome, endereco='Rua A', telefone='1', email=f'{nome}@proximidade.petcare',
+            latitude=latitude, longitude=longitude,
+        )
+
+    def test_mais_proximas_iguais_ao_calculo_completo(self):
+        aleatorio = random.Random(7)
+        for numero in range(40):
+            self.loja(f'loja{numero}', aleatorio.uniform(-24, -22), aleatorio.uniform(-47, -45))
+        # Poucas lojas, longe do ponto
+        self.loja('recife', -8.05, -34.9)
+        self.loja('manaus', -3.1, -60.0)
+        todas = list(Loja.objects.all())
+        for latitude, longitude, k in ((-23.5, -46.6, 10), (-23.5, -46.6, 42), (-8.0, -35.0, 3), (40.0, -74.0, 2)):
+            with self.subTest(latitude=latitude, longitude=longitude, k=k):
+                esperadas = sorted(todas, key=lambda loja: (distancia_km(latitude, longitude, loja.latitude, loja.longitude), loja.pk))[:k]
+                with CaptureQueriesContext(connection) as consultas:
+                    encontradas = lojas_mais_proximas(Loja.objects.all(), latitude, longitude, k)
+                self.assertEqual([loja.pk for loja in encontradas], [loja.pk for loja in esperadas])
+                # O raio cresce pela densidade, não dobrando a cada consulta
+                self.assertLessEqual(len(consultas), 7)
+
+    def test_busca_cruza_o_antimeridiano(self):
+        leste = self.loja('fiji', -17.0, 179.95)
+        oeste = self.loja('samoa', -17.0, -179.95)
+        self.loja('longe', -17.0, 170.0)
+        self.assertEqual(len(caixas_envolventes(-17.0, 179.99, 30)), 2)
+        encontradas = lojas_no_raio(Loja.objects.all(), -17.0, -179.99, 30)
+        self.assertEqual({loja.pk for loja in encontradas}, {leste.pk, oeste.pk})
+        self.assertEqual([loja.pk for loja in lojas_mais_proximas(Loja.objects.all(), -17.0, 179.97, 2)], [leste.pk, oeste.pk])
+
+    def test_parametros_da_view(self):
+        perto = self.loja('perto', -23.5, -46.6)
+        self.loja('longe', -8.05, -34.9)
+        self.client.force_login(User.objects.create_user('proximidade'))
+
+        def listar(**parametros):
+            return self.client.get(reverse('loja:loja_list'), {'ordenar': 'proximidade', **parametros})
+
+        for parametros in (
+            {'lat': 'nan', 'lon': '-46.6'}, {'lat': '-23.5', 'lon': 'inf'}, {'lat': '91', 'lon': '0'},
+            {'lat': '-23.5', 'lon': '-46.6', 'raio': 'nan'}, {'lat': '-23.5', 'lon': '-46.6', 'raio': 'inf'},
+            {'lat': '-23.5', 'lon': '-46.6', 'raio': '-5'}, {'lat': '-23.5', 'lon': '-46.6', 'raio': '0'},
+        ):
+            with self.subTest(**parametros):
+                self.assertEqual(listar(**parametros).status_code, 400)
+
+        # Raio enorme é limitado a RAIO_MAXIMO_BUSCA_KM (Recife fica a ~2.100 km)
+        resposta = listar(lat='-23.5', lon='-46.6', raio='1e300')
+        self.assertEqual([loja.pk for loja in resposta.context['lista_lojas']], [perto.pk])
+        # lat/lon que não são números: ordem alfabética, como antes
+        resposta = listar(lat='abc', lon='-46.6')
+        self.assertEqual([loja.nome for loja in resposta.context['lista_lojas']], ['longe', 'perto'])
+
+
+    def test_view_pagina_por_cursor_ate_a_ultima_loja(self):
+        aleatorio = random.Random(3)
+        for numero in range(70):
+            self.loja(f'loja{numero}', aleatorio.uniform(-25, -21), aleatorio.uniform(-48, -44))
+        self.loja('manaus', -3.1, -60.0)
+        esperadas = [
+            loja.pk for loja in sorted(
+                Loja.objects.all(), key=lambda loja: (distancia_km(-23.5, -46.6, loja.latitude, loja.longitude), loja.pk),
+            )
+        ]
+        self.client.force_login(User.objects.create_user('proximidade'))
+
+        def listar(cursor=None):
+            parametros = {'ordenar': 'proximidade', 'lat': '-23.5', 'lon': '-46.6'}
+            if cursor:
+                parametros['cursor'] = cursor
+            resposta = self.client.get(reverse('loja:loja_list'), parametros)
+            self.assertEqual(resposta.status_code, 200)
+            pagina = resposta.context['page_obj']
+            if pagina.has_next():
+                self.assertContains(resposta, f'cursor={quote_plus(pagina.cursor_proximo)}')
+            return pagina, [loja.pk for loja in resposta.context['lista_lojas']]
+
+        # Passa das 60 lojas do antigo limite e chega à mais distante
+        paginas = [listar()]
+        self.assertFalse(paginas[0][0].has_previous())
+        while paginas[-1][0].has_next():
+            paginas.append(listar(paginas[-1][0].cursor_proximo))
+        self.assertEqual(len(paginas), 6)
+        self.assertEqual([pk for _, pks in paginas for pk in pks], esperadas)
+
+        # E volta pelo cursor "anterior"
+        volta = [paginas[-1]]
+        while volta[-1][0].has_previous():
+            volta.append(listar(volta[-1][0].cursor_anterior))
+        self.assertEqual([pks for _, pks in reversed(volta)], [pks for _, pks in paginas])
+
+        # Cursor inválido ou de outra listagem: primeira página
+        produtos = codificar_cursor(['Ração', 1], 'proximo')
+        for cursor in ('invalido', produtos, codificar_cursor([float('nan'), 1], 'proximo')):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(listar(cursor)[1], esperadas[:12])
+
+class ColetaMidiaTests(TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.pasta, ignore_errors=True)
+        configuracao = override_settings(MEDIA_ROOT=self.pasta)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+    def coletar(self):
+        call_command('coletar_midia', stdout=StringIO())
+
+    def enviar(self, nome, conteudo):
+        # Como um FileField: o nome gerado marca o arquivo como upload
+        return default_storage.save(default_storage.generate_filename(nome), ContentFile(conteudo))
+
+    def envelhecer(self, nome):
+        ArquivoMidia.objects.filter(nome=nome).update(enviado_em=timezone.now() - timedelta(days=2))
+
+    def test_upload_reaproveitado_nao_e_coletado(self):
+        nome = self.enviar('foto.png', b'conteudo')
+        self.assertTrue(nome.startswith('cas/'))
+        self.envelhecer(nome)
+
+        # Mesmo conteúdo enviado de novo; o registro ainda não foi salvo
+        self.assertEqual(self.enviar('outra.png', b'conteudo'), nome)
+        self.coletar()
+        self.assertTrue(default_storage.exists(nome))
+
+        loja = Loja.objects.create(nome='Midia', endereco='Rua A', telefone='1', email='m@midia.petcare', foto=nome)
+        self.assertEqual(ArquivoMidia.objects.get(nome=nome).referencias, 1)
+
+        loja.delete()
+        self.coletar()
+        # Ainda dentro do prazo de carência
+        self.assertTrue(default_storage.exists(nome))
+        self.envelhecer(nome)
+        self.coletar()
+        self.assertFalse(default_storage.exists(nome))
+        self.assertFalse(ArquivoMidia.objects.filter(nome=nome).exists())
+
+
+class DerivadosImagemTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_so_agenda_quando_a_imagem_muda(self):
+        with self.captureOnCommitCallbacks() as agendados:
+            loja = Loja.objects.create(nome='Derivados', endereco='Rua A', telefone='1', email='d@derivados.petcare', foto='loja/a.png')
+        self.assertEqual(len(agendados), 1)
+
+        # Saves dos contadores e edições que não tocam na foto
+        with self.captureOnCommitCallbacks() as agendados:
+            Loja.ajustar_avaliacoes(loja.pk, 5, 1)
+            loja = Loja.objects.get(pk=loja.pk)
+            loja.atualizar_media()
+            loja.nome = 'Derivados 2'
+            loja.save()
+            loja.save()
+        self.assertEqual(agendados, [])
+
+        loja.foto = 'loja/b.png'
+        with self.captureOnCommitCallbacks() as agendados:
+            loja.save()
+            loja.save()
+        self.assertEqual(len(agendados), 1)
+
+        imagem = CarouselImage.objects.create(image='carousel_images/a.jpg', order=1)
+        with self.captureOnCommitCallbacks() as agendados:
+            imagem = CarouselImage.objects.get(pk=imagem.pk)
+            imagem.order = 2
+            imagem.save()
+        self.assertEqual(agendados, [])
+
+    def test_chave_do_manifesto_aceita_qualquer_nome(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            self.assertIsNone(manifesto('carousel_images/promoção de inverno.jpg'))
+            self.assertIsNone(manifesto('loja/' + 'x' * 240 + '.png'))
+
+
+class MapaTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('mapa'))
+
+    @staticmethod
+    def loja(nome, latitude, longitude):
+        return Loja.objects.create(
+            nome=nome, endereco='Rua A', telefone='1', email=f'{nome}@mapa.petcare',
+            latitude=latitude, longitude=longitude,
+        )
+
+    @staticmethod
+    def grade():
+        return {
+            (zoom, x, y): total
+            for zoom, x, y, total in CelulaMapa.objects.filter(total__gt=0).values_list('zoom', 'x', 'y', 'total')
+        }
+
+    @staticmethod
+    def esperada(*coordenadas):
+        grade = {}
+        for latitude, longitude in coordenadas:
+            for zoom in range(ZOOM_LOJAS_INDIVIDUAIS):
+                chave = (zoom,) + celula(latitude, longitude, zoom)
+                grade[chave] = grade.get(chave, 0) + 1
+        return grade
+
+    def marcadores(self, bbox, zoom):
+        return self.client.get(reverse('loja:mapa_marcadores'), {'bbox': bbox, 'zoom': zoom})
+
+    def test_grade_acompanha_as_lojas(self):
+        paulista = self.loja('paulista', -23.56, -46.65)
+        self.loja('centro', -23.55, -46.63)
+        self.assertEqual(self.grade(), self.esperada((-23.56, -46.65), (-23.55, -46.63)))
+
+        paulista = Loja.objects.get(pk=paulista.pk)
+        paulista.latitude, paulista.longitude = -22.9, -43.2
+        paulista.save()
+        self.assertEqual(self.grade(), self.esperada((-22.9, -43.2), (-23.55, -46.63)))
+        # Saves que não mexem na coordenada não mudam a grade
+        paulista.save(update_fields=['nome'])
+        self.assertEqual(self.grade(), self.esperada((-22.9, -43.2), (-23.55, -46.63)))
+
+        paulista.delete()
+        self.assertEqual(self.grade(), self.esperada((-23.55, -46.63)))
+        reconstruir_indice()
+        self.assertEqual(self.grade(), self.esperada((-23.55, -46.63)))
+
+    def test_validacao_da_area(self):
+        for parametros in (
+            {}, {'bbox': '1,2,3'}, {'bbox': 'a,b,c,d', 'zoom': 3}, {'bbox': '-50,-10,-40,-20', 'zoom': 3},
+            {'bbox': '-50,-20,-40,91', 'zoom': 3}, {'bbox': '-50,-20,-40,-10', 'zoom': 23},
+            {'bbox': 'nan,-20,-40,-10', 'zoom': 3}, {'bbox': '-190,-20,-40,-10', 'zoom': 3},
+        ):
+            with self.subTest(parametros):
+                self.assertEqual(self.client.get(reverse('loja:mapa_marcadores'), parametros).status_code, 400)
+
+        # O mundo inteiro cabe numa tela nos zooms baixos, mas não no 10
+        self.assertEqual(self.marcadores('-180,-85,180,85', 2).status_code, 200)
+        self.assertEqual(self.marcadores('-180,-85,180,85', 10).status_code, 400)
+        self.assertEqual(self.marcadores('-46.7,-23.6,-46.6,-23.5', 10).status_code, 200)
+        # A partir do zoom das lojas individuais o limite é o de lojas
+        self.assertEqual(self.marcadores('-180,-85,180,85', ZOOM_LOJAS_INDIVIDUAIS).status_code, 200)
+
+    def test_grupos_e_lojas_individuais(self):
+        self.loja('paulista', -23.56, -46.65)
+        self.loja('centro', -23.5605, -46.6505)
+        bbox = '-46.7,-23.6,-46.6,-23.5'
+
+        grupos = self.marcadores(bbox, ZOOM_LOJAS_INDIVIDUAIS - 1).json()['marcadores']
+        self.assertEqual([(marcador['tipo'], marcador['total']) for marcador in grupos], [('grupo', 2)])
+        self.assertAlmostEqual(grupos[0]['latitude'], -23.56025)
+
+        lojas = self.marcadores(bbox, ZOOM_LOJAS_INDIVIDUAIS).json()['marcadores']
+        self.assertEqual(sorted((marcador['tipo'], marcador['nome']) for marcador in lojas), [('loja', 'centro'), ('loja', 'paulista')])
+
+    def test_area_que_cruza_o_antimeridiano(self):
+        self.loja('fiji', -17.0, 179.9)
+        self.loja('samoa', -17.0, -179.9)
+        self.loja('longe', -17.0, 170.0)
+        # oeste > leste: a área vai de 179 a -179 passando pelo 180
+        for zoom in (6, ZOOM_LOJAS_INDIVIDUAIS):
+            with self.subTest(zoom=zoom):
+                marcadores = self.marcadores('179,-18,-179,-16', zoom).json()['marcadores']
+                self.assertEqual(sum(marcador.get('total', 1) for marcador in marcadores), 2)
+
+
+class CacheReferenciasTests(TestCase):
+    """
+    Cada leitura depois de uma alteração tem que ver o valor novo: sem o
+    sinal correspondente, o cache serviria o antigo.
+    """
+
+    def setUp(self):
+        cache.clear()
+        _copias_locais.clear()
+
+    def test_categorias(self):
+        racao = Categoria.objects.create(nome='Ração')
+        with self.assertNumQueries(1):
+            self.assertEqual([categoria.nome for categoria in categorias()], ['Ração'])
+        with self.assertNumQueries(0):
+            self.assertEqual(categoria_por_nome('Ração'), racao)
+
+        racao.nome = 'Rações'
+        racao.save()
+        with self.assertNumQueries(1):
+            self.assertIsNone(categoria_por_nome('Ração'))
+        Categoria.objects.create(nome='Serviço')
+        self.assertEqual(sorted(categoria.nome for categoria in categorias()), ['Rações', 'Serviço'])
+        racao.delete()
+        # Outro processo, sem a cópia local, também vê a nova versão
+        _copias_locais.clear()
+        self.assertEqual([categoria.nome for categoria in categorias()], ['Serviço'])
+
+    def test_loja_do_usuario(self):
+        usuario = User.objects.create_user('lojista', 'dono@lojista.petcare')
+
+        def loja_id():
+            # Um usuário novo a cada requisição, sem a memória da anterior
+            return loja_do_usuario(User(pk=usuario.pk, email=usuario.email))
+
+        self.assertIsNone(loja_id())
+        with self.assertNumQueries(0):
+            self.assertIsNone(loja_id())
+
+        loja = Loja.objects.create(nome='Lojista', endereco='Rua A', telefone='1', email='dono@lojista.petcare')
+        self.assertEqual(loja_id(), loja.pk)
+        # Os saves dos agregados não descartam a relação
+        loja.total_favoritos = 3
+        loja.save(update_fields=['total_favoritos'])
+        with self.assertNumQueries(0):
+            self.assertEqual(loja_id(), loja.pk)
+
+        loja.email = 'outro@lojista.petcare'
+        loja.save()
+        self.assertIsNone(loja_id())
+        loja.email = usuario.email
+        loja.save()
+        self.assertEqual(loja_id(), loja.pk)
+        loja.delete()
+        self.assertIsNone(loja_id())
+
+    def test_favoritas(self):
+        usuario = User.objects.create_user('favoritas-cache')
+        self.client.force_login(usuario)
+        lojas = [
+            Loja.objects.create(nome=f'Loja {numero}', endereco='Rua A', telefone='1', email=f'{numero}@favoritas-cache.petcare')
+            for numero in range(3)
+        ]
+        self.assertEqual(ids_lojas_favoritas(usuario), set())
+
+        self.client.post(
+            reverse('loja:sincronizar-favoritas'),
+            json.dumps({'favoritas': {str(lojas[0].pk): True, str(lojas[1].pk): True}}),
+            content_type='application/json',
+        )
+        self.assertEqual(ids_lojas_favoritas(usuario), {lojas[0].pk, lojas[1].pk})
+        lojas[0].favoritada_por.remove(usuario)
+        self.assertEqual(ids_lojas_favoritas(usuario), {lojas[1].pk})
+        lojas[1].delete()
+        self.assertEqual(ids_lojas_favoritas(usuario), set())
+        with self.assertNumQueries(0):
+            self.assertEqual(ids_lojas_favoritas(usuario), set())
@@ -12,5 +12,9 @@ urlpatterns = [
     path('<int:pk>/', LojaDetailView.as_view(), name='loja_detail'),
     path('<int:loja_id>/avaliar/', views.avaliar_loja, name='avaliar-loja'),
     path('<int:loja_id>/favoritar/', views.favoritar_loja, name='favoritar-loja'),
+    path('favoritas/sincronizar/', views.sincronizar_favoritas, name='sincronizar-favoritas'),
+    path('mapa/marcadores/', views.mapa_marcadores, name='mapa_marcadores'),
+    path('perfil/', views.perfil_usuario, name='perfil_usuario'),
+    path('avaliacoes/exportar/', ExportarAvaliacoes.as_view(), name='exportar_avaliacoes'),
 
 ]
\ No newline at end of file
@@ -2,28 +2,45 @@
 # Imports de UpdateView, DeleteView e UserPassesTestMixin foram adicionados
 from django.views.generic import ListView, CreateView, View, DetailView, UpdateView, DeleteView
 import json
+import math
 from django.urls import reverse_lazy, reverse
 from django.forms import Select, TextInput, Textarea, NumberInput, CheckboxInput, FileInput, EmailInput, TimeInput, URLInput
-from .models import Loja, Avaliacao, LojaFavorita
+from .models import Loja, Avaliacao, LojaFavorita, ResumoUsuario
 from django.http import JsonResponse, HttpResponseBadRequest
-from produto.models import Produto, Categoria
+from produto.models import Produto
 from produto.consts import ANIMAL_CHOICES, IDADE_CHOICES, PORTE_CHOICES
+from django.db import transaction
 from django.db.models import Q
+from django.core.paginator import Paginator
 from django.http import FileResponse, Http404
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import BadRequest, ObjectDoesNotExist
 # Import UserPassesTestMixin
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from loja.forms import FormularioLoja
 from django.shortcuts import render, get_object_or_404, redirect
 from .forms import AvaliacaoForm, FormularioLoja
-from django.db.models.functions import Radians, Sin, Cos, Sqrt, ATan2
+from .geo import RAIO_MAXIMO_BUSCA_KM, lojas_no_raio, paginar_por_proximidade
+from .mapa import MAXIMO_CELULAS, marcadores, total_celulas
+from .cache import (
+    TEMPO_CACHE_FRAGMENTOS, categorias, ids_lojas_favoritas, invalidar_lojas_favoritas,
+    invalidar_total_favoritos, usuario_e_lojista, versao_loja,
+)
+from .busca import INDICE_LOJAS
+from produto.busca import INDICE_PRODUTOS
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_POST
-from django.db.models import Avg
 from agendamento.models import Agendamento
+from petcareapp.exportacao import ExportacaoView
+from petcareapp.fila_escrita import escrever
 from datetime import datetime
 from django.utils import timezone
 
+# Itens por página em cada lista do perfil (agendamentos e avaliações)
+ITENS_POR_PAGINA_PERFIL = 10
+# Lojas favoritas exibidas no perfil; a lista completa fica em loja_list
+LOJAS_FAVORITAS_NO_PERFIL = 12
+MAXIMO_FAVORITAS_POR_SINCRONIZACAO = 100
+
 
 
 class ListarLojas(LoginRequiredMixin, ListView):
@@ -34,63 +51,83 @@ class ListarLojas(LoginRequiredMixin, ListView):
     template_name = 'loja/loja_list.html'
     login_url = reverse_lazy('login')
     context_object_name = 'lista_lojas'
+    paginate_by = 12
 
     def get_queryset(self):
-        # Anotar a média de avaliação diretamente na queryset
-        queryset = Loja.objects.annotate(
-            avg_avaliacao=Avg('avaliacoes__nota')
-        )
+        # Ponto da ordenação por proximidade, paginada por cursor
+        self.proximidade = None
+        # A média de avaliação já vem pronta em Loja.avaliacao_media
+        queryset = Loja.objects.all()
 
         # Filtros
         query = self.request.GET.get('q')
         favoritas = self.request.GET.get('favoritas')
 
         if query:
-            queryset = queryset.filter(Q(nome__icontains=query) | Q(endereco__icontains=query))
+            queryset = INDICE_LOJAS.filtrar(queryset, query)
         if favoritas and self.request.user.is_authenticated:
             queryset = queryset.filter(favoritada_por=self.request.user)
 
         # Ordenação
-        ordenar_por = self.request.GET.get('ordenar', 'nome')
+        # Com um termo de busca, o padrão passa a ser a relevância
+        ordenar_por = self.request.GET.get('ordenar', 'relevancia' if query else 'nome')
         lat = self.request.GET.get('lat')
         lon = self.request.GET.get('lon')
 
         if ordenar_por == 'proximidade' and lat and lon:
             try:
-                user_lat = Radians(float(lat))
-                user_lon = Radians(float(lon))
-
-                # Fórmula de Haversine para calcular distância
-                queryset = queryset.annotate(
-                    dlat=Radians('latitude') - user_lat,
-                    dlon=Radians('longitude') - user_lon
-                ).annotate(
-                    a=Sin('dlat' / 2)**2 + Cos(user_lat) * Cos(Radians('latitude')) * Sin('dlon' / 2)**2
-                ).annotate(
-                    c=2 * ATan2(Sqrt('a'), Sqrt(1 - 'a'))  # Raio da Terra em km
-                ).annotate(
-                    distancia=6371 * 'c'  # Raio da Terra em km
-                ).order_by('distancia')
+                user_lat = float(lat)
+                user_lon = float(lon)
+                raio = self.request.GET.get('raio')
+                raio = float(raio) if raio else None
             except (ValueError, TypeError):
                 # Se lat/lon forem inválidos, ordena por nome
-                queryset = queryset.order_by('nome')
+                return queryset.order_by('nome', 'id')
+            # As comparações também recusam nan e infinito
+            if not (-90 <= user_lat <= 90 and -180 <= user_lon <= 180):
+                raise BadRequest("lat ou lon fora dos limites.")
+            if raio is not None and not 0 < raio < math.inf:
+                raise BadRequest("raio deve ser um número de km maior que zero.")
+
+            # Busca pelo índice de geohash: só as lojas das células
+            # próximas são lidas e têm a distância calculada
+            if raio is not None:
+                return lojas_no_raio(queryset, user_lat, user_lon, min(raio, RAIO_MAXIMO_BUSCA_KM))
+            # Sem raio, a lista vai até a loja mais distante
+            self.proximidade = (user_lat, user_lon)
+            return queryset
+        elif ordenar_por == 'relevancia' and query:
+            queryset = INDICE_LOJAS.ordenar_por_relevancia(queryset, query)
         elif ordenar_por == 'avaliacao':
-            queryset = queryset.order_by('-avaliacao_media', 'nome')
+            queryset = queryset.order_by('-avaliacao_media', 'nome', 'id')
         else: # Padrão é ordenar por nome
-            queryset = queryset.order_by('nome')
+            queryset = queryset.order_by('nome', 'id')
 
         return queryset
 
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Na ordenação por proximidade, pagina por cursor (distância, id):
+        a página seguinte busca só as lojas além da última exibida.
+        """
+        if self.proximidade is None:
+            return super().paginate_queryset(queryset, page_size)
+        pagina = paginar_por_proximidade(queryset, *self.proximidade, page_size, self.request.GET.get('cursor'))
+        return None, pagina, pagina.itens, pagina.has_next() or pagina.has_previous()
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        context['paginacao_por_cursor'] = self.proximidade is not None
         
         # ADICIONADO: Passa a informação se o usuário é admin
         context['is_admin'] = self.request.user.is_authenticated and self.request.user.is_superuser
         
         if self.request.user.is_authenticated:
+            # Uma única consulta (em cache) para as favoritas do usuário,
+            # cruzada apenas com as lojas da página atual
+            favoritas = ids_lojas_favoritas(self.request.user)
             context['favoritas_usuario'] = [
-                loja.id for loja in context['lista_lojas']
-                if loja.favoritada_por.filter(id=self.request.user.id).exists()
+                loja.id for loja in context['lista_lojas'] if loja.id in favoritas
             ]
         else:
             context['favoritas_usuario'] = []
@@ -138,7 +175,7 @@ class LojaDetailView(LoginRequiredMixin, DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        loja = self.get_object()
+        loja = self.object
         
         # Pega os parâmetros de filtro da requisição GET
         search_query = self.request.GET.get('q', '')
@@ -152,7 +189,7 @@ class LojaDetailView(LoginRequiredMixin, DetailView):
         
         # Aplica os filtros se eles existirem
         if search_query:
-            produtos = produtos.filter(nome__icontains=search_query)
+            produtos = INDICE_PRODUTOS.filtrar(produtos, search_query)
         if categoria_query:
             produtos = produtos.filter(categoria__id=categoria_query)
         if animal_query:
@@ -162,30 +199,33 @@ class LojaDetailView(LoginRequiredMixin, DetailView):
         if preco_max_query:
             produtos = produtos.filter(preco__lte=preco_max_query)
 
-        # Adiciona os produtos filtrados e as opções de filtro ao contexto
-        context['produtos'] = produtos.distinct()
-        context['categorias'] = Categoria.objects.all()
+        # Os querysets de produtos e avaliações só são executados quando o
+        # fragmento correspondente não está em cache (ver o template)
+        context['produtos'] = produtos.select_related('categoria').distinct()
+        context['categorias'] = categorias()
         context['animal_choices'] = ANIMAL_CHOICES # Usado nos filtros
-
         context['avaliacoes'] = loja.avaliacoes.select_related('usuario').order_by('-criado_em')
+
+        # Chaves dos fragmentos compartilhados entre os usuários
+        context['versao_loja'] = versao_loja(loja.pk)
+        context['tempo_cache'] = TEMPO_CACHE_FRAGMENTOS
+        context['filtros_produtos'] = [
+            search_query, categoria_query, animal_query, preco_min_query, preco_max_query,
+        ]
+
         user = self.request.user
         
         # ADICIONADO: Passa a informação se o usuário é admin
         context['is_admin'] = user.is_authenticated and user.is_superuser
-        
-        if user.is_authenticated:
-            context['ja_avaliou'] = loja.avaliacoes.filter(usuario=user).exists()
-        else:
-            context['ja_avaliou'] = False
 
+        # Dados do próprio usuário, aplicados por cima dos fragmentos
         if user.is_authenticated:
-            context['favoritada'] = loja.favoritada_por.filter(id=user.id).exists()
-            # Adiciona os IDs dos produtos curtidos pelo usuário para esta página
-            produtos_curtidos_ids = user.produtos_curtidos.values_list('id', flat=True)
-            produtos_na_pagina_ids = [p.id for p in context['produtos']]
-            context['curtidos_usuario'] = list(set(produtos_curtidos_ids) & set(produtos_na_pagina_ids))
-            context['is_store_user'] = Loja.objects.filter(email=user.email).exists()
+            context['minha_avaliacao'] = loja.avaliacoes.filter(usuario=user).first()
+            context['ja_avaliou'] = context['minha_avaliacao'] is not None
+            context['favoritada'] = loja.pk in ids_lojas_favoritas(user)
+            context['is_store_user'] = usuario_e_lojista(user)
         else:
+            context['ja_avaliou'] = False
             context['favoritada'] = False
             context['is_store_user'] = False
 
@@ -200,31 +240,72 @@ def avaliar_loja(request, loja_id):
         nota = int(request.POST.get('nota', 0))
         comentario = request.POST.get('comentario', '').strip()
 
-        Avaliacao.objects.update_or_create(
+        escrever(
+            Avaliacao.objects.update_or_create,
             usuario=request.user,
             loja=loja,
             defaults={'nota': nota, 'comentario': comentario}
         )
 
-        loja.atualizar_media()
         return redirect('loja:loja_detail', pk=loja.id)
 
     return redirect('loja:loja_detail', pk=loja.id)
 
 @login_required
 def favoritar_loja(request, loja_id):
-    loja = Loja.objects.get(pk=loja_id)
-    if request.user in loja.favoritada_por.all():
-        loja.favoritada_por.remove(request.user)
-        favoritado = False
-    else:
-        loja.favoritada_por.add(request.user)
-        favoritado = True
-
-    total_favoritos = loja.favoritada_por.count()
+    """
+    Alterna a loja entre favorita e não favorita para o usuário.
+    """
+    try:
+        favoritado, total_favoritos = escrever(LojaFavorita.alternar, request.user.pk, loja_id)
+    except Loja.DoesNotExist:
+        raise Http404("Loja não encontrada.")
+    invalidar_lojas_favoritas(request.user)
+    invalidar_total_favoritos(loja_id)
     return JsonResponse({'favoritado': favoritado, 'total_favoritos': total_favoritos})
 
 
+def _aplicar_favoritas(usuario_id, alteracoes):
+    lojas, ignoradas = {}, []
+    # Uma única transação para todas as alterações
+    with transaction.atomic():
+        for loja_id, favoritar in alteracoes.items():
+            try:
+                favoritado, total_favoritos = LojaFavorita.alternar(usuario_id, loja_id, favoritar)
+            except Loja.DoesNotExist:
+                ignoradas.append(loja_id)
+                continue
+            lojas[loja_id] = {'favoritado': favoritado, 'total_favoritos': total_favoritos}
+    return lojas, ignoradas
+
+
+@login_required
+@require_POST
+def sincronizar_favoritas(request):
+    """
+    Aplica de uma vez várias alterações de favoritas feitas no cliente.
+    Corpo JSON: ``{"favoritas": {"<loja_id>": true, "<loja_id>": false}}``,
+    com o estado final de cada loja (repetir o envio não muda nada).
+    Retorna o estado e o total de favoritos de cada loja; lojas
+    inexistentes voltam em ``ignoradas``.
+    """
+    try:
+        favoritas = json.loads(request.body)['favoritas']
+        alteracoes = {int(loja_id): bool(favoritar) for loja_id, favoritar in favoritas.items()}
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return HttpResponseBadRequest('Envie {"favoritas": {"<loja_id>": true|false, ...}}.')
+    if len(alteracoes) > MAXIMO_FAVORITAS_POR_SINCRONIZACAO:
+        return HttpResponseBadRequest(
+            f"Envie no máximo {MAXIMO_FAVORITAS_POR_SINCRONIZACAO} lojas por vez."
+        )
+
+    lojas, ignoradas = escrever(_aplicar_favoritas, request.user.pk, alteracoes)
+    for loja_id in lojas:
+        invalidar_total_favoritos(loja_id)
+    invalidar_lojas_favoritas(request.user)
+    return JsonResponse({'lojas': lojas, 'ignoradas': ignoradas})
+
+
 @login_required
 def mapa_lojas_view(request):
     """
@@ -247,31 +328,55 @@ def mapa_lojas_view(request):
             context['loja_para_editar'] = None
     return render(request, 'loja/mapa_lojas.html', context)
 
+
+@login_required
+def mapa_marcadores(request):
+    """
+    Retorna em JSON os marcadores da área visível do mapa, já agrupados.
+    Recebe `bbox=oeste,sul,leste,norte` (como o `toBBoxString()` do
+    Leaflet) e `zoom`; uma área com mais de `MAXIMO_CELULAS` células no
+    zoom pedido é recusada com 400.
+    """
+    try:
+        oeste, sul, leste, norte = (float(valor) for valor in request.GET['bbox'].split(','))
+        zoom = int(request.GET.get('zoom', 0))
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest("Informe bbox=oeste,sul,leste,norte e zoom.")
+    if not (-90 <= sul <= norte <= 90 and -180 <= oeste <= 180 and -180 <= leste <= 180 and 0 <= zoom <= 22):
+        return HttpResponseBadRequest("bbox ou zoom fora dos limites.")
+    if total_celulas(sul, oeste, norte, leste, zoom) > MAXIMO_CELULAS:
+        return HttpResponseBadRequest("Área grande demais para o zoom.")
+    return JsonResponse({'zoom': zoom, 'marcadores': marcadores(sul, oeste, norte, leste, zoom)})
+
 @login_required
 def perfil_usuario(request):
     """
     Exibe a página de perfil do usuário com suas informações e atividades.
+    Os totais vêm do ``ResumoUsuario`` e cada lista é paginada, então o
+    número de consultas não cresce com o histórico do usuário.
     """
-
-    agendamentos_futuros = Agendamento.objects.filter(
-        usuario=request.user,
-        data_hora__gte=timezone.now() # Não se esqueça de importar timezone
-      ).order_by('data_hora')
-    
-    agendamentos_passados = Agendamento.objects.filter(
-        usuario=request.user,
-        data_hora__lt=timezone.now()
-      ).order_by('-data_hora')
-
     user = request.user
-    lojas_favoritas = user.lojas_favoritadas.all().order_by('nome')
-    avaliacoes_usuario = Avaliacao.objects.filter(usuario=user).select_related('loja').order_by('-criado_em')
+    agora = timezone.now()
+    resumo = ResumoUsuario.do_usuario(user)
+
+    agendamentos = Agendamento.objects.filter(usuario=user).select_related('loja', 'produto')
+    agendamentos_futuros = Paginator(
+        agendamentos.filter(data_hora__gte=agora).order_by('data_hora'), ITENS_POR_PAGINA_PERFIL
+    ).get_page(request.GET.get('pagina_futuros'))
+    agendamentos_passados = Paginator(
+        agendamentos.filter(data_hora__lt=agora).order_by('-data_hora'), ITENS_POR_PAGINA_PERFIL
+    ).get_page(request.GET.get('pagina_passados'))
+    avaliacoes_usuario = Paginator(
+        Avaliacao.objects.filter(usuario=user).select_related('loja').order_by('-criado_em'), ITENS_POR_PAGINA_PERFIL
+    ).get_page(request.GET.get('pagina_avaliacoes'))
+    lojas_favoritas = user.lojas_favoritadas.order_by('nome')[:LOJAS_FAVORITAS_NO_PERFIL]
 
     context = {
         'lojas_favoritas': lojas_favoritas,
         'avaliacoes': avaliacoes_usuario,
-        'total_favoritos': lojas_favoritas.count(),
-        'total_avaliacoes': avaliacoes_usuario.count(),
+        'total_favoritos': resumo.total_favoritos,
+        'total_avaliacoes': resumo.total_avaliacoes,
+        'total_proximos_agendamentos': resumo.total_proximos_agendamentos,
         'titulo': 'Meu Perfil',
         'agendamentos_futuros': agendamentos_futuros,
         'agendamentos_passados': agendamentos_passados,
@@ -378,4 +483,17 @@ class AvaliacaoDeleteView(AvaliacaoOwnerMixin, DeleteView):
         context = super().get_context_data(**kwargs)
         context['loja'] = self.object.loja
         context['titulo'] = f'Excluir Avaliação - {self.object.loja.nome}'
-        return context
\ No newline at end of file
+        return context
+
+
+class ExportarAvaliacoes(ExportacaoView):
+    """
+    Exporta as avaliações em CSV ou JSON, com filtro pela data da avaliação.
+    """
+    model = Avaliacao
+    nome_arquivo = 'avaliacoes'
+    campo_data = 'criado_em'
+    colunas = [
+        ('id', 'pk'), ('loja', 'loja_id'), ('loja_nome', 'loja__nome'), ('usuario', 'usuario__username'),
+        ('nota', 'nota'), ('comentario', 'comentario'), ('criado_em', 'criado_em'),
+    ]
@@ -0,0 +1,104 @@
+"""
+Storage dos arquivos estáticos para produção.
+
+Além dos nomes com hash do ``ManifestStaticFilesStorage`` (ex:
+``css/base.3f2a9c1e.css``), que podem ser guardados em cache pelo
+navegador para sempre, o ``collectstatic`` grava ao lado de cada arquivo
+de texto uma versão ``.gz`` e, se o pacote ``brotli`` estiver instalado,
+uma ``.br``. O servidor web entrega a versão pré-comprimida sem gastar
+CPU a cada requisição (no nginx: ``gzip_static on`` e ``brotli_static on``).
+"""
+import gzip
+import logging
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+EXTENSOES_COMPRIMIVEIS = ('.css', '.js', '.map', '.svg', '.json', '.txt', '.html', '.xml', '.ico')
+# Arquivos menores que isso não compensam a versão comprimida
+TAMANHO_MINIMO = 256
+
+
+def _gzip(conteudo):
+    # mtime fixo para que o mesmo arquivo gere sempre o mesmo .gz
+    return gzip.compress(conteudo, compresslevel=9, mtime=0)
+
+
+def _brotli(conteudo):
+    return brotli.compress(conteudo, quality=11)
+
+
+class EstaticosComprimidos(ManifestStaticFilesStorage):
+    """
+    ``ManifestStaticFilesStorage`` que também grava as versões .gz e .br
+    dos arquivos de texto.
+    """
+    # Um {% static %} de um arquivo fora do manifesto gera a URL sem hash
+    # em vez de derrubar a página com um erro 500
+    manifest_strict = False
+
+    # Ligado durante o post_process do collectstatic
+    coletando = False
+
+    def hashed_name(self, name, content=None, filename=None):
+        try:
+            return super().hashed_name(name, content, filename)
+        except ValueError:
+            # Um CSS que cita um arquivo inexistente não deve impedir o
+            # collectstatic; a referência fica com o nome original. Fora
+            # dele (ex: testes, sem o collectstatic) o aviso só faria ruído
+            if self.coletando:
+                logger.warning('Arquivo estático não encontrado: %s', name)
+            return name
+
+    def compressores(self):
+        compressores = [('.gz', _gzip)]
+        if brotli is not None:
+            compressores.append(('.br', _brotli))
+        return compressores
+
+    def post_process(self, paths, dry_run=False, **options):
+        processados = []
+        self.coletando = True
+        try:
+            for original, processado, alterado in super().post_process(paths, dry_run, **options):
+                if processado and not isinstance(alterado, Exception):
+                    processados.append(processado)
+                yield original, processado, alterado
+        finally:
+            self.coletando = False
+        if dry_run:
+            return
+        # Comprime tanto o nome com hash quanto o original
+        for nome in set(processados) | {nome for nome in paths}:
+            for comprimido in self.comprimir(nome):
+                yield nome, comprimido, True
+
+    def comprimir(self, nome):
+        """
+        Grava as versões comprimidas de ``nome`` e retorna os nomes gravados.
+        """
+        if not nome.endswith(EXTENSOES_COMPRIMIVEIS) or not self.exists(nome):
+            return []
+        with self.open(nome) as arquivo:
+            conteudo = arquivo.read()
+        if len(conteudo) < TAMANHO_MINIMO:
+            return []
+        gravados = []
+        for extensao, comprimir in self.compressores():
+            comprimido = comprimir(conteudo)
+            if len(comprimido) >= len(conteudo):
+                continue
+            destino = nome + extensao
+            if self.exists(destino):
+                self.delete(destino)
+            self._save(destino, ContentFile(comprimido))
+            gravados.append(destino)
+        return gravados
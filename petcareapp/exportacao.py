@@ -0,0 +1,164 @@
+"""
+Exportação em fluxo (CSV ou JSON) de tabelas grandes.
+
+As linhas são lidas com ``values_list(...).iterator(chunk_size=...)`` e
+escritas uma a uma por um gerador entregue ao ``StreamingHttpResponse``:
+nem o queryset nem o arquivo ficam inteiros na memória, que se mantém
+estável com qualquer número de linhas.
+
+As views de exportação herdam de ``ExportacaoView`` e definem o modelo,
+as colunas e o campo de data usado no filtro por período. Parâmetros
+aceitos na URL: ``formato`` (``csv``, padrão, ou ``json``), ``loja`` (id;
+só para superusuários, o lojista exporta sempre a própria loja),
+``inicio`` e ``fim`` (AAAA-MM-DD, inclusivos).
+"""
+import csv
+from datetime import datetime, time, timedelta
+
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+from django.urls import reverse_lazy
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.views.generic import View
+
+from loja.cache import loja_do_usuario, usuario_e_lojista
+
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'json': 'application/json',
+}
+TAMANHO_BLOCO = 2000
+# Tamanho aproximado de cada pedaço enviado ao servidor
+TAMANHO_PEDACO = 64 * 1024
+
+
+class _Eco:
+    """
+    "Arquivo" que devolve o que recebe, para o ``csv.writer`` gerar texto
+    linha a linha em vez de acumular num buffer.
+    """
+
+    def write(self, valor):
+        return valor
+
+
+def _formatar(valor):
+    if isinstance(valor, datetime):
+        return timezone.localtime(valor).isoformat() if timezone.is_aware(valor) else valor.isoformat()
+    return valor
+
+
+def linhas_csv(cabecalho, registros):
+    escritor = csv.writer(_Eco())
+    # BOM para o Excel reconhecer o UTF-8
+    yield '\ufeff' + escritor.writerow(cabecalho)
+    for registro in registros:
+        yield escritor.writerow([_formatar(valor) for valor in registro])
+
+
+def itens_json(cabecalho, registros):
+    """
+    Uma lista JSON de objetos, escrita um objeto por vez.
+    """
+    codificador = DjangoJSONEncoder(ensure_ascii=False)
+    separador = '[\n'
+    for registro in registros:
+        yield separador + codificador.encode(dict(zip(cabecalho, map(_formatar, registro))))
+        separador = ',\n'
+    yield '[]\n' if separador == '[\n' else '\n]\n'
+
+
+def _em_pedacos(partes):
+    """
+    Junta as linhas em pedaços de ``TAMANHO_PEDACO``, em vez de entregar ao
+    servidor uma escrita por linha.
+    """
+    pedaco, tamanho = [], 0
+    for parte in partes:
+        pedaco.append(parte)
+        tamanho += len(parte)
+        if tamanho >= TAMANHO_PEDACO:
+            yield ''.join(pedaco)
+            pedaco, tamanho = [], 0
+    if pedaco:
+        yield ''.join(pedaco)
+
+
+class ExportacaoView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """
+    Base das exportações. As subclasses definem ``model``, ``colunas``
+    (lista de (título, campo) para o ``values_list``), ``nome_arquivo`` e,
+    se houver filtro por período, ``campo_data``.
+    """
+    model = None
+    colunas = []
+    nome_arquivo = None
+    campo_data = None
+    campo_loja = 'loja'
+    login_url = reverse_lazy('login')
+
+    def test_func(self):
+        """Permite acesso a superusuários ou usuários associados a uma loja."""
+        if self.request.user.is_superuser:
+            return True
+        return usuario_e_lojista(self.request.user)
+
+    def get_queryset(self):
+        return self.model.objects.all()
+
+    def filtrar(self, queryset):
+        """
+        Aplica os filtros de loja e período; levanta ``ValueError`` com a
+        mensagem para o usuário se algum parâmetro for inválido.
+        """
+        if self.request.user.is_superuser:
+            loja = self.request.GET.get('loja')
+            if loja:
+                if not loja.isdigit():
+                    raise ValueError("O parâmetro loja deve ser o id da loja.")
+                queryset = queryset.filter(**{f'{self.campo_loja}_id': loja})
+        else:
+            queryset = queryset.filter(**{f'{self.campo_loja}_id': loja_do_usuario(self.request.user)})
+
+        inicio, fim = self.request.GET.get('inicio'), self.request.GET.get('fim')
+        if (inicio or fim) and self.campo_data is None:
+            raise ValueError("Esta exportação não tem filtro por período.")
+        for parametro, texto, operador in (('inicio', inicio, 'gte'), ('fim', fim, 'lt')):
+            if not texto:
+                continue
+            try:
+                dia = parse_date(texto)
+            except ValueError:
+                dia = None
+            if dia is None:
+                raise ValueError(f"Informe {parametro}=AAAA-MM-DD.")
+            if operador == 'lt':
+                # O dia final entra inteiro
+                dia += timedelta(days=1)
+            # Compara com o instante em vez de __date, que aplicaria uma
+            # função à coluna em cada linha
+            limite = timezone.make_aware(datetime.combine(dia, time.min))
+            queryset = queryset.filter(**{f'{self.campo_data}__{operador}': limite})
+        return queryset
+
+    def get(self, request, *args, **kwargs):
+        formato = request.GET.get('formato', 'csv')
+        if formato not in FORMATOS:
+            return HttpResponseBadRequest(f"Formato desconhecido: use {' ou '.join(FORMATOS)}.")
+        try:
+            queryset = self.filtrar(self.get_queryset())
+        except ValueError as erro:
+            return HttpResponseBadRequest(str(erro))
+
+        cabecalho = [titulo for titulo, _ in self.colunas]
+        queryset = queryset.order_by('pk').values_list(*[campo for _, campo in self.colunas])
+        # O banco (réplica ou primário) é escolhido agora: o corpo é gerado
+        # depois que a requisição saiu dos middlewares
+        registros = queryset.using(queryset.db).iterator(chunk_size=TAMANHO_BLOCO)
+        gerador = linhas_csv if formato == 'csv' else itens_json
+        response = StreamingHttpResponse(_em_pedacos(gerador(cabecalho, registros)), content_type=FORMATOS[formato])
+        nome = f'{self.nome_arquivo}-{timezone.localdate():%Y%m%d}.{formato}'
+        response['Content-Disposition'] = f'attachment; filename="{nome}"'
+        return response
@@ -0,0 +1,58 @@
+"""
+Fila única de escrita.
+
+O SQLite aceita um escritor por vez. Com várias requisições gravando ao
+mesmo tempo, cada thread fica tentando pegar o lock do banco até o busy
+timeout. Com ``FILA_DE_ESCRITA`` ligada, as escritas das views passam por
+``escrever()``: elas rodam uma de cada vez numa thread dedicada, e a
+thread da requisição só espera o resultado.
+
+A função roda direto, sem passar pela fila, quando a fila está desligada,
+quando o banco não é SQLite e quando quem chama já está dentro de uma
+transação. No último caso a transação pode estar segurando o lock, e a
+thread escritora ficaria esperando por ela.
+
+A fila vale dentro de um processo. Com vários processos (ex: workers do
+gunicorn), cada um tem a sua fila, e eles disputam o lock pelo busy
+timeout.
+"""
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+
+from .replicas import fixar_no_primario
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='escritor')
+_local = threading.local()
+
+
+def _executar(funcao, args, kwargs):
+    # Descarta uma conexão que ficou inutilizável por um erro anterior
+    close_old_connections()
+    _local.na_fila = True
+    try:
+        return funcao(*args, **kwargs)
+    finally:
+        _local.na_fila = False
+
+
+def escrever(funcao, *args, **kwargs):
+    """
+    Executa ``funcao(*args, **kwargs)`` na thread escritora e retorna o
+    resultado (ou levanta a exceção dela).
+    """
+    conexao = connections[DEFAULT_DB_ALIAS]
+    if (
+        not getattr(settings, 'FILA_DE_ESCRITA', False)
+        or conexao.vendor != 'sqlite'
+        or getattr(_local, 'na_fila', False)
+        or conexao.in_atomic_block
+    ):
+        return funcao(*args, **kwargs)
+    # A escrita vale para a requisição atual, que passa a ler do primário
+    fixar_no_primario()
+    contexto = contextvars.copy_context()
+    return _executor.submit(contexto.run, _executar, funcao, args, kwargs).result()
@@ -0,0 +1,74 @@
+"""
+Usuário da requisição sem consultar o banco.
+
+Com as sessões em ``cached_db`` e o ``BackendComCache``, o
+``AuthenticationMiddleware`` resolve a sessão e o usuário pelo cache: uma
+requisição autenticada só consulta o banco quando o usuário foi editado
+(os sinais de ``User`` descartam a cópia) ou a cópia expirou. A loja do
+usuário vem de ``loja.cache.loja_do_usuario``, guardada no próprio
+usuário da requisição.
+
+O hash da senha não vai para o cache: guardamos só os campos usados nas
+requisições e os hashes de sessão derivados da senha, que o
+``AuthenticationMiddleware`` compara com o da sessão.
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import router
+
+# Limite para edições feitas sem passar pelo save() (ex: ``update()``)
+TEMPO_CACHE_USUARIO = 60 * 15
+
+# Campos do usuário guardados no cache (todos menos a senha)
+CAMPOS_EM_CACHE = (
+    'id', 'username', 'first_name', 'last_name', 'email',
+    'is_active', 'is_staff', 'is_superuser', 'last_login', 'date_joined',
+)
+
+
+def _chave_usuario(user_id):
+    return f'identidade:usuario:{user_id}'
+
+
+def invalidar_usuario(user_id):
+    cache.delete(_chave_usuario(user_id))
+
+
+def _para_cache(user):
+    return {
+        'campos': {campo: getattr(user, campo) for campo in CAMPOS_EM_CACHE},
+        'hash_sessao': user.get_session_auth_hash(),
+        'hashes_anteriores': list(user.get_session_auth_fallback_hash()),
+    }
+
+
+def _do_cache(dados):
+    modelo = get_user_model()
+    # Como um ``only()`` (valores na ordem dos campos do modelo): a senha
+    # fica adiada, então um save() do usuário da requisição grava só os
+    # campos carregados
+    nomes = [campo.attname for campo in modelo._meta.concrete_fields if campo.attname in dados['campos']]
+    user = modelo.from_db(router.db_for_read(modelo), nomes, [dados['campos'][nome] for nome in nomes])
+    # Sem isso, conferir a sessão leria a senha do banco
+    user.get_session_auth_hash = lambda: dados['hash_sessao']
+    user.get_session_auth_fallback_hash = lambda: iter(dados['hashes_anteriores'])
+    return user
+
+
+class BackendComCache(ModelBackend):
+    """
+    ``ModelBackend`` que guarda em cache o usuário carregado pela sessão.
+    """
+
+    def get_user(self, user_id):
+        chave = _chave_usuario(user_id)
+        dados = cache.get(chave)
+        if dados is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            cache.set(chave, _para_cache(user), TEMPO_CACHE_USUARIO)
+        else:
+            user = _do_cache(dados)
+        return user if self.user_can_authenticate(user) else None
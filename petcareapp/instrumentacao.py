@@ -0,0 +1,135 @@
+"""
+Medição das consultas SQL de cada requisição.
+
+Com ``INSTRUMENTACAO_SQL`` ligada, o ``InstrumentacaoSQLMiddleware``
+registra as consultas feitas pela requisição (em todas as conexões da
+thread) e:
+
+- devolve o número de consultas e o tempo total no cabeçalho
+  ``Server-Timing`` (aparece na aba de rede do navegador);
+- avisa no log ``petcareapp.instrumentacao`` quando a mesma forma de
+  consulta (o SQL sem os valores) se repete ``SQL_LIMITE_REPETICOES``
+  vezes, com o trecho do projeto que a disparou: o sinal de um N+1;
+- compara o total com o orçamento da view (``SQL_ORCAMENTO_CONSULTAS``,
+  pelo nome da URL, ou ``SQL_ORCAMENTO_PADRAO``). Com
+  ``SQL_FALHAR_NO_ORCAMENTO`` (para os testes) o excesso levanta
+  ``OrcamentoExcedido``; senão só vai para o log.
+
+As escritas feitas pela fila de escrita (``petcareapp.fila_escrita``)
+rodam em outra thread e não entram na conta.
+"""
+import logging
+import re
+import time
+import traceback
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_VALORES = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LISTAS = re.compile(r'(?:%s|\?)(?:\s*,\s*(?:%s|\?))+')
+
+
+class OrcamentoExcedido(AssertionError):
+    """
+    A view fez mais consultas que o orçamento configurado.
+    """
+
+
+def forma_da_consulta(sql):
+    """
+    O SQL sem os valores: consultas que só diferem nos parâmetros (ou no
+    tamanho de uma lista ``IN``) têm a mesma forma.
+    """
+    return _LISTAS.sub('%s...', _VALORES.sub('%s', sql))
+
+
+def _trecho_do_projeto():
+    """
+    As chamadas do próprio projeto na pilha atual, da mais externa para a
+    mais interna (sem o Django, as bibliotecas e a passagem pelos
+    middlewares).
+    """
+    base = str(settings.BASE_DIR)
+    quadros = [
+        quadro for quadro in traceback.extract_stack()[:-2]
+        if quadro.filename.startswith(base)
+        and 'site-packages' not in quadro.filename
+        and not quadro.filename.endswith('instrumentacao.py')
+        and 'get_response(' not in (quadro.line or '')
+    ]
+    return ''.join(traceback.format_list(quadros))
+
+
+class RegistroDeConsultas:
+    """
+    ``execute_wrapper`` que conta as consultas, o tempo e as formas
+    repetidas.
+    """
+
+    def __init__(self, limite_repeticoes):
+        self.limite_repeticoes = limite_repeticoes
+        self.total = 0
+        self.duracao = 0.0
+        self.formas = Counter()
+        # forma -> pilha do projeto quando ela atingiu o limite
+        self.repetidas = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duracao += time.perf_counter() - inicio
+            self.total += 1
+            forma = forma_da_consulta(sql)
+            self.formas[forma] += 1
+            if self.formas[forma] == self.limite_repeticoes:
+                self.repetidas[forma] = _trecho_do_projeto()
+
+
+def _orcamento(nome_view):
+    orcamentos = getattr(settings, 'SQL_ORCAMENTO_CONSULTAS', {})
+    return orcamentos.get(nome_view, getattr(settings, 'SQL_ORCAMENTO_PADRAO', None))
+
+
+class InstrumentacaoSQLMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'INSTRUMENTACAO_SQL', False):
+            return self.get_response(request)
+
+        registro = RegistroDeConsultas(getattr(settings, 'SQL_LIMITE_REPETICOES', 5))
+        inicio = time.perf_counter()
+        with ExitStack() as pilha:
+            for conexao in connections.all():
+                pilha.enter_context(conexao.execute_wrapper(registro))
+            response = self.get_response(request)
+        duracao = time.perf_counter() - inicio
+
+        response.headers['Server-Timing'] = ', '.join([
+            f'sql;desc="{registro.total} consultas";dur={registro.duracao * 1000:.1f}',
+            f'total;dur={duracao * 1000:.1f}',
+        ])
+
+        match = getattr(request, 'resolver_match', None)
+        nome_view = match.view_name if match else request.path
+        for forma, trecho in registro.repetidas.items():
+            logger.warning(
+                'Possível N+1 em %s: %d consultas com a forma\n  %s\nchamadas a partir de:\n%s',
+                nome_view, registro.formas[forma], forma, trecho,
+            )
+
+        orcamento = _orcamento(nome_view)
+        if orcamento is not None and registro.total > orcamento:
+            mensagem = f'{nome_view} fez {registro.total} consultas (orçamento: {orcamento})'
+            if getattr(settings, 'SQL_FALHAR_NO_ORCAMENTO', False):
+                raise OrcamentoExcedido(mensagem)
+            logger.warning(mensagem)
+        return response
@@ -0,0 +1,158 @@
+"""
+Entrega dos arquivos de mídia (uploads).
+
+A view responde a GET condicional (ETag / Last-Modified) com 304 e a
+pedidos de intervalo (``Range: bytes=...``) com 206. Em produção o corpo
+do arquivo não precisa passar pelo Python: com ``MIDIA_ENTREGA`` igual a
+``'x-accel-redirect'`` (nginx) ou ``'x-sendfile'`` (Apache, lighttpd) a
+view só confere o arquivo e devolve o cabeçalho para o servidor web
+enviá-lo. Exemplo para o nginx::
+
+    location /_midia/ {
+        internal;
+        alias /caminho/do/projeto/media/;
+    }
+
+Os arquivos do armazenamento por conteúdo (``cas/...``) nunca mudam, então
+são marcados como imutáveis.
+
+A rota só é montada com ``DEBUG`` ou com ``MIDIA_ENTREGA`` configurada
+(ver ``petcareapp/urls.py``): sem isso, em produção os uploads não ficam
+públicos pelo Django.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+from loja.armazenamento import PREFIXO
+
+TEMPO_CACHE_IMUTAVEL = 60 * 60 * 24 * 365
+TEMPO_CACHE_PADRAO = 60 * 60
+
+_INTERVALO = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _intervalo(cabecalho, tamanho):
+    """
+    Interpreta um cabeçalho Range com um único intervalo. Retorna
+    (inicio, fim) inclusivos, None para ignorar o cabeçalho (a resposta
+    vai inteira) ou False se o intervalo não for satisfazível.
+    """
+    combinacao = _INTERVALO.match(cabecalho.strip())
+    if not combinacao:
+        return None
+    inicio, fim = combinacao.groups()
+    if not inicio and not fim:
+        return None
+    if not inicio:
+        # "bytes=-500": os últimos 500 bytes
+        sufixo = int(fim)
+        if sufixo == 0:
+            return False
+        return max(tamanho - sufixo, 0), tamanho - 1
+    inicio = int(inicio)
+    fim = min(int(fim), tamanho - 1) if fim else tamanho - 1
+    if inicio >= tamanho or inicio > fim:
+        return False
+    return inicio, fim
+
+
+class _Trecho:
+    """
+    Lê apenas ``tamanho`` bytes de um arquivo, a partir da posição atual.
+    """
+
+    def __init__(self, arquivo, tamanho):
+        self.arquivo = arquivo
+        self.restante = tamanho
+
+    def read(self, tamanho=-1):
+        if self.restante <= 0:
+            return b''
+        if tamanho < 0 or tamanho > self.restante:
+            tamanho = self.restante
+        dados = self.arquivo.read(tamanho)
+        self.restante -= len(dados)
+        return dados
+
+    def close(self):
+        self.arquivo.close()
+
+
+def _cabecalhos_de_cache(resposta, caminho, etag, modificado):
+    resposta['ETag'] = etag
+    resposta['Last-Modified'] = http_date(modificado)
+    resposta['Accept-Ranges'] = 'bytes'
+    if caminho.startswith(PREFIXO + '/'):
+        resposta['Cache-Control'] = f'public, max-age={TEMPO_CACHE_IMUTAVEL}, immutable'
+    else:
+        resposta['Cache-Control'] = f'public, max-age={TEMPO_CACHE_PADRAO}'
+    return resposta
+
+
+@require_safe
+def servir_midia(request, caminho):
+    try:
+        caminho_completo = safe_join(settings.MEDIA_ROOT, caminho)
+    except SuspiciousFileOperation:
+        raise Http404
+    try:
+        estado = os.stat(caminho_completo)
+    except OSError:
+        raise Http404
+    if not os.path.isfile(caminho_completo):
+        raise Http404
+
+    modificado = int(estado.st_mtime)
+    etag = f'"{estado.st_mtime_ns:x}-{estado.st_size:x}"'
+    nao_modificado = get_conditional_response(request, etag=etag, last_modified=modificado)
+    if nao_modificado is not None:
+        return _cabecalhos_de_cache(nao_modificado, caminho, etag, modificado)
+
+    tipo, codificacao = mimetypes.guess_type(caminho_completo)
+    tipo = tipo or 'application/octet-stream'
+
+    entrega = getattr(settings, 'MIDIA_ENTREGA', None)
+    if entrega == 'x-accel-redirect':
+        resposta = HttpResponse(content_type=tipo)
+        prefixo = getattr(settings, 'MIDIA_PREFIXO_INTERNO', '/_midia/')
+        resposta['X-Accel-Redirect'] = prefixo + quote(caminho)
+        return _cabecalhos_de_cache(resposta, caminho, etag, modificado)
+    if entrega == 'x-sendfile':
+        resposta = HttpResponse(content_type=tipo)
+        resposta['X-Sendfile'] = caminho_completo
+        return _cabecalhos_de_cache(resposta, caminho, etag, modificado)
+
+    intervalo = None
+    cabecalho_range = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    # Com If-Range, o intervalo só vale se o arquivo não mudou desde então
+    if cabecalho_range and (not if_range or if_range in (etag, http_date(modificado))):
+        intervalo = _intervalo(cabecalho_range, estado.st_size)
+    if intervalo is False:
+        resposta = HttpResponse(status=416)
+        resposta['Content-Range'] = f'bytes */{estado.st_size}'
+        return resposta
+
+    arquivo = open(caminho_completo, 'rb')
+    if intervalo is None:
+        # O servidor WSGI pode usar sendfile() com o arquivo inteiro
+        resposta = FileResponse(arquivo, content_type=tipo)
+    else:
+        inicio, fim = intervalo
+        arquivo.seek(inicio)
+        resposta = FileResponse(_Trecho(arquivo, fim - inicio + 1), content_type=tipo, status=206)
+        resposta['Content-Length'] = fim - inicio + 1
+        resposta['Content-Range'] = f'bytes {inicio}-{fim}/{estado.st_size}'
+    if codificacao:
+        resposta['Content-Encoding'] = codificacao
+    return _cabecalhos_de_cache(resposta, caminho, etag, modificado)
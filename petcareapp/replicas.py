@@ -0,0 +1,131 @@
+"""
+Leituras nas réplicas do banco, escritas no primário.
+
+O ``RoteadorReplicas`` manda as leituras das requisições GET/HEAD para uma
+das réplicas de ``REPLICAS_DE_LEITURA`` (sorteada uma vez por requisição)
+e tudo o mais para o ``default``. Como as réplicas ficam um pouco
+atrasadas, quem acabou de escrever continua lendo do primário:
+
+- dentro da própria requisição, depois da primeira escrita;
+- nas requisições seguintes, por ``JANELA_LEITURA_NO_PRIMARIO`` segundos,
+  pelo cookie gravado pelo ``ReplicasMiddleware``;
+- sempre dentro de ``transaction.atomic()``.
+
+Fora de uma requisição (comandos, threads de segundo plano) tudo vai para
+o primário.
+
+Para testar localmente, ``REPLICAS_SQLITE_LOCAIS`` cria cópias do SQLite
+que o comando ``replicar_banco`` mantém atualizadas, no papel da
+replicação de um banco de verdade.
+"""
+import os
+import random
+import sqlite3
+import tempfile
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+COOKIE_PRIMARIO = 'ler_do_primario'
+METODOS_SEGUROS = ('GET', 'HEAD', 'OPTIONS')
+
+_requisicao = ContextVar('replicas_requisicao', default=None)
+
+
+class _Requisicao:
+    def __init__(self, replica):
+        # None: a requisição lê do primário
+        self.replica = replica
+        self.escreveu = False
+
+
+def fixar_no_primario():
+    """
+    Faz o restante da requisição, e a janela seguinte, ler do primário.
+    O ``db_for_write`` já faz isso; serve para escritas feitas fora da
+    thread da requisição (ver ``petcareapp.fila_escrita``).
+    """
+    requisicao = _requisicao.get()
+    if requisicao is not None:
+        requisicao.escreveu = True
+
+
+def _janela():
+    return getattr(settings, 'JANELA_LEITURA_NO_PRIMARIO', 10)
+
+
+class RoteadorReplicas:
+    def db_for_read(self, model, **hints):
+        requisicao = _requisicao.get()
+        if requisicao is None or requisicao.replica is None or requisicao.escreveu:
+            return DEFAULT_DB_ALIAS
+        # Leituras dentro de uma transação precisam ver o que ela gravou
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return requisicao.replica
+
+    def db_for_write(self, model, **hints):
+        requisicao = _requisicao.get()
+        if requisicao is not None:
+            requisicao.escreveu = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Primário e réplicas têm os mesmos dados
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # As réplicas recebem o esquema pela replicação
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicasMiddleware:
+    """
+    Decide de onde a requisição lê e grava o cookie que mantém o usuário
+    no primário depois de uma escrita.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        replicas = getattr(settings, 'REPLICAS_DE_LEITURA', [])
+        replica = None
+        if replicas and request.method in METODOS_SEGUROS and COOKIE_PRIMARIO not in request.COOKIES:
+            replica = random.choice(replicas)
+        estado = _Requisicao(replica)
+        token = _requisicao.set(estado)
+        try:
+            response = self.get_response(request)
+        finally:
+            _requisicao.reset(token)
+        if replicas and (estado.escreveu or request.method not in METODOS_SEGUROS):
+            response.set_cookie(COOKIE_PRIMARIO, '1', max_age=_janela(), httponly=True, samesite='Lax')
+        return response
+
+
+def replicar(alias):
+    """
+    Copia o SQLite primário para a réplica ``alias`` com a API de backup
+    do SQLite (uma cópia consistente mesmo com escritas em andamento). A
+    cópia é feita num arquivo temporário e trocada de uma vez, então quem
+    abre a réplica nunca vê um arquivo pela metade.
+    """
+    origem = str(settings.DATABASES[DEFAULT_DB_ALIAS]['NAME'])
+    destino = str(settings.DATABASES[alias]['NAME'])
+    descritor, temporario = tempfile.mkstemp(dir=os.path.dirname(destino), suffix='.sqlite3')
+    os.close(descritor)
+    try:
+        primario, copia = sqlite3.connect(origem), sqlite3.connect(temporario)
+        try:
+            primario.backup(copia)
+            # A cópia herdaria o WAL do primário
+            copia.execute('PRAGMA journal_mode = DELETE')
+        finally:
+            copia.close()
+            primario.close()
+        os.replace(temporario, destino)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 
+from .sqlite import PRAGMAS_REPLICA, opcoes
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -39,10 +41,13 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'loja',
     'produto',
+    'agendamento',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'petcareapp.instrumentacao.InstrumentacaoSQLMiddleware',
+    'petcareapp.replicas.ReplicasMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -81,10 +86,81 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # WAL, PRAGMAs e BEGIN IMMEDIATE (ver petcareapp/sqlite.py)
+        'OPTIONS': opcoes(),
+        # Banco de testes em arquivo (e não em memória) para que os testes
+        # de concorrência possam abrir várias conexões
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    }
+}
+
+# Réplicas de leitura (ver petcareapp/replicas.py): as leituras das
+# requisições GET vão para uma delas e as escritas para o 'default'. Para
+# testar localmente, aumente REPLICAS_SQLITE_LOCAIS; as cópias do SQLite
+# são mantidas em dia pelo comando ``replicar_banco``.
+REPLICAS_SQLITE_LOCAIS = 0
+for _numero in range(1, REPLICAS_SQLITE_LOCAIS + 1):
+    DATABASES[f'replica_{_numero}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'db.replica_{_numero}.sqlite3',
+        'OPTIONS': opcoes(PRAGMAS_REPLICA, modo_transacao=None),
+        # Nos testes a réplica é o próprio banco de testes
+        'TEST': {'MIRROR': 'default'},
     }
+REPLICAS_DE_LEITURA = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['petcareapp.replicas.RoteadorReplicas']
+# Segundos em que quem acabou de escrever continua lendo do primário
+JANELA_LEITURA_NO_PRIMARIO = 10
+# Escritas das views numa única thread por processo (ver petcareapp/fila_escrita.py)
+FILA_DE_ESCRITA = True
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# 'memoria' fica em cada processo e serve para desenvolvimento; 'arquivo'
+# é compartilhado pelos processos da mesma máquina; 'redis' é compartilhado
+# entre máquinas. Com mais de um processo em produção use 'arquivo' ou
+# 'redis': as versões de loja/cache.py precisam ser vistas por todos.
+CACHE_TIPO = 'memoria'
+CACHE_REDIS_URL = 'redis://127.0.0.1:6379/1'
+CACHES = {
+    'default': {
+        'memoria': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'arquivo': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': BASE_DIR / 'cache',
+        },
+        'redis': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+        },
+    }[CACHE_TIPO],
 }
 
 
+# Sessões lidas do cache, com o banco como reserva, e o usuário da sessão
+# também em cache (ver petcareapp/identidade.py)
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+AUTHENTICATION_BACKENDS = ['petcareapp.identidade.BackendComCache']
+
+
+# Consultas por requisição no Server-Timing e avisos de N+1 no log (ver
+# petcareapp/instrumentacao.py)
+INSTRUMENTACAO_SQL = DEBUG
+# Repetições da mesma forma de consulta que indicam um N+1
+SQL_LIMITE_REPETICOES = 5
+# Máximo de consultas por view (nome da URL, ex: 'loja:loja_detail');
+# as demais usam SQL_ORCAMENTO_PADRAO (None: sem limite)
+SQL_ORCAMENTO_CONSULTAS = {}
+SQL_ORCAMENTO_PADRAO = None
+# Exceder o orçamento levanta OrcamentoExcedido (para os testes)
+SQL_FALHAR_NO_ORCAMENTO = False
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -128,6 +204,21 @@ STATICFILES_DIRS = [ BASE_DIR /'petcareapp'/'static' ]
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Os uploads são gravados uma única vez pelo hash do conteúdo (ver loja/armazenamento.py)
+STORAGES = {
+    'default': {'BACKEND': 'loja.armazenamento.ArmazenamentoPorConteudo'},
+    # Nomes com hash e versões .gz/.br geradas no collectstatic (ver petcareapp/estaticos.py)
+    'staticfiles': {'BACKEND': 'petcareapp.estaticos.EstaticosComprimidos'},
+}
+# Uploads maiores que isso vão direto para um arquivo temporário em vez da memória
+FILE_UPLOAD_MAX_MEMORY_SIZE = 512 * 1024
+
+# Como as mídias são entregues (ver petcareapp/midia.py): None (o próprio
+# Django, só com DEBUG), 'x-accel-redirect' (nginx) ou 'x-sendfile'
+# (Apache, lighttpd)
+MIDIA_ENTREGA = None
+MIDIA_PREFIXO_INTERNO = '/_midia/'
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -0,0 +1,62 @@
+"""
+Modo de produção do SQLite.
+
+Cada conexão é aberta com os PRAGMAs abaixo (pelo ``init_command`` do
+backend do Django):
+
+- ``journal_mode=WAL``: os leitores não esperam o escritor, e o escritor
+  não espera os leitores;
+- ``synchronous=NORMAL``: com WAL, o banco continua íntegro se o processo
+  cair; numa queda de energia só as últimas transações podem se perder;
+- ``mmap_size`` e ``cache_size``: menos chamadas de sistema e mais páginas
+  na memória para as leituras;
+- ``temp_store=MEMORY``: ordenações e tabelas temporárias fora do disco.
+
+As transações começam com ``BEGIN IMMEDIATE``: quem vai escrever pega o
+lock já no início e espera por ele até ``TEMPO_ESPERA_LOCK`` segundos, em
+vez de falhar com ``database is locked`` ao tentar passar de leitura para
+escrita no meio da transação.
+
+O ``journal_mode`` fica gravado no cabeçalho do arquivo: a primeira
+conexão (qualquer comando de gerenciamento, inclusive os que só leem)
+converte para WAL um banco criado sem ele. Por isso o ``db.sqlite3`` do
+repositório aparece como alterado no git depois do primeiro comando, e
+os arquivos ``-wal``/``-shm`` ao lado dele (ignorados pelo git) guardam
+as transações ainda não copiadas para o banco.
+
+Este módulo não importa nada do Django para poder ser usado no settings.
+"""
+TEMPO_ESPERA_LOCK = 20
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    # Negativo: em KiB (64 MiB por conexão)
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+# As réplicas locais são trocadas inteiras pelo ``replicar_banco``; sem
+# WAL, não sobram arquivos -wal/-shm de uma cópia anterior
+PRAGMAS_REPLICA = {
+    'query_only': 'ON',
+    'mmap_size': PRAGMAS['mmap_size'],
+    'cache_size': PRAGMAS['cache_size'],
+    'temp_store': PRAGMAS['temp_store'],
+}
+
+
+def comandos_iniciais(pragmas):
+    return '; '.join(f'PRAGMA {nome} = {valor}' for nome, valor in pragmas.items())
+
+
+def opcoes(pragmas=PRAGMAS, modo_transacao='IMMEDIATE'):
+    """
+    ``OPTIONS`` de um banco SQLite no modo de produção.
+    """
+    return {
+        'timeout': TEMPO_ESPERA_LOCK,
+        'transaction_mode': modo_transacao,
+        'init_command': comandos_iniciais(pragmas),
+    }
@@ -0,0 +1,441 @@
+import logging
+import os
+import pickle
+import re
+import shutil
+import tempfile
+import threading
+import time
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connection, router, transaction
+from django.http import Http404, HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.functional import empty
+
+from loja.models import Loja
+
+from .fila_escrita import escrever
+from .identidade import BackendComCache, _chave_usuario
+from .instrumentacao import InstrumentacaoSQLMiddleware, OrcamentoExcedido, forma_da_consulta
+from .midia import servir_midia
+from .replicas import COOKIE_PRIMARIO, ReplicasMiddleware, fixar_no_primario
+from .sqlite import PRAGMAS, TEMPO_ESPERA_LOCK
+
+_STATIC = re.compile(r"""{%\s*static\s+['"]([^'"]+)['"]""")
+
+
+class EstaticosTests(TestCase):
+    """
+    As páginas renderizadas como em produção: DEBUG desligado e os nomes
+    com hash lidos do manifesto gerado pelo collectstatic.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.destino = tempfile.mkdtemp()
+        cls.configuracao = override_settings(DEBUG=False, STATIC_ROOT=cls.destino)
+        cls.configuracao.enable()
+        # O CSS da autenticação cita uma imagem que não existe (só um aviso)
+        logging.getLogger('petcareapp.estaticos').disabled = True
+        try:
+            call_command('collectstatic', interactive=False, verbosity=0, stdout=StringIO())
+        finally:
+            logging.getLogger('petcareapp.estaticos').disabled = False
+        # Como num processo novo: o storage lê o manifesto gravado
+        staticfiles_storage._wrapped = empty
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.configuracao.disable()
+        shutil.rmtree(cls.destino, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_paginas_renderizam_com_o_manifesto(self):
+        self.assertEqual(staticfiles_storage.__class__.__name__, 'EstaticosComprimidos')
+        resposta = self.client.get(reverse('login'))
+        self.assertEqual(resposta.status_code, 200)
+        self.assertRegex(resposta.content.decode(), r'/static/css/autenticacao\.[0-9a-f]{12}\.css')
+
+        usuario = User.objects.create_user('estaticos', 'estaticos@petcare.test', 'senha')
+        self.client.force_login(usuario)
+        for nome in ('loja:loja_list', 'produto:produto_list', 'agendamento:listar_agendamento'):
+            with self.subTest(nome):
+                resposta = self.client.get(reverse(nome))
+                self.assertEqual(resposta.status_code, 200)
+                # Páginas que estendem base.html
+                self.assertRegex(resposta.content.decode(), r'/static/css/base\.[0-9a-f]{12}\.css')
+
+    def test_templates_so_citam_estaticos_existentes(self):
+        pasta = settings.TEMPLATES[0]['DIRS'][0]
+        ausentes = []
+        for template in sorted(pasta.rglob('*.html')):
+            for nome in _STATIC.findall(template.read_text(encoding='utf-8')):
+                if finders.find(nome) is None:
+                    ausentes.append(f'{template.relative_to(pasta)}: {nome}')
+        self.assertEqual(ausentes, [])
+
+
+@override_settings(REPLICAS_DE_LEITURA=['replica_1'])
+class ReplicasTests(SimpleTestCase):
+    """
+    Só a decisão do roteador: ``QuerySet.db`` consulta o roteador sem ir
+    ao banco, então a réplica não precisa existir.
+    """
+    # Para o transaction.atomic() do teste das transações
+    databases = {DEFAULT_DB_ALIAS}
+
+    def requisicao(self, metodo='get', cookies=None, view=None):
+        bancos = []
+
+        def responder(request):
+            bancos.append(Loja.objects.all().db)
+            if view is not None:
+                view()
+                bancos.append(Loja.objects.all().db)
+            return HttpResponse()
+
+        request = getattr(RequestFactory(), metodo)('/')
+        request.COOKIES.update(cookies or {})
+        response = ReplicasMiddleware(responder)(request)
+        return bancos, response.cookies.get(COOKIE_PRIMARIO)
+
+    def test_get_le_da_replica(self):
+        bancos, cookie = self.requisicao()
+        self.assertEqual(bancos, ['replica_1'])
+        self.assertIsNone(cookie)
+        # Fora de uma requisição (comandos, threads), sempre o primário
+        self.assertEqual(Loja.objects.all().db, DEFAULT_DB_ALIAS)
+
+    def test_quem_escreveu_le_do_primario(self):
+        # Toda escrita do ORM pede o banco ao db_for_write
+        bancos, cookie = self.requisicao(view=lambda: router.db_for_write(Loja))
+        self.assertEqual(bancos, ['replica_1', DEFAULT_DB_ALIAS])
+        self.assertEqual(cookie['max-age'], 10)
+
+        # Escritas feitas pela thread da fila de escrita
+        bancos, cookie = self.requisicao(view=fixar_no_primario)
+        self.assertEqual(bancos, ['replica_1', DEFAULT_DB_ALIAS])
+        self.assertIsNotNone(cookie)
+
+        # Dentro da janela do cookie, a próxima requisição fica no primário
+        bancos, cookie = self.requisicao(cookies={COOKIE_PRIMARIO: '1'})
+        self.assertEqual(bancos, [DEFAULT_DB_ALIAS])
+
+    def test_post_e_transacoes_usam_o_primario(self):
+        bancos, cookie = self.requisicao(metodo='post')
+        self.assertEqual(bancos, [DEFAULT_DB_ALIAS])
+        self.assertIsNotNone(cookie)
+
+        # Leituras dentro de uma transação veem o que ela gravou
+        dentro = []
+
+        def em_transacao():
+            with transaction.atomic():
+                dentro.append(Loja.objects.all().db)
+        bancos, _ = self.requisicao(view=em_transacao)
+        self.assertEqual(dentro, [DEFAULT_DB_ALIAS])
+        self.assertEqual(bancos, ['replica_1', 'replica_1'])
+
+    @override_settings(REPLICAS_DE_LEITURA=[])
+    def test_sem_replicas_tudo_no_primario(self):
+        bancos, cookie = self.requisicao(view=lambda: None)
+        self.assertEqual(bancos, [DEFAULT_DB_ALIAS, DEFAULT_DB_ALIAS])
+        self.assertIsNone(cookie)
+
+
+@override_settings(INSTRUMENTACAO_SQL=True, SQL_LIMITE_REPETICOES=5, SQL_ORCAMENTO_CONSULTAS={}, SQL_ORCAMENTO_PADRAO=None)
+class InstrumentacaoSQLTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lojas = [
+            Loja.objects.create(nome=f'Loja {numero}', endereco='Rua A', telefone='1', email=f'{numero}@sql.petcare')
+            for numero in range(6)
+        ]
+
+    def requisicao(self, consultas):
+        def view(request):
+            for loja in self.lojas[:consultas]:
+                Loja.objects.filter(pk=loja.pk).exists()
+            return HttpResponse()
+        return InstrumentacaoSQLMiddleware(view)(RequestFactory().get('/teste/'))
+
+    def test_forma_da_consulta(self):
+        self.assertEqual(
+            forma_da_consulta("SELECT 1 FROM t WHERE id = 42 AND nome = 'O''Hara' AND x IN (%s, %s, %s)"),
+            forma_da_consulta("SELECT 1 FROM t WHERE id = 7 AND nome = 'Ana' AND x IN (%s, %s)"),
+        )
+
+    def test_consulta_repetida_vai_para_o_log(self):
+        with self.assertLogs('petcareapp.instrumentacao', 'WARNING') as logs:
+            response = self.requisicao(6)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('Possível N+1 em /teste/: 6 consultas', logs.output[0])
+        # O trecho do projeto que disparou as consultas
+        self.assertIn('petcareapp/tests.py', logs.output[0])
+        self.assertIn('Loja.objects.filter(pk=loja.pk).exists()', logs.output[0])
+        self.assertIn('sql;desc="6 consultas"', response.headers['Server-Timing'])
+
+        with self.assertNoLogs('petcareapp.instrumentacao', 'WARNING'):
+            self.requisicao(4)
+
+    @override_settings(SQL_ORCAMENTO_CONSULTAS={'/teste/': 3})
+    def test_orcamento(self):
+        with self.assertNoLogs('petcareapp.instrumentacao', 'WARNING'):
+            self.requisicao(3)
+        with self.assertLogs('petcareapp.instrumentacao', 'WARNING') as logs:
+            self.requisicao(4)
+        self.assertEqual(logs.output, ['WARNING:petcareapp.instrumentacao:/teste/ fez 4 consultas (orçamento: 3)'])
+
+        with override_settings(SQL_FALHAR_NO_ORCAMENTO=True):
+            with self.assertRaisesMessage(OrcamentoExcedido, '/teste/ fez 4 consultas (orçamento: 3)'):
+                self.requisicao(4)
+
+    @override_settings(SQL_ORCAMENTO_CONSULTAS={'loja:loja_list': 1}, SQL_FALHAR_NO_ORCAMENTO=True)
+    def test_orcamento_pelo_nome_da_url(self):
+        self.client.force_login(User.objects.create_user('sql'))
+        with self.assertRaisesMessage(OrcamentoExcedido, 'loja:loja_list fez'):
+            self.client.get(reverse('loja:loja_list'))
+
+
+class EscritaSQLiteTests(TransactionTestCase):
+    """
+    Cada thread usa a sua conexão, como as requisições concorrentes.
+    """
+
+    def em_outra_thread(self, funcao):
+        resultado = []
+
+        def executar():
+            try:
+                resultado.append(funcao())
+            finally:
+                connection.close()
+        thread = threading.Thread(target=executar)
+        thread.start()
+        thread.join()
+        return resultado[0]
+
+    def test_pragmas_das_conexoes_novas(self):
+        def ler_pragmas():
+            with connection.cursor() as cursor:
+                valores = {}
+                for nome in ('journal_mode', 'synchronous', 'busy_timeout', 'temp_store', 'cache_size'):
+                    cursor.execute(f'PRAGMA {nome}')
+                    valores[nome] = cursor.fetchone()[0]
+                return valores
+
+        self.assertEqual(self.em_outra_thread(ler_pragmas), {
+            'journal_mode': 'wal',
+            'synchronous': 1,  # NORMAL
+            'busy_timeout': TEMPO_ESPERA_LOCK * 1000,
+            'temp_store': 2,  # MEMORY
+            'cache_size': PRAGMAS['cache_size'],
+        })
+
+    def test_transacoes_comecam_com_begin_immediate(self):
+        def abrir_transacao():
+            with CaptureQueriesContext(connection) as consultas:
+                with transaction.atomic():
+                    Loja.objects.exists()
+            return consultas[0]['sql']
+
+        self.assertEqual(self.em_outra_thread(abrir_transacao), 'BEGIN IMMEDIATE')
+
+    @override_settings(FILA_DE_ESCRITA=True)
+    def test_escritas_concorrentes_rodam_uma_de_cada_vez(self):
+        trava = threading.Lock()
+        estado = {'agora': 0, 'maximo': 0}
+        threads_escritoras = set()
+
+        def gravar(numero):
+            with trava:
+                estado['agora'] += 1
+                estado['maximo'] = max(estado['maximo'], estado['agora'])
+            threads_escritoras.add(threading.current_thread().name)
+            time.sleep(0.005)
+            Loja.objects.create(nome=f'Fila {numero}', endereco='Rua A', telefone='1', email=f'{numero}@fila.petcare')
+            with trava:
+                estado['agora'] -= 1
+            return numero
+
+        largada = threading.Barrier(8)
+        resultados = []
+
+        def requisicao(numero):
+            try:
+                largada.wait()
+                resultados.append(escrever(gravar, numero))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=requisicao, args=(numero,)) for numero in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(resultados), list(range(8)))
+        self.assertEqual(estado['maximo'], 1)
+        self.assertEqual(len(threads_escritoras), 1)
+        self.assertTrue(threads_escritoras.pop().startswith('escritor'))
+        self.assertEqual(Loja.objects.filter(nome__startswith='Fila ').count(), 8)
+
+    @override_settings(FILA_DE_ESCRITA=True)
+    def test_excecao_da_escrita_chega_a_quem_chamou(self):
+        def falhar():
+            raise ValueError(threading.current_thread().name)
+
+        with self.assertRaises(ValueError) as erro:
+            escrever(falhar)
+        self.assertTrue(str(erro.exception).startswith('escritor'))
+
+        # Dentro de uma transação, roda na própria thread
+        with transaction.atomic():
+            self.assertEqual(escrever(lambda: threading.current_thread().name), threading.current_thread().name)
+
+
+class IdentidadeTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.usuario = User.objects.create_user('identidade', 'identidade@petcare.test', 'senha-secreta')
+        self.client.force_login(self.usuario)
+        self.url = reverse('agendamento:listar_agendamento')
+
+    def consultas_de_usuario(self):
+        with CaptureQueriesContext(connection) as consultas:
+            resposta = self.client.get(self.url)
+        return resposta, [consulta['sql'] for consulta in consultas if 'FROM "auth_user"' in consulta['sql']]
+
+    def test_requisicoes_seguintes_nao_consultam_o_usuario(self):
+        resposta, consultas = self.consultas_de_usuario()
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(len(consultas), 1)
+        resposta, consultas = self.consultas_de_usuario()
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(consultas, [])
+        self.assertEqual(resposta.wsgi_request.user.pk, self.usuario.pk)
+
+    def test_senha_fica_fora_do_cache(self):
+        self.client.get(self.url)
+        guardado = pickle.dumps(cache.get(_chave_usuario(self.usuario.pk)))
+        self.assertNotIn(self.usuario.password.encode(), guardado)
+
+        # Salvar o usuário vindo do cache não apaga a senha
+        usuario = BackendComCache().get_user(self.usuario.pk)
+        usuario.first_name = 'Ana'
+        usuario.save()
+        self.usuario.refresh_from_db()
+        self.assertEqual(self.usuario.first_name, 'Ana')
+        self.assertTrue(self.usuario.check_password('senha-secreta'))
+
+    def test_save_e_exclusao_descartam_a_copia(self):
+        self.client.get(self.url)
+        self.usuario.first_name = 'Novo'
+        self.usuario.save()
+        self.assertIsNone(cache.get(_chave_usuario(self.usuario.pk)))
+        resposta, consultas = self.consultas_de_usuario()
+        self.assertEqual(len(consultas), 1)
+        self.assertEqual(resposta.wsgi_request.user.first_name, 'Novo')
+
+        # Trocar a senha derruba as sessões abertas
+        self.usuario.set_password('outra')
+        self.usuario.save()
+        self.assertRedirects(self.client.get(self.url), f"{reverse('login')}?next={self.url}", fetch_redirect_response=False)
+
+        self.client.force_login(self.usuario)
+        self.client.get(self.url)
+        self.usuario.delete()
+        self.assertIsNone(cache.get(_chave_usuario(self.usuario.pk)))
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+
+class MidiaTests(SimpleTestCase):
+
+    CONTEUDO = b'0123456789'
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.pasta, ignore_errors=True)
+        configuracao = override_settings(MEDIA_ROOT=self.pasta, MIDIA_ENTREGA=None)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        for caminho in ('fotos/a b.txt', 'cas/ab/cd/abcd.txt'):
+            os.makedirs(os.path.dirname(os.path.join(self.pasta, caminho)), exist_ok=True)
+            with open(os.path.join(self.pasta, caminho), 'wb') as arquivo:
+                arquivo.write(self.CONTEUDO)
+
+    def pedir(self, caminho='fotos/a b.txt', metodo='get', **cabecalhos):
+        resposta = servir_midia(getattr(RequestFactory(), metodo)('/media/', headers=cabecalhos), caminho)
+        self.addCleanup(resposta.close)
+        return resposta
+
+    @staticmethod
+    def corpo(resposta):
+        return b''.join(resposta.streaming_content) if resposta.streaming else resposta.content
+
+    def test_arquivo_inteiro_e_get_condicional(self):
+        resposta = self.pedir()
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(self.corpo(resposta), self.CONTEUDO)
+        self.assertEqual(resposta['Accept-Ranges'], 'bytes')
+        self.assertEqual(resposta['Cache-Control'], 'public, max-age=3600')
+        self.assertIn('immutable', self.pedir('cas/ab/cd/abcd.txt')['Cache-Control'])
+
+        nao_modificado = self.pedir(If_None_Match=resposta['ETag'])
+        self.assertEqual(nao_modificado.status_code, 304)
+        self.assertEqual(nao_modificado['ETag'], resposta['ETag'])
+        self.assertEqual(self.pedir(If_None_Match='"outro"').status_code, 200)
+
+    def test_intervalos(self):
+        for cabecalho, esperado, content_range in (
+            ('bytes=2-5', b'2345', 'bytes 2-5/10'),
+            ('bytes=7-', b'789', 'bytes 7-9/10'),
+            ('bytes=-3', b'789', 'bytes 7-9/10'),
+            ('bytes=-50', self.CONTEUDO, 'bytes 0-9/10'),
+            ('bytes=8-100', b'89', 'bytes 8-9/10'),
+        ):
+            with self.subTest(cabecalho):
+                resposta = self.pedir(Range=cabecalho)
+                self.assertEqual(resposta.status_code, 206)
+                self.assertEqual(self.corpo(resposta), esperado)
+                self.assertEqual(resposta['Content-Range'], content_range)
+                self.assertEqual(int(resposta['Content-Length']), len(esperado))
+
+        for cabecalho in ('bytes=10-', 'bytes=5-2', 'bytes=-0'):
+            with self.subTest(cabecalho):
+                resposta = self.pedir(Range=cabecalho)
+                self.assertEqual(resposta.status_code, 416)
+                self.assertEqual(resposta['Content-Range'], 'bytes */10')
+
+        # Intervalos múltiplos ou um If-Range desatualizado: o arquivo inteiro
+        self.assertEqual(self.pedir(Range='bytes=0-1,4-5').status_code, 200)
+        self.assertEqual(self.pedir(Range='bytes=2-5', If_Range='"antigo"').status_code, 200)
+        etag = self.pedir()['ETag']
+        self.assertEqual(self.pedir(Range='bytes=2-5', If_Range=etag).status_code, 206)
+
+    def test_caminhos_fora_da_pasta_de_midia(self):
+        for caminho in ('../settings.py', 'fotos/../../settings.py', '/etc/passwd', 'fotos', 'nao/existe.txt'):
+            with self.subTest(caminho), self.assertRaises(Http404):
+                self.pedir(caminho)
+        self.assertEqual(self.pedir(metodo='post').status_code, 405)
+
+    @override_settings(MIDIA_ENTREGA='x-accel-redirect')
+    def test_entrega_pelo_nginx(self):
+        resposta = self.pedir()
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta['X-Accel-Redirect'], '/_midia/fotos/a%20b.txt')
+        self.assertEqual(resposta['Content-Type'], 'text/plain')
+        self.assertEqual(resposta.content, b'')
+        self.assertEqual(self.pedir(If_None_Match=resposta['ETag']).status_code, 304)
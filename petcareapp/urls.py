@@ -14,21 +14,28 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
 from petcareapp.views import *
+from petcareapp.midia import servir_midia
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', Login.as_view(), name='login'),
     path('loja/', include('loja.urls'), name='loja'),
     path('produto/', include('produto.urls')),
+    path('agendamento/', include('agendamento.urls')),
     path('cadastro/', Cadastro.as_view(), name='cadastro'),
-    path('logout/', Logout.as_view(), name = 'logout')
+    path('logout/', Logout.as_view(), name = 'logout'),
 ]
 
-if settings.DEBUG:
-    # Adiciona a rota para servir arquivos de mídia em modo de desenvolvimento
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+if settings.DEBUG or settings.MIDIA_ENTREGA:
+    # Mídia (uploads), com ETag e Range. Fora do DEBUG só com a entrega
+    # pelo servidor web configurada (MIDIA_ENTREGA): sem ela, os uploads
+    # ficam a cargo da configuração do próprio servidor web
+    urlpatterns += [
+        re_path(r'^%s(?P<caminho>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), servir_midia, name='midia'),
+    ]
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Categoria, Produto
+from .models import Categoria, Produto, ProdutoCanonico
 
 
 @admin.register(Categoria)
@@ -17,7 +17,16 @@ class ProdutoAdmin(admin.ModelAdmin):
     Configuração da interface de administração para o modelo Produto.
     """
     list_display = ('nome', 'loja', 'categoria', 'preco', 'estoque', 'disponivel', 'animal_destino')
-    search_fields = ('nome', 'descricao', 'loja__nome')
+    search_fields = ('nome', 'sku', 'descricao', 'loja__nome')
     list_filter = ('disponivel', 'categoria', 'loja', 'animal_destino', 'porte_animal', 'idade_animal')
     list_editable = ('preco', 'estoque', 'disponivel')
     autocomplete_fields = ('loja', 'categoria')
+
+
+@admin.register(ProdutoCanonico)
+class ProdutoCanonicoAdmin(admin.ModelAdmin):
+    """
+    Configuração da interface de administração para o modelo ProdutoCanonico.
+    """
+    list_display = ('nome', 'chave')
+    search_fields = ('nome', 'chave')
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class ProdutoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'produto'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .busca import INDICE_PRODUTOS
+        INDICE_PRODUTOS.conectar(self)
@@ -0,0 +1,5 @@
+from loja.busca import IndiceBusca
+
+from .models import Produto
+
+INDICE_PRODUTOS = IndiceBusca(Produto, ['nome'])
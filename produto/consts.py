@@ -20,4 +20,7 @@ IDADE_CHOICES = [
     ('ADULTO', 'Adulto'),
     ('IDOSO', 'Idoso'),
     ('TODOS', 'Todos'),
-]
\ No newline at end of file
+]
+
+# Duração máxima (em minutos) de um serviço agendável
+DURACAO_MAXIMA_SERVICO = 8 * 60
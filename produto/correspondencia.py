@@ -0,0 +1,141 @@
+"""
+Agrupamento dos anúncios das lojas em produtos canônicos.
+
+Cada produto é comparado apenas com os canônicos do mesmo "bloco":
+canônicos que têm uma palavra em comum e exatamente as mesmas medidas
+(ex: "15kg"). Dentro do bloco, vence o canônico com maior similaridade
+de trigramas, desde que acima do limiar; se nenhum servir, um novo
+canônico é criado. Assim o custo fica proporcional ao tamanho dos
+blocos, e não ao quadrado do catálogo.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+
+from .models import Produto, ProdutoCanonico, ResumoOferta, grupo_de_oferta
+from .normalizacao import medidas, similaridade, trigramas
+
+LIMIAR_SIMILARIDADE = 0.7
+# Blocos maiores que isso (palavras muito comuns, como "racao") só são
+# usados quando o produto não tem nenhuma palavra mais específica
+TAMANHO_MAXIMO_BLOCO = 500
+
+
+class _Candidato:
+    __slots__ = ('canonico', 'trigramas')
+
+    def __init__(self, canonico):
+        self.canonico = canonico
+        self.trigramas = trigramas(canonico.chave)
+
+
+def _chaves_de_bloco(chave):
+    sufixo = ' '.join(medidas(chave))
+    palavras = [p for p in chave.split() if len(p) >= 3 and p not in sufixo.split()]
+    return [f'{palavra}|{sufixo}' for palavra in palavras] or [f'|{sufixo}']
+
+
+class AgrupadorProdutos:
+    """
+    Associa produtos a canônicos, mantendo em memória um índice dos
+    canônicos por chave exata e por bloco.
+    """
+
+    def __init__(self, limiar=LIMIAR_SIMILARIDADE, tamanho_maximo_bloco=TAMANHO_MAXIMO_BLOCO):
+        self.limiar = limiar
+        self.tamanho_maximo_bloco = tamanho_maximo_bloco
+        self.por_chave = {}
+        self.blocos = defaultdict(list)
+        # Grupos de ofertas (ver ``ResumoOferta``) que perderam ou ganharam produtos
+        self.grupos_alterados = set()
+
+    def carregar(self):
+        for canonico in ProdutoCanonico.objects.only('id', 'nome', 'chave').iterator(chunk_size=2000):
+            self._indexar(canonico)
+
+    def _indexar(self, canonico):
+        candidato = _Candidato(canonico)
+        self.por_chave[canonico.chave] = candidato
+        for bloco in _chaves_de_bloco(canonico.chave):
+            self.blocos[bloco].append(candidato)
+
+    def _candidatos(self, chave):
+        blocos = [self.blocos[b] for b in _chaves_de_bloco(chave) if b in self.blocos]
+        if not blocos:
+            return []
+        pequenos = [b for b in blocos if len(b) <= self.tamanho_maximo_bloco]
+        if not pequenos:
+            pequenos = [min(blocos, key=len)]
+        vistos = {}
+        for bloco in pequenos:
+            for candidato in bloco:
+                vistos[id(candidato)] = candidato
+        return vistos.values()
+
+    def encontrar(self, chave):
+        """
+        Retorna o canônico equivalente à chave, ou None.
+        """
+        exato = self.por_chave.get(chave)
+        if exato is not None:
+            return exato.canonico
+        alvo = trigramas(chave)
+        melhor, melhor_nota = None, self.limiar
+        for candidato in self._candidatos(chave):
+            nota = similaridade(alvo, candidato.trigramas)
+            if nota >= melhor_nota:
+                melhor, melhor_nota = candidato.canonico, nota
+        return melhor
+
+    def agrupar(self, produtos, batch_size=1000):
+        """
+        Associa cada produto do queryset a um canônico, criando os que
+        faltarem. Retorna (produtos processados, canônicos criados).
+        """
+        processados = criados = 0
+        # Os ids são lidos antes para não alterar a tabela enquanto ela é percorrida
+        ids = list(produtos.order_by('id').values_list('id', flat=True))
+        for inicio in range(0, len(ids), batch_size):
+            lote = list(
+                Produto.objects.filter(id__in=ids[inicio:inicio + batch_size])
+                .only('id', 'nome', 'chave', 'canonico_id').order_by('id')
+            )
+            novos = []
+            for produto in lote:
+                self.grupos_alterados.add(produto.grupo_oferta)
+                canonico = self.encontrar(produto.chave)
+                if canonico is None:
+                    canonico = ProdutoCanonico(nome=produto.nome, chave=produto.chave)
+                    self._indexar(canonico)
+                    novos.append(canonico)
+                produto.canonico = canonico
+            with transaction.atomic():
+                ProdutoCanonico.objects.bulk_create(novos)
+                Produto.objects.bulk_update(lote, ['canonico'])
+            self.grupos_alterados.update(produto.grupo_oferta for produto in lote)
+            processados += len(lote)
+            criados += len(novos)
+        return processados, criados
+
+
+def agrupar_produtos(recriar=False, limiar=LIMIAR_SIMILARIDADE):
+    """
+    Agrupa os produtos ainda sem canônico e atualiza os resumos de ofertas
+    dos grupos alterados. Com ``recriar``, descarta os canônicos existentes
+    e reagrupa todo o catálogo.
+    """
+    agrupador = AgrupadorProdutos(limiar=limiar)
+    if recriar:
+        with transaction.atomic():
+            Produto.objects.update(canonico=None)
+            ProdutoCanonico.objects.all().delete()
+        produtos = Produto.objects.all()
+    else:
+        agrupador.carregar()
+        produtos = Produto.objects.filter(canonico__isnull=True)
+    resultado = agrupador.agrupar(produtos)
+    if recriar:
+        ResumoOferta.reconstruir()
+    else:
+        ResumoOferta.atualizar_grupos(agrupador.grupos_alterados)
+    return resultado
@@ -1,4 +1,7 @@
 from django import forms
+
+from loja.models import Loja
+
 from .models import Categoria, Produto
 
 
@@ -17,4 +20,15 @@ class ProdutoForm(forms.ModelForm):
     """
     class Meta:
         model = Produto
-        fields = ['loja', 'categoria', 'nome', 'descricao', 'preco', 'estoque', 'disponivel', 'animal_destino', 'porte_animal', 'idade_animal', 'foto']
\ No newline at end of file
+        fields = ['loja', 'categoria', 'nome', 'sku', 'descricao', 'preco', 'estoque', 'disponivel', 'duracao_minutos', 'animal_destino', 'porte_animal', 'idade_animal', 'foto']
+
+class ImportacaoCatalogoForm(forms.Form):
+    """
+    Envio de um arquivo CSV ou JSON com o catálogo de uma loja.
+    """
+    loja = forms.ModelChoiceField(queryset=Loja.objects.order_by('nome'), required=False)
+    arquivo = forms.FileField(help_text="CSV (vírgula ou ponto e vírgula), lista JSON ou JSON Lines, em UTF-8.")
+    simular = forms.BooleanField(
+        required=False, label="Apenas simular", help_text="Valida o arquivo sem gravar nada."
+    )
+    criar_categorias = forms.BooleanField(required=False, label="Criar categorias que não existem")
@@ -0,0 +1,348 @@
+"""
+Importação em lote do catálogo de uma loja (CSV ou JSON).
+
+O arquivo é lido como fluxo, linha a linha (CSV) ou objeto a objeto
+(JSON: uma lista de objetos ou um objeto por linha), sem carregá-lo na
+memória. Cada linha é validada contra as escolhas de ``produto/consts.py``
+e as categorias em cache, e os produtos válidos são gravados em lotes
+com um único INSERT ... ON CONFLICT por lote, pela chave (loja, SKU):
+produtos novos são criados e os já importados são atualizados.
+
+Como o ``bulk_create`` não chama o ``save()`` nem os sinais, a chave e o
+canônico do produto são preenchidos aqui, e os resumos de ofertas e os
+fragmentos da página da loja são acertados ao final (``concluir()``).
+
+Colunas: ``sku`` e ``nome`` (obrigatórias), ``preco`` (obrigatória),
+``categoria`` (nome), ``descricao``, ``estoque``, ``disponivel``,
+``duracao_minutos``, ``animal_destino``, ``porte_animal`` e
+``idade_animal`` (código ou nome da escolha, ex: ``GATO`` ou ``Gato``).
+"""
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from loja.cache import categorias, invalidar_loja
+from petcareapp.fila_escrita import escrever
+
+from .consts import ANIMAL_CHOICES, DURACAO_MAXIMA_SERVICO, IDADE_CHOICES, PORTE_CHOICES
+from .models import Categoria, Produto, ProdutoCanonico, ResumoOferta, grupo_de_oferta
+from .normalizacao import normalizar_nome, remover_acentos
+
+FORMATOS = ('csv', 'json')
+TAMANHO_LOTE = 1000
+# Só os primeiros erros são guardados com a mensagem; os demais só contam
+MAXIMO_ERROS_LISTADOS = 100
+TAMANHO_BLOCO_LEITURA = 64 * 1024
+
+CAMPOS_ATUALIZADOS = [
+    'categoria', 'nome', 'chave', 'canonico', 'descricao', 'preco', 'estoque', 'disponivel',
+    'duracao_minutos', 'animal_destino', 'porte_animal', 'idade_animal',
+]
+_VERDADEIROS = {'1', 'true', 'sim', 's', 'yes', 'y', 'verdadeiro'}
+_FALSOS = {'0', 'false', 'nao', 'n', 'no', 'falso'}
+
+
+class ErroImportacao(Exception):
+    """
+    O arquivo não pôde ser lido (formato inválido ou corrompido).
+    """
+
+
+def _texto(arquivo):
+    """
+    Fluxo de texto sobre o arquivo binário (ou o ``UploadedFile``).
+    """
+    binario = getattr(arquivo, 'file', arquivo)
+    if isinstance(binario, io.TextIOBase):
+        return binario
+    return io.TextIOWrapper(binario, encoding='utf-8-sig', newline='')
+
+
+def linhas_csv(arquivo):
+    """
+    Gera (número da linha, dicionário) do CSV. O separador (vírgula ou
+    ponto e vírgula) é detectado pelo cabeçalho.
+    """
+    texto = _texto(arquivo)
+    try:
+        cabecalho = texto.readline()
+        if not cabecalho.strip():
+            return
+        separador = ';' if cabecalho.count(';') > cabecalho.count(',') else ','
+        colunas = [coluna.strip().lower() for coluna in next(csv.reader([cabecalho], delimiter=separador))]
+    except UnicodeDecodeError as erro:
+        raise ErroImportacao(f"O arquivo não está em UTF-8 (salve o CSV como UTF-8): {erro}") from erro
+    except csv.Error as erro:
+        raise ErroImportacao(f"Cabeçalho do CSV inválido: {erro}") from erro
+    leitor = csv.DictReader(texto, fieldnames=colunas, delimiter=separador)
+    try:
+        for linha in leitor:
+            # line_num conta a partir da primeira linha depois do cabeçalho
+            yield leitor.line_num + 1, linha
+    except (csv.Error, UnicodeDecodeError) as erro:
+        raise ErroImportacao(f"CSV inválido perto da linha {leitor.line_num + 1}: {erro}") from erro
+
+
+def linhas_json(arquivo):
+    """
+    Gera (número do item, dicionário) de uma lista JSON de objetos ou de
+    um objeto por linha (JSON Lines), decodificando um objeto por vez.
+    """
+    texto = _texto(arquivo)
+    decodificador = json.JSONDecoder()
+    buffer, posicao, numero = '', 0, 0
+    em_lista = None
+    fim_do_arquivo = False
+    while True:
+        # Pula espaços e separadores até o próximo objeto
+        while posicao < len(buffer) and (buffer[posicao].isspace() or (em_lista and buffer[posicao] == ',')):
+            posicao += 1
+        if posicao < len(buffer):
+            if em_lista is None:
+                em_lista = buffer[posicao] == '['
+                if em_lista:
+                    posicao += 1
+                continue
+            if em_lista and buffer[posicao] == ']':
+                return
+            try:
+                item, fim = decodificador.raw_decode(buffer, posicao)
+            except json.JSONDecodeError as erro:
+                if fim_do_arquivo:
+                    raise ErroImportacao(f"JSON inválido no item {numero + 1}: {erro.msg}") from erro
+            else:
+                numero += 1
+                if not isinstance(item, dict):
+                    raise ErroImportacao(f"O item {numero} não é um objeto JSON.")
+                yield numero, item
+                posicao = fim
+                continue
+        elif fim_do_arquivo:
+            if em_lista:
+                raise ErroImportacao("JSON inválido: a lista não foi fechada.")
+            return
+        # Descarta o que já foi lido e traz o próximo bloco
+        try:
+            bloco = texto.read(TAMANHO_BLOCO_LEITURA)
+        except UnicodeDecodeError as erro:
+            raise ErroImportacao(f"O arquivo não está em UTF-8: {erro}") from erro
+        buffer, posicao = buffer[posicao:] + bloco, 0
+        fim_do_arquivo = not bloco
+
+
+def ler_feed(arquivo, formato):
+    if formato not in FORMATOS:
+        raise ErroImportacao(f"Formato desconhecido: {formato} (use {' ou '.join(FORMATOS)}).")
+    return linhas_csv(arquivo) if formato == 'csv' else linhas_json(arquivo)
+
+
+def formato_do_arquivo(nome):
+    extensao = nome.rsplit('.', 1)[-1].lower() if '.' in nome else ''
+    return 'json' if extensao in ('json', 'jsonl', 'ndjson') else 'csv'
+
+
+def _chave_escolha(texto):
+    return remover_acentos(str(texto)).strip().upper()
+
+
+def _mapa_escolhas(escolhas):
+    """
+    Código e nome de cada escolha (sem acento e em maiúsculas) -> código.
+    """
+    mapa = {}
+    for codigo, nome in escolhas:
+        mapa[_chave_escolha(codigo)] = codigo
+        mapa[_chave_escolha(nome)] = codigo
+    return mapa
+
+
+ESCOLHAS = {
+    'animal_destino': _mapa_escolhas(ANIMAL_CHOICES),
+    'porte_animal': _mapa_escolhas(PORTE_CHOICES),
+    'idade_animal': _mapa_escolhas(IDADE_CHOICES),
+}
+
+
+def _valor(linha, campo):
+    valor = linha.get(campo)
+    if valor is None:
+        return ''
+    return valor.strip() if isinstance(valor, str) else valor
+
+
+class ImportadorCatalogo:
+    """
+    Valida e grava as linhas de um feed no catálogo de ``loja``. Com
+    ``simular``, só valida e conta o que seria criado ou atualizado.
+
+    Uso: ``importador.importar(ler_feed(arquivo, 'csv'))``. Os totais
+    ficam em ``processadas``, ``criados``, ``atualizados``, ``total_erros``
+    e ``erros`` (as primeiras mensagens, com o número da linha).
+    """
+
+    def __init__(self, loja, simular=False, criar_categorias=False, tamanho_lote=TAMANHO_LOTE, progresso=None):
+        self.loja = loja
+        self.simular = simular
+        self.criar_categorias = criar_categorias
+        self.tamanho_lote = tamanho_lote
+        # Chamada a cada lote com o próprio importador
+        self.progresso = progresso
+        self.processadas = self.criados = self.atualizados = self.total_erros = 0
+        self.erros = []
+        self.categorias_novas = set()
+        self._grupos_alterados = set()
+        self._categorias = {categoria.nome.lower(): categoria.pk for categoria in categorias()}
+
+    def importar(self, linhas):
+        lote = {}
+        for numero, linha in linhas:
+            self.processadas += 1
+            try:
+                produto = self.validar(linha)
+            except ValueError as erro:
+                self._registrar_erro(numero, erro)
+                continue
+            # SKU repetido no mesmo lote: vale a última linha
+            lote[produto.sku] = produto
+            if len(lote) >= self.tamanho_lote:
+                self._gravar(list(lote.values()))
+                lote = {}
+        if lote:
+            self._gravar(list(lote.values()))
+        self.concluir()
+        return self
+
+    def _registrar_erro(self, numero, erro):
+        self.total_erros += 1
+        if len(self.erros) < MAXIMO_ERROS_LISTADOS:
+            self.erros.append((numero, str(erro)))
+
+    def validar(self, linha):
+        """
+        Retorna o ``Produto`` (não salvo) da linha ou levanta ``ValueError``
+        com os problemas encontrados.
+        """
+        problemas = []
+        sku = str(_valor(linha, 'sku'))
+        nome = str(_valor(linha, 'nome'))
+        if not sku:
+            problemas.append("SKU vazio")
+        elif len(sku) > Produto._meta.get_field('sku').max_length:
+            problemas.append("SKU longo demais")
+        if not nome:
+            problemas.append("nome vazio")
+        elif len(nome) > Produto._meta.get_field('nome').max_length:
+            problemas.append("nome longo demais")
+
+        preco = None
+        try:
+            preco = Decimal(str(_valor(linha, 'preco')).replace(',', '.')).quantize(Decimal('0.01'))
+            if preco <= 0 or preco >= Decimal('1e8'):
+                raise InvalidOperation
+        except (InvalidOperation, ValueError):
+            problemas.append(f"preço inválido ({_valor(linha, 'preco')!r})")
+
+        estoque = self._inteiro(linha, 'estoque', 0, 0, None, problemas)
+        duracao = self._inteiro(linha, 'duracao_minutos', 30, 5, DURACAO_MAXIMA_SERVICO, problemas)
+
+        disponivel = True
+        texto = remover_acentos(str(_valor(linha, 'disponivel'))).lower()
+        if texto in _FALSOS:
+            disponivel = False
+        elif texto and texto not in _VERDADEIROS:
+            problemas.append(f"disponivel inválido ({texto!r})")
+
+        escolhas = {}
+        for campo, mapa in ESCOLHAS.items():
+            texto = _valor(linha, campo)
+            escolhas[campo] = mapa.get(_chave_escolha(texto)) if texto else 'TODOS'
+            if escolhas[campo] is None:
+                problemas.append(f"{campo} inválido ({texto!r})")
+
+        categoria_id = self._categoria(str(_valor(linha, 'categoria')), problemas)
+
+        if problemas:
+            raise ValueError('; '.join(problemas))
+        return Produto(
+            loja_id=self.loja.pk, sku=sku, nome=nome, chave=normalizar_nome(nome),
+            descricao=_valor(linha, 'descricao') or None, preco=preco, estoque=estoque,
+            disponivel=disponivel, duracao_minutos=duracao, categoria_id=categoria_id, **escolhas,
+        )
+
+    @staticmethod
+    def _inteiro(linha, campo, padrao, minimo, maximo, problemas):
+        texto = str(_valor(linha, campo))
+        if not texto:
+            return padrao
+        try:
+            valor = int(texto)
+        except ValueError:
+            valor = None
+        if valor is None or valor < minimo or (maximo is not None and valor > maximo):
+            problemas.append(f"{campo} inválido ({texto!r})")
+        return valor
+
+    def _categoria(self, nome, problemas):
+        if not nome:
+            return None
+        categoria_id = self._categorias.get(nome.lower())
+        if categoria_id is not None:
+            return categoria_id
+        if not self.criar_categorias:
+            problemas.append(f"categoria desconhecida ({nome!r})")
+            return None
+        self.categorias_novas.add(nome)
+        if self.simular:
+            return None
+        categoria, _ = escrever(Categoria.objects.get_or_create, nome=nome)
+        self._categorias[nome.lower()] = categoria.pk
+        return categoria.pk
+
+    def _gravar(self, lote):
+        anteriores = {
+            sku: (nome, chave, canonico_id)
+            for sku, nome, chave, canonico_id in Produto.objects.filter(
+                loja=self.loja, sku__in=[produto.sku for produto in lote]
+            ).values_list('sku', 'nome', 'chave', 'canonico_id')
+        }
+        canonicos = dict(
+            ProdutoCanonico.objects.filter(chave__in={produto.chave for produto in lote}).values_list('chave', 'pk')
+        )
+        for produto in lote:
+            anterior = anteriores.get(produto.sku)
+            if anterior is not None and anterior[1] == produto.chave and anterior[2]:
+                # Mantém o canônico de um agrupamento aproximado anterior
+                produto.canonico_id = anterior[2]
+            else:
+                # Associa pela chave exata, como o save(); os aproximados
+                # ficam para o comando ``agrupar_produtos``
+                produto.canonico_id = canonicos.get(produto.chave)
+            self._grupos_alterados.add(grupo_de_oferta(produto.canonico_id, produto.chave))
+            if anterior is not None:
+                self._grupos_alterados.add(grupo_de_oferta(anterior[2], anterior[1]))
+        self.atualizados += len(anteriores)
+        self.criados += len(lote) - len(anteriores)
+        if not self.simular:
+            escrever(self._inserir_ou_atualizar, lote)
+        if self.progresso:
+            self.progresso(self)
+
+    @staticmethod
+    def _inserir_ou_atualizar(lote):
+        with transaction.atomic():
+            Produto.objects.bulk_create(
+                lote, update_conflicts=True, unique_fields=['loja', 'sku'], update_fields=CAMPOS_ATUALIZADOS,
+            )
+
+    def concluir(self):
+        """
+        Acerta os resumos de ofertas dos grupos alterados e descarta os
+        fragmentos em cache da página da loja.
+        """
+        if self.simular or not (self.criados or self.atualizados):
+            return
+        escrever(ResumoOferta.atualizar_grupos, self._grupos_alterados)
+        invalidar_loja(self.loja.pk)
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from produto.correspondencia import LIMIAR_SIMILARIDADE, agrupar_produtos
+
+
+class Command(BaseCommand):
+    help = "Associa os produtos das lojas aos produtos canônicos usados para comparar ofertas."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recriar',
+            action='store_true',
+            help="Descarta os canônicos existentes e reagrupa todo o catálogo.",
+        )
+        parser.add_argument(
+            '--limiar',
+            type=float,
+            default=LIMIAR_SIMILARIDADE,
+            help="Similaridade mínima (0 a 1) para considerar dois nomes o mesmo produto.",
+        )
+
+    def handle(self, *args, **options):
+        processados, criados = agrupar_produtos(recriar=options['recriar'], limiar=options['limiar'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{processados} produto(s) agrupado(s), {criados} produto(s) canônico(s) criado(s)."
+        ))
@@ -0,0 +1,69 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from loja.models import Loja
+from produto.importacao import FORMATOS, TAMANHO_LOTE, ErroImportacao, ImportadorCatalogo, formato_do_arquivo, ler_feed
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa (cria ou atualiza pelo SKU) o catálogo de uma loja a partir de um arquivo "
+        "CSV ou JSON, lido em fluxo e gravado em lotes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo', help="Arquivo CSV, JSON ou JSON Lines.")
+        parser.add_argument('--loja', type=int, required=True, help="Id da loja dona do catálogo.")
+        parser.add_argument('--formato', choices=FORMATOS, help="Padrão: pela extensão do arquivo.")
+        parser.add_argument('--lote', type=int, default=TAMANHO_LOTE, help="Produtos gravados por vez.")
+        parser.add_argument(
+            '--simular',
+            action='store_true',
+            help="Apenas valida e conta o que seria criado ou atualizado, sem gravar.",
+        )
+        parser.add_argument(
+            '--criar-categorias',
+            action='store_true',
+            help="Cria as categorias que ainda não existem em vez de recusar a linha.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            loja = Loja.objects.get(pk=options['loja'])
+        except Loja.DoesNotExist:
+            raise CommandError(f"Loja {options['loja']} não encontrada.")
+        formato = options['formato'] or formato_do_arquivo(options['arquivo'])
+        inicio = time.monotonic()
+
+        def progresso(importador):
+            self.stdout.write(
+                f"{importador.processadas} linha(s) lida(s): {importador.criados} nova(s), "
+                f"{importador.atualizados} atualizada(s), {importador.total_erros} erro(s) "
+                f"[{time.monotonic() - inicio:.1f}s]"
+            )
+
+        importador = ImportadorCatalogo(
+            loja,
+            simular=options['simular'],
+            criar_categorias=options['criar_categorias'],
+            tamanho_lote=options['lote'],
+            progresso=progresso if options['verbosity'] >= 1 else None,
+        )
+        try:
+            with open(options['arquivo'], 'rb') as arquivo:
+                importador.importar(ler_feed(arquivo, formato))
+        except (OSError, ErroImportacao) as erro:
+            raise CommandError(str(erro))
+
+        for numero, mensagem in importador.erros:
+            self.stdout.write(f"Linha {numero}: {mensagem}")
+        if importador.total_erros > len(importador.erros):
+            self.stdout.write(f"... e mais {importador.total_erros - len(importador.erros)} erro(s).")
+        if importador.categorias_novas:
+            self.stdout.write(f"Categorias novas: {', '.join(sorted(importador.categorias_novas))}")
+        acao = "seriam" if options['simular'] else "foram"
+        self.stdout.write(self.style.SUCCESS(
+            f"{importador.criados} produto(s) {acao} criado(s) e {importador.atualizados} {acao} atualizado(s) "
+            f"em {time.monotonic() - inicio:.1f}s; {importador.total_erros} linha(s) recusada(s)."
+        ))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from produto.models import ResumoOferta
+
+
+class Command(BaseCommand):
+    help = "Recalcula a tabela de resumo de ofertas usada pelo comparador de preços."
+
+    def handle(self, *args, **options):
+        ResumoOferta.reconstruir()
+        total = ResumoOferta.objects.count()
+        self.stdout.write(self.style.SUCCESS(f"{total} resumo(s) de oferta gerado(s)."))
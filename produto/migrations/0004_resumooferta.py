@@ -0,0 +1,51 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Q
+
+
+def preencher_resumos(apps, schema_editor):
+    Produto = apps.get_model('produto', 'Produto')
+    ResumoOferta = apps.get_model('produto', 'ResumoOferta')
+    linhas = Produto.objects.filter(disponivel=True).values('nome').annotate(
+        min_preco=Min('preco'),
+        max_preco=Max('preco'),
+        produto_id=Min('id'),
+        foto=Min('foto', filter=Q(foto__isnull=False) & ~Q(foto='')),
+        loja_count=Count('loja', distinct=True),
+    )
+    ResumoOferta.objects.bulk_create(
+        [ResumoOferta(**dict(linha, foto=linha['foto'] or '')) for linha in linhas.iterator()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produto', '0003_remove_produto_foto_adicional_1_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='produto',
+            name='nome',
+            field=models.CharField(db_index=True, max_length=200),
+        ),
+        migrations.CreateModel(
+            name='ResumoOferta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=200, unique=True)),
+                ('min_preco', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('max_preco', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('foto', models.CharField(blank=True, default='', max_length=100)),
+                ('loja_count', models.PositiveIntegerField(default=0)),
+                ('produto', models.ForeignKey(db_constraint=False, help_text='Produto usado como referência do grupo (o de menor id).', on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='produto.produto')),
+            ],
+            options={
+                'verbose_name': 'Resumo de Oferta',
+                'verbose_name_plural': 'Resumos de Ofertas',
+            },
+        ),
+        migrations.RunPython(preencher_resumos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Cópia de produto/normalizacao.py no momento desta migração (a migração
+# não deve depender do código atual)
+TAMANHO_CHAVE = 255
+
+_UNIDADES = r'kg|g|mg|l|ml|un|und|cm|mm|m'
+_NUMERO_UNIDADE = re.compile(rf'(\d)\s+({_UNIDADES})\b')
+_VIRGULA_DECIMAL = re.compile(r'(\d),(\d)')
+_NAO_ALFANUMERICO = re.compile(r'[^a-z0-9.]+')
+
+
+def normalizar_nome(nome):
+    decomposto = unicodedata.normalize('NFKD', nome or '')
+    texto = ''.join(c for c in decomposto if not unicodedata.combining(c)).lower()
+    texto = _VIRGULA_DECIMAL.sub(r'\1.\2', texto)
+    texto = _NUMERO_UNIDADE.sub(r'\1\2', texto)
+    texto = _NAO_ALFANUMERICO.sub(' ', texto)
+    return ' '.join(sorted({p.strip('.') for p in texto.split() if p.strip('.')}))[:TAMANHO_CHAVE]
+
+
+def preencher_chaves(apps, schema_editor):
+    Produto = apps.get_model('produto', 'Produto')
+    lote = []
+    for produto in Produto.objects.only('id', 'nome').iterator(chunk_size=1000):
+        produto.chave = normalizar_nome(produto.nome)
+        lote.append(produto)
+        if len(lote) >= 1000:
+            Produto.objects.bulk_update(lote, ['chave'])
+            lote = []
+    Produto.objects.bulk_update(lote, ['chave'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produto', '0004_resumooferta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProdutoCanonico',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=200)),
+                ('chave', models.CharField(max_length=255, unique=True)),
+            ],
+            options={
+                'verbose_name': 'Produto Canônico',
+                'verbose_name_plural': 'Produtos Canônicos',
+            },
+        ),
+        migrations.AddField(
+            model_name='produto',
+            name='chave',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='produto',
+            name='canonico',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='produtos', to='produto.produtocanonico'),
+        ),
+        migrations.RunPython(preencher_chaves, migrations.RunPython.noop),
+    ]
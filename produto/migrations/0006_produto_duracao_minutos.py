@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:28
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produto', '0005_produtocanonico_produto_chave_produto_canonico'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='produto',
+            name='duracao_minutos',
+            field=models.PositiveSmallIntegerField(default=30, help_text='Tempo de atendimento, usado nos agendamentos de serviços.', validators=[django.core.validators.MinValueValidator(5), django.core.validators.MaxValueValidator(480)], verbose_name='Duração (minutos)'),
+        ),
+    ]
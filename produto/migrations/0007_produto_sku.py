@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loja', '0019_favoritas_consolidadas'),
+        ('produto', '0006_produto_duracao_minutos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='produto',
+            name='sku',
+            field=models.CharField(blank=True, help_text='Código do produto na loja (usado na importação do catálogo).', max_length=64, null=True, verbose_name='SKU'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='produto',
+            unique_together={('loja', 'sku')},
+        ),
+    ]
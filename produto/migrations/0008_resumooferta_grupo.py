@@ -0,0 +1,60 @@
+from django.db import migrations, models
+from django.db.models import Case, CharField, Count, Max, Min, Q, Value, When
+from django.db.models.functions import Cast, Concat
+
+# Cópia de ``expressao_grupo`` e ``ResumoOferta.agregar`` (produto/models.py)
+# no momento desta migração (a migração não deve depender do código atual)
+TAMANHO_CHAVE = 255
+
+
+def expressao_grupo():
+    return Case(
+        When(canonico__isnull=False, then=Concat(Value('c:'), Cast('canonico_id', CharField()))),
+        default=Concat(Value('k:'), 'chave'),
+        output_field=CharField(),
+    )
+
+
+def apagar_resumos(apps, schema_editor):
+    apps.get_model('produto', 'ResumoOferta').objects.all().delete()
+
+
+def preencher_resumos(apps, schema_editor):
+    Produto = apps.get_model('produto', 'Produto')
+    ResumoOferta = apps.get_model('produto', 'ResumoOferta')
+    linhas = Produto.objects.filter(disponivel=True).annotate(grupo=expressao_grupo()).values('grupo').annotate(
+        nome=Min('nome'),
+        min_preco=Min('preco'),
+        max_preco=Max('preco'),
+        produto_id=Min('id'),
+        foto=Min('foto', filter=Q(foto__isnull=False) & ~Q(foto='')),
+        loja_count=Count('loja', distinct=True),
+    ).order_by('grupo')
+    ResumoOferta.objects.bulk_create(
+        [ResumoOferta(**dict(linha, foto=linha['foto'] or '')) for linha in linhas.iterator()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produto', '0007_produto_sku'),
+    ]
+
+    operations = [
+        # Os resumos são refeitos do zero com a nova chave
+        migrations.RunPython(apagar_resumos, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='resumooferta',
+            name='nome',
+            field=models.CharField(max_length=200),
+        ),
+        migrations.AddField(
+            model_name='resumooferta',
+            name='grupo',
+            field=models.CharField(default='', max_length=TAMANHO_CHAVE + 2, unique=True),
+            preserve_default=False,
+        ),
+        migrations.RunPython(preencher_resumos, apagar_resumos),
+    ]
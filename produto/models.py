@@ -1,6 +1,10 @@
-from django.db import models
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import models, transaction
+from django.db.models import Case, CharField, Count, Max, Min, Q, Value, When
+from django.db.models.functions import Cast, Concat
 from loja.models import Loja, CarouselImage
-from .consts import ANIMAL_CHOICES, IDADE_CHOICES, PORTE_CHOICES
+from .consts import ANIMAL_CHOICES, DURACAO_MAXIMA_SERVICO, IDADE_CHOICES, PORTE_CHOICES
+from .normalizacao import TAMANHO_CHAVE, normalizar_nome
 
 
 class Categoria(models.Model):
@@ -19,6 +23,58 @@ class Categoria(models.Model):
         return self.nome
 
 
+# Acima de tantos grupos alterados, reconstruir o ResumoOferta inteiro é
+# mais rápido que atualizar grupo a grupo
+LIMITE_RESUMO_PARCIAL = 500
+
+
+def grupo_de_oferta(canonico_id, chave):
+    """
+    Identifica o grupo de ofertas de um produto: o produto canônico ou,
+    enquanto ele não tem canônico, a chave (nome normalizado).
+    """
+    if canonico_id:
+        return f'c:{canonico_id}'
+    return f'k:{chave}'
+
+
+def filtro_do_grupo(grupo):
+    """
+    Filtro dos produtos de um grupo de ``grupo_de_oferta``.
+    """
+    tipo, valor = grupo.split(':', 1)
+    if tipo == 'c':
+        return Q(canonico_id=int(valor))
+    return Q(canonico__isnull=True, chave=valor)
+
+
+def expressao_grupo():
+    """
+    ``grupo_de_oferta`` calculado no banco.
+    """
+    return Case(
+        When(canonico__isnull=False, then=Concat(Value('c:'), Cast('canonico_id', CharField()))),
+        default=Concat(Value('k:'), 'chave'),
+        output_field=CharField(),
+    )
+
+
+class ProdutoCanonico(models.Model):
+    """
+    Produto "de catálogo" que agrupa os anúncios equivalentes de lojas
+    diferentes (ex: "Ração Golden 15kg" e "Racao golden 15 kg").
+    """
+    nome = models.CharField(max_length=200)
+    chave = models.CharField(max_length=TAMANHO_CHAVE, unique=True)
+
+    class Meta:
+        verbose_name = "Produto Canônico"
+        verbose_name_plural = "Produtos Canônicos"
+
+    def __str__(self):
+        return self.nome
+
+
 class Produto(models.Model):
     """
     Modelo para representar produtos ou serviços oferecidos pelas lojas.
@@ -26,11 +82,22 @@ class Produto(models.Model):
 
     loja = models.ForeignKey(Loja, on_delete=models.CASCADE, related_name='produtos')
     categoria = models.ForeignKey(Categoria, on_delete=models.SET_NULL, null=True, blank=True, related_name='produtos')
-    nome = models.CharField(max_length=200)
+    nome = models.CharField(max_length=200, db_index=True)
+    # Código do produto no catálogo da loja; chave da importação em lote
+    sku = models.CharField(
+        max_length=64, blank=True, null=True, verbose_name="SKU",
+        help_text="Código do produto na loja (usado na importação do catálogo)."
+    )
     descricao = models.TextField(blank=True, null=True)
     preco = models.DecimalField(max_digits=10, decimal_places=2)
     estoque = models.PositiveIntegerField(default=0, help_text="Quantidade em estoque. Para serviços, pode ser 0.")
     disponivel = models.BooleanField(default=True)
+    duracao_minutos = models.PositiveSmallIntegerField(
+        default=30,
+        validators=[MinValueValidator(5), MaxValueValidator(DURACAO_MAXIMA_SERVICO)],
+        verbose_name="Duração (minutos)",
+        help_text="Tempo de atendimento, usado nos agendamentos de serviços."
+    )
 
     # Campos para filtro
     animal_destino = models.CharField(max_length=10, choices=ANIMAL_CHOICES, default='TODOS')
@@ -44,9 +111,140 @@ class Produto(models.Model):
         verbose_name="Foto do Produto"
     )
 
+    # Nome normalizado e produto canônico, usados para achar as ofertas
+    # do mesmo produto em outras lojas
+    chave = models.CharField(max_length=TAMANHO_CHAVE, blank=True, default='', db_index=True, editable=False)
+    canonico = models.ForeignKey(
+        ProdutoCanonico, on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='produtos'
+    )
+
     def __str__(self):
         return self.nome
 
+    def save(self, *args, **kwargs):
+        chave = normalizar_nome(self.nome)
+        if chave != self.chave or self.canonico_id is None:
+            # Associa pelo índice da chave; casos aproximados ficam para o
+            # comando ``agrupar_produtos``
+            self.chave = chave
+            self.canonico = ProdutoCanonico.objects.filter(chave=chave).first()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'chave', 'canonico'}
+        super().save(*args, **kwargs)
+
+    @property
+    def grupo_oferta(self):
+        return grupo_de_oferta(self.canonico_id, self.chave)
+
+    def ofertas(self):
+        """
+        Retorna as ofertas disponíveis do mesmo produto em todas as lojas
+        (as do mesmo grupo do ``ResumoOferta``).
+        """
+        return Produto.objects.filter(filtro_do_grupo(self.grupo_oferta), disponivel=True)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Guarda o grupo e a loja carregados para atualizar o resumo do
+        # grupo antigo e a página da loja anterior, e a foto para só gerar
+        # os derivados quando ela muda
+        if 'chave' in instance.__dict__ and 'canonico_id' in instance.__dict__:
+            instance._grupo_salvo = instance.grupo_oferta
+        instance._loja_salva = instance.__dict__.get('loja_id')
+        instance._foto_salva = instance.__dict__.get('foto')
+        return instance
+
     class Meta:
         verbose_name = "Produto"
         verbose_name_plural = "Produtos"
+        # Produtos sem SKU (NULL) não entram na restrição
+        unique_together = ('loja', 'sku')
+
+
+class ResumoOferta(models.Model):
+    """
+    Resumo materializado das ofertas de um produto, agrupadas como em
+    ``Produto.ofertas`` (pelo canônico, ou pela chave). Usado pelo
+    comparador de preços para não agregar a tabela de produtos a cada
+    listagem. É atualizado sempre que um produto é salvo ou excluído e
+    quando ``agrupar_produtos`` muda os canônicos.
+    """
+    # Ver ``grupo_de_oferta``
+    grupo = models.CharField(max_length=TAMANHO_CHAVE + 2, unique=True)
+    # Nome exibido: o primeiro em ordem alfabética entre os do grupo
+    nome = models.CharField(max_length=200)
+    produto = models.ForeignKey(
+        Produto,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+        help_text="Produto usado como referência do grupo (o de menor id)."
+    )
+    min_preco = models.DecimalField(max_digits=10, decimal_places=2)
+    max_preco = models.DecimalField(max_digits=10, decimal_places=2)
+    foto = models.CharField(max_length=100, blank=True, default='')
+    loja_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Resumo de Oferta"
+        verbose_name_plural = "Resumos de Ofertas"
+
+    def __str__(self):
+        return self.nome
+
+    @staticmethod
+    def agregar(produtos):
+        """
+        Agrega um queryset de produtos por grupo, no mesmo formato das
+        linhas de ``ResumoOferta``.
+        """
+        return produtos.annotate(grupo=expressao_grupo()).values('grupo').annotate(
+            nome=Min('nome'),
+            min_preco=Min('preco'),
+            max_preco=Max('preco'),
+            produto_id=Min('id'),
+            foto=Min('foto', filter=Q(foto__isnull=False) & ~Q(foto='')),
+            loja_count=Count('loja', distinct=True),
+        )
+
+    @classmethod
+    def atualizar(cls, grupo):
+        """
+        Recalcula o resumo de um único grupo de produtos.
+        """
+        linha = cls.agregar(Produto.objects.filter(filtro_do_grupo(grupo), disponivel=True)).order_by('grupo').first()
+        if linha is None:
+            cls.objects.filter(grupo=grupo).delete()
+            return
+        linha['foto'] = linha['foto'] or ''
+        cls.objects.update_or_create(grupo=grupo, defaults=linha)
+
+    @classmethod
+    def atualizar_grupos(cls, grupos):
+        """
+        Recalcula os resumos dos grupos alterados, ou todos, se forem muitos.
+        """
+        if len(grupos) > LIMITE_RESUMO_PARCIAL:
+            cls.reconstruir()
+            return
+        for grupo in grupos:
+            cls.atualizar(grupo)
+
+    @classmethod
+    def reconstruir(cls, batch_size=1000):
+        """
+        Recalcula todos os resumos a partir da tabela de produtos.
+        """
+        with transaction.atomic():
+            cls.objects.all().delete()
+            linhas = cls.agregar(Produto.objects.filter(disponivel=True)).order_by('grupo')
+            lote = []
+            for linha in linhas.iterator(chunk_size=batch_size):
+                linha['foto'] = linha['foto'] or ''
+                lote.append(cls(**linha))
+                if len(lote) >= batch_size:
+                    cls.objects.bulk_create(lote)
+                    lote = []
+            cls.objects.bulk_create(lote)
@@ -0,0 +1,63 @@
+"""
+Normalização de nomes de produtos para comparar ofertas entre lojas.
+
+"Ração Golden 15kg" e "Racao golden 15 kg" geram a mesma chave
+("15kg golden racao"): acentos e maiúsculas são ignorados, quantidades
+são juntadas à unidade e as palavras são ordenadas.
+"""
+import re
+import unicodedata
+
+TAMANHO_CHAVE = 255
+
+_UNIDADES = r'kg|g|mg|l|ml|un|und|cm|mm|m'
+_NUMERO_UNIDADE = re.compile(rf'(\d)\s+({_UNIDADES})\b')
+_VIRGULA_DECIMAL = re.compile(r'(\d),(\d)')
+_NAO_ALFANUMERICO = re.compile(r'[^a-z0-9.]+')
+_MEDIDA = re.compile(rf'^\d+(\.\d+)?({_UNIDADES})?$')
+
+
+def remover_acentos(texto):
+    decomposto = unicodedata.normalize('NFKD', texto)
+    return ''.join(c for c in decomposto if not unicodedata.combining(c))
+
+
+def palavras(nome):
+    """
+    Retorna as palavras normalizadas do nome, sem repetição e em ordem.
+    """
+    texto = remover_acentos(nome or '').lower()
+    texto = _VIRGULA_DECIMAL.sub(r'\1.\2', texto)
+    texto = _NUMERO_UNIDADE.sub(r'\1\2', texto)
+    texto = _NAO_ALFANUMERICO.sub(' ', texto)
+    return sorted({p.strip('.') for p in texto.split() if p.strip('.')})
+
+
+def normalizar_nome(nome):
+    """
+    Retorna a chave normalizada de um nome de produto.
+    """
+    return ' '.join(palavras(nome))[:TAMANHO_CHAVE]
+
+
+def medidas(chave):
+    """
+    Retorna as quantidades da chave (ex: "15kg", "500ml"). Produtos com
+    medidas diferentes nunca são considerados o mesmo produto.
+    """
+    return tuple(p for p in chave.split() if _MEDIDA.match(p))
+
+
+def trigramas(chave):
+    texto = f'  {chave} '
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def similaridade(trigramas_a, trigramas_b):
+    """
+    Similaridade de Jaccard entre dois conjuntos de trigramas (0 a 1).
+    """
+    if not trigramas_a or not trigramas_b:
+        return 0.0
+    comuns = len(trigramas_a & trigramas_b)
+    return comuns / (len(trigramas_a) + len(trigramas_b) - comuns)
@@ -0,0 +1,125 @@
+"""
+Paginação por cursor (keyset) para o comparador de preços.
+
+Em vez de OFFSET, cada página é buscada a partir dos valores de ordenação
+do último (ou primeiro) item da página anterior, então a página 500 custa
+o mesmo que a primeira. O cursor é um token assinado e opaco para o
+cliente.
+"""
+import hashlib
+
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import Q
+
+_SALT = 'produto.paginacao'
+TEMPO_CACHE_TOTAL = 60 * 5
+
+
+def codificar_cursor(valores, direcao):
+    return signing.dumps({'v': list(valores), 'd': direcao}, salt=_SALT, compress=True)
+
+
+def decodificar_cursor(token):
+    """
+    Retorna (valores, direcao) do cursor, ou None se o token for inválido.
+    """
+    try:
+        dados = signing.loads(token, salt=_SALT)
+        return list(dados['v']), dados['d']
+    except (signing.BadSignature, KeyError, TypeError):
+        return None
+
+
+def valor_do_item(item, campo):
+    """
+    Lê um campo de um item do queryset, seja ele um dict ou um objeto.
+    """
+    return item[campo] if isinstance(item, dict) else getattr(item, campo)
+
+
+def _apos(campos, valores, operador):
+    """
+    Filtro da comparação lexicográfica (campo1, campo2, ...) > valores
+    (ou < valores, conforme o operador).
+    """
+    filtro = Q()
+    for i, campo in enumerate(campos):
+        condicao = Q(**{f'{campo}__{operador}': valores[i]})
+        for anterior, valor in zip(campos[:i], valores[:i]):
+            condicao &= Q(**{anterior: valor})
+        filtro |= condicao
+    return filtro
+
+
+class PaginaCursor:
+    """
+    Página de resultados com os cursores para a página anterior e a próxima.
+    """
+
+    def __init__(self, itens, anterior=None, proximo=None, total=None):
+        self.itens = itens
+        self.cursor_anterior = anterior
+        self.cursor_proximo = proximo
+        self.total = total
+
+    def has_next(self):
+        return self.cursor_proximo is not None
+
+    def has_previous(self):
+        return self.cursor_anterior is not None
+
+    def __iter__(self):
+        return iter(self.itens)
+
+    def __len__(self):
+        return len(self.itens)
+
+
+def paginar_por_cursor(queryset, campos, tamanho, token=None):
+    """
+    Retorna a ``PaginaCursor`` indicada pelo token (ou a primeira página).
+    ``campos`` deve identificar cada linha de forma única.
+    """
+    cursor = decodificar_cursor(token) if token else None
+    if cursor is not None and (len(cursor[0]) != len(campos) or cursor[1] not in ('proximo', 'anterior')):
+        # Cursor de outra ordenação (ex: gerado antes de uma mudança nos campos)
+        cursor = None
+    if cursor is None:
+        valores, direcao = None, 'proximo'
+        queryset = queryset.order_by(*campos)
+    else:
+        valores, direcao = cursor
+        if direcao == 'anterior':
+            queryset = queryset.filter(_apos(campos, valores, 'lt')).order_by(*[f'-{c}' for c in campos])
+        else:
+            queryset = queryset.filter(_apos(campos, valores, 'gt')).order_by(*campos)
+
+    itens = list(queryset[:tamanho + 1])
+    tem_mais = len(itens) > tamanho
+    itens = itens[:tamanho]
+    if direcao == 'anterior':
+        itens.reverse()
+
+    anterior = proximo = None
+    if itens:
+        primeiro = [valor_do_item(itens[0], c) for c in campos]
+        ultimo = [valor_do_item(itens[-1], c) for c in campos]
+        if (direcao == 'proximo' and tem_mais) or (direcao == 'anterior' and valores is not None):
+            proximo = codificar_cursor(ultimo, 'proximo')
+        if (direcao == 'anterior' and tem_mais) or (direcao == 'proximo' and valores is not None):
+            anterior = codificar_cursor(primeiro, 'anterior')
+    return PaginaCursor(itens, anterior, proximo)
+
+
+def total_em_cache(queryset, chave):
+    """
+    Retorna o total de linhas do queryset, guardado em cache por alguns
+    minutos para não repetir o COUNT a cada página.
+    """
+    chave_cache = 'produto:total:' + hashlib.md5(chave.encode()).hexdigest()
+    total = cache.get(chave_cache)
+    if total is None:
+        total = queryset.count()
+        cache.set(chave_cache, total, TEMPO_CACHE_TOTAL)
+    return total
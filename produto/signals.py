@@ -0,0 +1,67 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from loja.armazenamento import registrar_referencias
+from loja.cache import invalidar_categorias, invalidar_loja
+from loja.imagens import agendar_se_mudou
+
+from .models import Categoria, Produto, ProdutoCanonico, ResumoOferta, grupo_de_oferta
+
+registrar_referencias(Produto, 'foto')
+
+
+@receiver(post_save, sender=Produto)
+def atualizar_resumo_ao_salvar(sender, instance, **kwargs):
+    """
+    Recalcula o resumo do grupo do produto (e o do grupo antigo, se o
+    produto foi renomeado ou mudou de canônico).
+    """
+    ResumoOferta.atualizar(instance.grupo_oferta)
+    grupo_anterior = getattr(instance, '_grupo_salvo', None)
+    if grupo_anterior is not None and grupo_anterior != instance.grupo_oferta:
+        ResumoOferta.atualizar(grupo_anterior)
+    instance._grupo_salvo = instance.grupo_oferta
+
+
+@receiver(post_delete, sender=Produto)
+def atualizar_resumo_ao_excluir(sender, instance, **kwargs):
+    ResumoOferta.atualizar(instance.grupo_oferta)
+
+
+@receiver(pre_delete, sender=ProdutoCanonico)
+def guardar_chaves_do_canonico(sender, instance, **kwargs):
+    # Os produtos do canônico voltam a ser agrupados pela chave
+    instance._chaves_dos_produtos = set(instance.produtos.values_list('chave', flat=True))
+
+
+@receiver(post_delete, sender=ProdutoCanonico)
+def atualizar_resumo_do_canonico(sender, instance, **kwargs):
+    chaves = getattr(instance, '_chaves_dos_produtos', set())
+    ResumoOferta.atualizar_grupos(
+        {grupo_de_oferta(instance.pk, ''), *(grupo_de_oferta(None, chave) for chave in chaves)}
+    )
+
+
+@receiver(post_save, sender=Produto)
+@receiver(post_delete, sender=Produto)
+def invalidar_pagina_da_loja(sender, instance, **kwargs):
+    """
+    Descarta os fragmentos em cache da página da loja do produto (e da
+    loja anterior, se ele mudou de loja).
+    """
+    invalidar_loja(instance.loja_id)
+    loja_anterior = getattr(instance, '_loja_salva', None)
+    if loja_anterior is not None and loja_anterior != instance.loja_id:
+        invalidar_loja(loja_anterior)
+    instance._loja_salva = instance.loja_id
+
+
+@receiver(post_save, sender=Produto)
+def gerar_derivados_da_foto(sender, instance, update_fields=None, **kwargs):
+    agendar_se_mudou(instance, 'foto', update_fields)
+
+
+@receiver(post_save, sender=Categoria)
+@receiver(post_delete, sender=Categoria)
+def atualizar_categorias(sender, **kwargs):
+    invalidar_categorias()
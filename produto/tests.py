@@ -1,3 +1,347 @@
+from io import BytesIO
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
+from django.urls import reverse
+
+from loja.models import Loja
+
+from .correspondencia import agrupar_produtos
+from .forms import ProdutoForm
+from .importacao import ErroImportacao, ImportadorCatalogo, ler_feed
+from .models import Categoria, Produto, ProdutoCanonico, ResumoOferta
+from .paginacao import codificar_cursor
+from .normalizacao import normalizar_nome
+
+
+def _csv(texto):
+    return BytesIO(texto.encode('utf-8'))
+
+
+class ImportacaoCatalogoTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.loja = Loja.objects.create(nome='Pet Shop', endereco='Rua A', telefone='1', email='loja@importacao.petcare')
+        self.outra = Loja.objects.create(nome='Outra', endereco='Rua B', telefone='2', email='outra@importacao.petcare')
+        Categoria.objects.create(nome='Rações')
+
+    def importar(self, texto, loja=None, **opcoes):
+        importador = ImportadorCatalogo(loja or self.loja, **opcoes)
+        return importador.importar(ler_feed(_csv(texto), 'csv'))
+
+    def test_cria_e_depois_atualiza_pelo_sku(self):
+        importador = self.importar(
+            'sku,nome,preco,categoria\n'
+            'R1,Ração Golden,100.00,Rações\n'
+            'R2,Ração Premier,80.00,rações\n'
+            'R3,Petisco,10.00,\n'
+        )
+        self.assertEqual((importador.criados, importador.atualizados, importador.total_erros), (3, 0, 0))
+        # O mesmo SKU em outra loja é outro produto
+        self.importar('sku,nome,preco\nR1,Ração Golden,95.00\n', loja=self.outra)
+
+        importador = self.importar('sku;nome;preco;estoque\nR1;Ração Golden 15kg;110,50;4\nR2;Ração Premier;80,00;0\nR4;Bolinha;5;1\n')
+        self.assertEqual((importador.criados, importador.atualizados), (1, 2))
+        self.assertEqual(Produto.objects.filter(loja=self.loja).count(), 4)
+        produto = Produto.objects.get(loja=self.loja, sku='R1')
+        self.assertEqual((produto.nome, str(produto.preco), produto.estoque), ('Ração Golden 15kg', '110.50', 4))
+        self.assertEqual(produto.chave, normalizar_nome('Ração Golden 15kg'))
+        self.assertEqual(str(Produto.objects.get(loja=self.outra, sku='R1').preco), '95.00')
+
+    def test_sku_repetido_no_lote_vale_a_ultima_linha(self):
+        importador = self.importar('sku,nome,preco\nR1,Ração,10\nR1,Ração,20\n')
+        self.assertEqual((importador.processadas, importador.criados, importador.atualizados), (2, 1, 0))
+        self.assertEqual(str(Produto.objects.get(loja=self.loja, sku='R1').preco), '20.00')
+
+    def test_erros_de_validacao_com_o_numero_da_linha(self):
+        importador = self.importar(
+            'sku,nome,preco,animal_destino,porte_animal\n'
+            'R1,Ração,10,Gato,médio\n'
+            'R2,Ração,10,DINOSSAURO,\n'
+            'R3,Ração,abc,,GIGANTE\n'
+            ',,10,,\n'
+        )
+        self.assertEqual(importador.criados, 1)
+        self.assertEqual(importador.erros, [
+            (3, "animal_destino inválido ('DINOSSAURO')"),
+            (4, "preço inválido ('abc'); porte_animal inválido ('GIGANTE')"),
+            (5, 'SKU vazio; nome vazio'),
+        ])
+        produto = Produto.objects.get(sku='R1')
+        self.assertEqual((produto.animal_destino, produto.porte_animal), ('GATO', 'MEDIO'))
+
+    def test_simular_nao_grava_nada(self):
+        self.importar('sku,nome,preco\nR1,Ração,10\n')
+        importador = self.importar(
+            'sku,nome,preco,categoria\nR1,Ração nova,15,\nR2,Brinquedo,5,Brinquedos\n',
+            simular=True, criar_categorias=True,
+        )
+        self.assertEqual((importador.criados, importador.atualizados), (1, 1))
+        self.assertEqual(importador.categorias_novas, {'Brinquedos'})
+        self.assertEqual(list(Produto.objects.values_list('sku', 'nome')), [('R1', 'Ração')])
+        self.assertFalse(Categoria.objects.filter(nome='Brinquedos').exists())
+
+    def test_csv_que_nao_esta_em_utf8(self):
+        with self.assertRaises(ErroImportacao):
+            ImportadorCatalogo(self.loja).importar(ler_feed(BytesIO(b'sku,n\xe3o,preco\n'), 'csv'))
+
+    def test_lojista_importa_sempre_na_propria_loja(self):
+        lojista = User.objects.create_user('lojista', self.loja.email, 'senha')
+        self.client.force_login(lojista)
+        resposta = self.client.post(reverse('produto:produto_importar'), {
+            'loja': self.outra.pk,
+            'arquivo': SimpleUploadedFile('catalogo.csv', b'sku,nome,preco\nR1,Racao,10\n'),
+        })
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(list(Produto.objects.values_list('loja_id', flat=True)), [self.loja.pk])
+
+        resposta = self.client.post(reverse('produto:produto_importar'), {
+            'arquivo': SimpleUploadedFile('catalogo.csv', b'sku,n\xe3o,preco\n'),
+        })
+        self.assertEqual(resposta.status_code, 200)
+        self.assertIn('arquivo', resposta.context['form'].errors)
+
+    def test_cliente_nao_importa(self):
+        self.client.force_login(User.objects.create_user('cliente', 'cliente@importacao.petcare', 'senha'))
+        self.assertEqual(self.client.get(reverse('produto:produto_importar')).status_code, 403)
+
+
+class ResumoOfertaTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.lojas = [
+            Loja.objects.create(nome=f'Loja {numero}', endereco='Rua A', telefone='1', email=f'loja{numero}@ofertas.petcare')
+            for numero in range(2)
+        ]
+
+    def produto(self, nome, preco, loja=0, **campos):
+        return Produto.objects.create(loja=self.lojas[loja], nome=nome, preco=preco, **campos)
+
+    def assertResumosConferem(self):
+        """
+        A tabela mantida pelos sinais é igual à agregação feita do zero.
+        """
+        campos = ('nome', 'produto_id', 'min_preco', 'max_preco', 'foto', 'loja_count')
+        mantidos = list(ResumoOferta.objects.order_by('nome').values_list(*campos))
+        ResumoOferta.reconstruir()
+        self.assertEqual(mantidos, list(ResumoOferta.objects.order_by('nome').values_list(*campos)))
+        return {nome: (str(minimo), str(maximo), lojas) for nome, _, minimo, maximo, _, lojas in mantidos}
+
+    def test_resumo_acompanha_os_produtos(self):
+        golden = self.produto('Ração Golden', '100.00')
+        self.produto('Ração Golden', '90.00', loja=1)
+        bolinha = self.produto('Bolinha', '5.00')
+        self.assertEqual(self.assertResumosConferem(), {
+            'Bolinha': ('5.00', '5.00', 1),
+            'Ração Golden': ('90.00', '100.00', 2),
+        })
+
+        golden.preco = '80.00'
+        golden.save()
+        self.assertEqual(self.assertResumosConferem()['Ração Golden'], ('80.00', '90.00', 2))
+
+        # Renomeado a partir de uma instância carregada do banco: o grupo
+        # antigo também é recalculado
+        renomeado = Produto.objects.get(pk=golden.pk)
+        renomeado.nome = 'Bolinha'
+        renomeado.save()
+        self.assertEqual(self.assertResumosConferem(), {
+            'Bolinha': ('5.00', '80.00', 1),
+            'Ração Golden': ('90.00', '90.00', 1),
+        })
+
+        bolinha.disponivel = False
+        bolinha.save()
+        self.assertEqual(self.assertResumosConferem()['Bolinha'], ('80.00', '80.00', 1))
+
+        Produto.objects.get(pk=golden.pk).delete()
+        self.assertEqual(self.assertResumosConferem(), {'Ração Golden': ('90.00', '90.00', 1)})
+
+    def test_listagem_le_o_resumo(self):
+        self.produto('Ração Golden', '100.00')
+        self.produto('Ração Golden', '90.00', loja=1)
+        self.client.force_login(User.objects.create_user('comprador'))
+        resposta = self.client.get(reverse('produto:produto_list_json'))
+        self.assertEqual(
+            [(item['nome'], item['min_preco'], item['max_preco'], item['loja_count']) for item in resposta.json()['resultados']],
+            [('Ração Golden', '90.00', '100.00', 2)],
+        )
+
+
+class ProdutoCanonicoTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.lojas = [
+            Loja.objects.create(nome=f'Loja {numero}', endereco='Rua A', telefone='1', email=f'loja{numero}@canonicos.petcare')
+            for numero in range(4)
+        ]
+
+    def produto(self, nome, loja):
+        return Produto.objects.create(loja=self.lojas[loja], nome=nome, preco='10.00')
+
+    def test_chave_normalizada(self):
+        self.assertEqual(normalizar_nome('Ração Golden 15kg'), normalizar_nome('Racao  golden 15 KG'))
+        self.assertEqual(normalizar_nome('Shampoo 0,5 l'), normalizar_nome('shampoo 0.5l'))
+        self.assertNotEqual(normalizar_nome('Ração Golden 15kg'), normalizar_nome('Ração Golden 3kg'))
+
+    def test_agrupar_e_associar_novos_produtos(self):
+        golden = self.produto('Ração Golden Adulto 15kg', 0)
+        mesma_chave = self.produto('Racao golden adulto 15 kg', 1)
+        com_erro = self.produto('Ração Goldem Adulto 15kg', 2)
+        outra_medida = self.produto('Ração Golden Adulto 3kg', 3)
+
+        self.assertEqual(agrupar_produtos(), (4, 2))
+        for produto in (golden, mesma_chave, com_erro, outra_medida):
+            produto.refresh_from_db()
+        self.assertEqual(golden.canonico_id, mesma_chave.canonico_id)
+        self.assertEqual(golden.canonico_id, com_erro.canonico_id)
+        self.assertNotEqual(golden.canonico_id, outra_medida.canonico_id)
+        # Rodar de novo não mexe nos já agrupados
+        self.assertEqual(agrupar_produtos(), (0, 0))
+
+        # Um produto novo com a mesma chave já é associado ao salvar
+        novo = self.produto('RAÇÃO GOLDEN ADULTO 15KG', 3)
+        self.assertEqual(novo.canonico_id, golden.canonico_id)
+        self.assertEqual(
+            set(golden.ofertas().values_list('pk', flat=True)), {golden.pk, mesma_chave.pk, com_erro.pk, novo.pk},
+        )
+
+        self.assertEqual(agrupar_produtos(recriar=True), (5, 2))
+        self.assertEqual(ProdutoCanonico.objects.count(), 2)
+
+    def resumos(self):
+        """
+        (nome, lojas) de cada grupo do resumo, conferidos com a agregação
+        do zero e com as ofertas da página do produto.
+        """
+        campos = ('grupo', 'nome', 'produto_id', 'min_preco', 'max_preco', 'loja_count')
+        mantidos = list(ResumoOferta.objects.order_by('grupo').values_list(*campos))
+        ResumoOferta.reconstruir()
+        self.assertEqual(mantidos, list(ResumoOferta.objects.order_by('grupo').values_list(*campos)))
+        for _, _, produto_id, _, _, lojas in mantidos:
+            self.assertEqual(Produto.objects.get(pk=produto_id).ofertas().values('loja').distinct().count(), lojas)
+        return sorted((nome, lojas) for _, nome, _, _, _, lojas in mantidos)
+
+    def test_resumo_agrupa_pelo_canonico(self):
+        golden = self.produto('Ração Golden Adulto 15kg', 0)
+        self.produto('Racao golden adulto 15 kg', 1)
+        self.produto('Ração Goldem Adulto 15kg', 2)
+        self.produto('Ração Golden Adulto 3kg', 3)
+        # Sem canônicos, os grupos são as chaves
+        self.assertEqual(self.resumos(), [
+            ('Racao golden adulto 15 kg', 2), ('Ração Goldem Adulto 15kg', 1), ('Ração Golden Adulto 3kg', 1),
+        ])
+
+        agrupar_produtos()
+        self.assertEqual(self.resumos(), [('Racao golden adulto 15 kg', 3), ('Ração Golden Adulto 3kg', 1)])
+        self.client.force_login(User.objects.create_user('comprador'))
+        resultados = self.client.get(reverse('produto:produto_list_json'), {'q': 'goldem'}).json()['resultados']
+        self.assertEqual([(item['nome'], item['loja_count']) for item in resultados], [('Racao golden adulto 15 kg', 3)])
+
+        # Produto novo com a chave do canônico entra no grupo dele ao salvar
+        self.produto('RAÇÃO GOLDEN ADULTO 15KG', 3)
+        self.assertEqual(self.resumos(), [('RAÇÃO GOLDEN ADULTO 15KG', 4), ('Ração Golden Adulto 3kg', 1)])
+
+        # Excluir o canônico (ex: pelo admin) devolve os produtos às chaves
+        Produto.objects.get(pk=golden.pk).canonico.delete()
+        self.assertEqual(self.resumos(), [
+            ('RAÇÃO GOLDEN ADULTO 15KG', 3), ('Ração Goldem Adulto 15kg', 1), ('Ração Golden Adulto 3kg', 1),
+        ])
+
+    def test_pagina_do_produto_lista_as_ofertas(self):
+        golden = self.produto('Ração Golden 15kg', 0)
+        Produto.objects.create(loja=self.lojas[1], nome='Racao golden 15 kg', preco='8.00')
+        Produto.objects.create(loja=self.lojas[2], nome='Ração Golden 15kg', preco='9.00', disponivel=False)
+        self.produto('Ração Golden 3kg', 3)
+        agrupar_produtos()
+
+        self.client.force_login(User.objects.create_user('comprador'))
+        resposta = self.client.get(reverse('produto:produto_detail', args=[golden.pk]))
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual([oferta.loja.nome for oferta in resposta.context['ofertas']], ['Loja 1', 'Loja 0'])
+        self.assertContains(resposta, 'Disponível em 2 loja(s)')
+
+
+class PaginacaoCursorTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        loja = Loja.objects.create(nome='Pet Shop', endereco='Rua A', telefone='1', email='loja@cursor.petcare')
+        cls.racoes = Categoria.objects.create(nome='Rações')
+        for numero in range(30):
+            # Dois produtos por nome nos pares: o grupo aparece uma vez só
+            for preco in ('10.00', '12.00')[:1 + numero % 2]:
+                Produto.objects.create(loja=loja, nome=f'Produto {numero:02d}', preco=preco, categoria=cls.racoes)
+        cls.nomes = [f'Produto {numero:02d}' for numero in range(30)]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user('comprador'))
+
+    def pagina(self, **parametros):
+        resposta = self.client.get(reverse('produto:produto_list_json'), parametros)
+        self.assertEqual(resposta.status_code, 200)
+        return resposta.json()
+
+    def percorrer(self, **filtros):
+        """
+        Vai até a última página pelo cursor "próximo" e volta pelo "anterior".
+        """
+        paginas = [self.pagina(**filtros)]
+        self.assertIsNone(paginas[0]['anterior'])
+        while paginas[-1]['proximo']:
+            paginas.append(self.pagina(cursor=paginas[-1]['proximo'], **filtros))
+        ida = [[item['nome'] for item in pagina['resultados']] for pagina in paginas]
+
+        volta = [ida[-1]]
+        pagina = paginas[-1]
+        while pagina['anterior']:
+            pagina = self.pagina(cursor=pagina['anterior'], **filtros)
+            volta.insert(0, [item['nome'] for item in pagina['resultados']])
+        return ida, volta, paginas[0]['total']
+
+    def test_ida_e_volta(self):
+        for filtros in ({}, {'categoria': self.racoes.pk}):
+            with self.subTest(**filtros):
+                ida, volta, total = self.percorrer(**filtros)
+                self.assertEqual([len(pagina) for pagina in ida], [12, 12, 6])
+                self.assertEqual(sum(ida, []), self.nomes)
+                self.assertEqual(volta, ida)
+                self.assertEqual(total, 30)
+
+    def test_cursor_adulterado_volta_a_primeira_pagina(self):
+        primeira = self.pagina()
+        proximo = primeira['proximo']
+        invalidos = [
+            proximo[:-2] + ('AA' if not proximo.endswith('AA') else 'BB'),
+            'lixo',
+            codificar_cursor(['Produto 05'], 'proximo')[:10],
+            # Assinados, mas com outra ordenação ou direção
+            codificar_cursor(['Produto 05'], 'proximo'),
+            codificar_cursor(['Produto 05', 1], 'lado'),
+        ]
+        for cursor in invalidos:
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.pagina(cursor=cursor)['resultados'], primeira['resultados'])
+
+
+class ProdutoFormTests(TestCase):
+
+    def test_lojista_define_a_duracao_do_servico(self):
+        loja = Loja.objects.create(nome='Pet Shop', endereco='Rua A', telefone='1', email='loja@form.petcare')
+        dados = {
+            'loja': loja.pk, 'nome': 'Banho e tosa', 'preco': '80.00', 'estoque': 0, 'disponivel': True,
+            'duracao_minutos': 90, 'animal_destino': 'CACHORRO', 'porte_animal': 'TODOS', 'idade_animal': 'TODOS',
+        }
+        form = ProdutoForm(dados)
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.save().duracao_minutos, 90)
 
-# Create your tests here.
+        # Mais que DURACAO_MAXIMA_SERVICO não passa
+        form = ProdutoForm({**dados, 'duracao_minutos': 9 * 60})
+        self.assertIn('duracao_minutos', form.errors)
@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import ProdutoListView, ProdutoCreateView, CategoriaCreateAjaxView, ProdutoDetailView, ProdutoUpdateView
+from .views import ProdutoListView, ProdutoListJsonView, ProdutoCreateView, CategoriaCreateAjaxView, ProdutoDetailView, ProdutoUpdateView, ProdutoImportView, ProdutoExportView
 
 # Adiciona um namespace para o app 'produto'
 
@@ -7,7 +7,10 @@ app_name = 'produto'
 
 urlpatterns = [
     path('', ProdutoListView.as_view(), name='produto_list'),
+    path('api/', ProdutoListJsonView.as_view(), name='produto_list_json'),
     path('novo/', ProdutoCreateView.as_view(), name='produto_create'),
+    path('importar/', ProdutoImportView.as_view(), name='produto_importar'),
+    path('exportar/', ProdutoExportView.as_view(), name='produto_exportar'),
     path('<int:pk>/', ProdutoDetailView.as_view(), name='produto_detail'),
     path('<int:pk>/editar/', ProdutoUpdateView.as_view(), name='produto_update'),
     path('categoria/nova/', CategoriaCreateAjaxView.as_view(), name='categoria_create_ajax'),
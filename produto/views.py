@@ -1,13 +1,22 @@
-from django.urls import reverse_lazy
-from django.views.generic import ListView, CreateView, DetailView, UpdateView, View
+from functools import partial
+
+from django.conf import settings
+from django.urls import reverse, reverse_lazy
+from django.views.generic import ListView, CreateView, DetailView, UpdateView, View, FormView
 from django.forms import Select, TextInput, Textarea, NumberInput, CheckboxInput, FileInput
 from django.http import JsonResponse
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.db.models import Min, Max, Count, Q
 
-from .models import Produto, Categoria, Loja
-from .forms import CategoriaForm, ProdutoForm, Categoria
+from loja.cache import categorias, loja_do_usuario, usuario_e_lojista
+from loja.models import Loja
+from petcareapp.exportacao import ExportacaoView
+
+from .models import Produto, ResumoOferta, expressao_grupo
+from .forms import CategoriaForm, ImportacaoCatalogoForm, ProdutoForm
+from .importacao import ErroImportacao, ImportadorCatalogo, formato_do_arquivo, ler_feed
 from .consts import ANIMAL_CHOICES
+from .busca import INDICE_PRODUTOS
+from .paginacao import paginar_por_cursor, total_em_cache, valor_do_item
 
 class ProdutoListView(LoginRequiredMixin, ListView):
     """
@@ -18,6 +27,8 @@ class ProdutoListView(LoginRequiredMixin, ListView):
     context_object_name = 'produtos'
     login_url = reverse_lazy('login')
     paginate_by = 12
+    # Ordenação usada pela paginação por cursor; identifica cada grupo
+    campos_cursor = ('nome', 'produto_id')
 
     def get_queryset(self):
         # Inicia a queryset base e aplica os filtros
@@ -27,31 +38,82 @@ class ProdutoListView(LoginRequiredMixin, ListView):
         categoria_id = self.request.GET.get('categoria', '')
         animal = self.request.GET.get('animal', '')
 
+        if categoria_id.isdigit() or animal:
+            # Esses filtros mudam quais produtos entram em cada grupo,
+            # então o agrupamento é feito na hora sobre o conjunto filtrado
+            if query:
+                queryset = INDICE_PRODUTOS.filtrar(queryset, query)
+            if categoria_id.isdigit():
+                queryset = queryset.filter(categoria__id=categoria_id)
+            if animal:
+                queryset = queryset.filter(animal_destino=animal)
+            return ResumoOferta.agregar(queryset).order_by(*self.campos_cursor)
+
+        # Sem esses filtros, lê os grupos já agregados em ResumoOferta
+        resumos = ResumoOferta.objects.all()
         if query:
-            queryset = queryset.filter(nome__icontains=query)
-        if categoria_id.isdigit():
-            queryset = queryset.filter(categoria__id=categoria_id)
-        if animal:
-            queryset = queryset.filter(animal_destino=animal)
-
-        # Troque 'preco' pelo nome do campo correto se for diferente!
-        return queryset.values('nome').annotate(
-            min_preco=Min('preco'),
-            max_preco=Max('preco'),
-            id=Min('id'),
-            foto=Min('foto', filter=Q(foto__isnull=False)),
-            loja_count=Count('loja', distinct=True)
-        ).order_by('nome')
+            encontrados = INDICE_PRODUTOS.filtrar(queryset, query).annotate(grupo=expressao_grupo())
+            resumos = resumos.filter(grupo__in=encontrados.values('grupo'))
+        return resumos.order_by(*self.campos_cursor)
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Pagina por cursor em vez de OFFSET: o custo de cada página não
+        depende de quantas vieram antes.
+        """
+        pagina = paginar_por_cursor(queryset, self.campos_cursor, page_size, self.request.GET.get('cursor'))
+        filtros = self.parametros_filtro()
+        pagina.total = total_em_cache(queryset, f'{queryset.model._meta.label}?{filtros}')
+        return None, pagina, pagina.itens, pagina.has_next() or pagina.has_previous()
+
+    def parametros_filtro(self):
+        """
+        Parâmetros da busca atual sem o cursor, para montar os links das páginas.
+        """
+        parametros = self.request.GET.copy()
+        parametros.pop('cursor', None)
+        parametros.pop('page', None)
+        return parametros.urlencode()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['categorias'] = Categoria.objects.all()
+        context['categorias'] = categorias()
         context['animal_choices'] = ANIMAL_CHOICES
+        context['parametros_filtro'] = self.parametros_filtro()
         if self.request.user.is_authenticated:
-            context['is_store_user'] = Loja.objects.filter(email=self.request.user.email).exists()
+            context['is_store_user'] = usuario_e_lojista(self.request.user)
         return context
 
 
+class ProdutoListJsonView(ProdutoListView):
+    """
+    Versão JSON do comparador de preços, com a mesma paginação por cursor.
+    """
+
+    def get(self, request, *args, **kwargs):
+        queryset = self.get_queryset()
+        _, pagina, itens, _ = self.paginate_queryset(queryset, self.paginate_by)
+        resultados = []
+        for item in itens:
+            valor = partial(valor_do_item, item)
+            foto = valor('foto')
+            resultados.append({
+                'nome': valor('nome'),
+                'produto_id': valor('produto_id'),
+                'min_preco': str(valor('min_preco')),
+                'max_preco': str(valor('max_preco')),
+                'loja_count': valor('loja_count'),
+                'foto': f'{settings.MEDIA_URL}{foto}' if foto else None,
+                'url': reverse('produto:produto_detail', kwargs={'pk': valor('produto_id')}),
+            })
+        return JsonResponse({
+            'resultados': resultados,
+            'total': pagina.total,
+            'anterior': pagina.cursor_anterior,
+            'proximo': pagina.cursor_proximo,
+        })
+
+
 class ProdutoCreateView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
     """
     View para cadastrar um novo produto.
@@ -66,7 +128,7 @@ class ProdutoCreateView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
         """Permite acesso a superusuários ou usuários associados a uma loja."""
         if self.request.user.is_superuser:
             return True
-        return Loja.objects.filter(email=self.request.user.email).exists()
+        return usuario_e_lojista(self.request.user)
 
     def get_form(self, form_class=None):
         """
@@ -104,9 +166,8 @@ class ProdutoCreateView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
         Associa a loja correta ao produto se o usuário não for superuser.
         """
         if not self.request.user.is_superuser:
-            # Busca a loja associada ao email do usuário logado
-            loja_usuario = Loja.objects.get(email=self.request.user.email)
-            form.instance.loja = loja_usuario
+            # A loja associada ao email do usuário logado (já conferida no test_func)
+            form.instance.loja_id = loja_do_usuario(self.request.user)
         return super().form_valid(form)
 
 
@@ -122,8 +183,8 @@ class ProdutoDetailView(LoginRequiredMixin, DetailView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         produto_selecionado = self.get_object()
-        # Busca todos os produtos com o mesmo nome (ofertas em diferentes lojas)
-        ofertas = Produto.objects.filter(nome__iexact=produto_selecionado.nome, disponivel=True).order_by('preco')
+        # Busca as ofertas do mesmo produto canônico em diferentes lojas
+        ofertas = produto_selecionado.ofertas().select_related('loja').order_by('preco')
         context['ofertas'] = ofertas
         return context
 
@@ -154,6 +215,70 @@ class ProdutoUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
         return context
 
 
+class ProdutoImportView(LoginRequiredMixin, UserPassesTestMixin, FormView):
+    """
+    View para importar (criar ou atualizar pelo SKU) o catálogo de uma loja
+    a partir de um arquivo CSV ou JSON.
+    """
+    form_class = ImportacaoCatalogoForm
+    template_name = 'produto/importar_catalogo.html'
+    login_url = reverse_lazy('login')
+
+    def test_func(self):
+        """Permite acesso a superusuários ou usuários associados a uma loja."""
+        if self.request.user.is_superuser:
+            return True
+        return usuario_e_lojista(self.request.user)
+
+    def get_form(self, form_class=None):
+        form = super().get_form(form_class)
+        if self.request.user.is_superuser:
+            form.fields['loja'].required = True
+        else:
+            # O lojista importa sempre para a própria loja
+            del form.fields['loja']
+        for field in form.fields.values():
+            if isinstance(field.widget, Select):
+                field.widget.attrs.update({'class': 'form-select'})
+            elif isinstance(field.widget, CheckboxInput):
+                field.widget.attrs.update({'class': 'form-check-input'})
+            else:
+                field.widget.attrs.update({'class': 'form-control'})
+        return form
+
+    def form_valid(self, form):
+        if self.request.user.is_superuser:
+            loja = form.cleaned_data['loja']
+        else:
+            loja = Loja.objects.get(pk=loja_do_usuario(self.request.user))
+        arquivo = form.cleaned_data['arquivo']
+        importador = ImportadorCatalogo(
+            loja, simular=form.cleaned_data['simular'], criar_categorias=form.cleaned_data['criar_categorias'],
+        )
+        try:
+            importador.importar(ler_feed(arquivo, formato_do_arquivo(arquivo.name)))
+        except ErroImportacao as erro:
+            form.add_error('arquivo', str(erro))
+            return self.form_invalid(form)
+        # Mostra o resultado na própria página, com o formulário para um novo envio
+        return self.render_to_response(self.get_context_data(form=form, importador=importador))
+
+
+class ProdutoExportView(ExportacaoView):
+    """
+    Exporta o catálogo em CSV ou JSON, com as mesmas colunas aceitas pela
+    importação (os produtos com SKU podem ser editados e importados de volta).
+    """
+    model = Produto
+    nome_arquivo = 'produtos'
+    colunas = [
+        ('loja', 'loja_id'), ('loja_nome', 'loja__nome'), ('id', 'pk'), ('sku', 'sku'), ('nome', 'nome'),
+        ('preco', 'preco'), ('categoria', 'categoria__nome'), ('descricao', 'descricao'), ('estoque', 'estoque'),
+        ('disponivel', 'disponivel'), ('duracao_minutos', 'duracao_minutos'), ('animal_destino', 'animal_destino'),
+        ('porte_animal', 'porte_animal'), ('idade_animal', 'idade_animal'),
+    ]
+
+
 class CategoriaCreateAjaxView(LoginRequiredMixin, UserPassesTestMixin, View):
     """
     View para criar uma nova categoria via AJAX.